@@ -1,30 +1,41 @@
-from typing import Iterator
+from typing import Iterator, List
 
+from django import forms
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.safestring import SafeText, mark_safe
-from telegram import Bot
 
+from bot.models.bot import Bot
 from bot.models.channel_settings import ChannelSettings
+from bot.models.job import Job
+from bot.models.outbox import Outbox
 from bot.models.reactions import Reaction
 from bot.models.usersettings import UserSettings
 from bot import telegrambot as tb
+from bot.utils.bulk_settings import DIRECTIONS, PATCHABLE_FIELDS, apply_settings, clean_patch, parse_reactions, \
+    preview_settings
+from bot.utils.cache import TTLCache
+from bot.utils.export import export_file_name
+from bot.utils.jobs import enqueue_job
+from bot.utils.media import Fonts
+from bot.utils.reapply import REAPPLY_DEFAULT_POSTS, enqueue_reapply
+from bot.utils.zombies import enqueue_sweep_job
 
 link_template = '<a href="{link}" target={target}>{text}</a>'
 
 
 class AdminHelper:
-    _cached_bots = {}
-
     def resolve_bot_name(self, bot_token: str):
-        if bot_token not in self._cached_bots and tb.my_bot:
-            bot: Bot = next(iter([bot for bot in tb.my_bot.bots if bot.token == bot_token]), None)
-            if bot:
-                me = bot.get_me()
-                self._cached_bots[bot_token] = (me.full_name, me.link)
-        return self._cached_bots.get(bot_token, (None, None))
+        me = tb.my_bot.identity(bot_token) if tb.my_bot else None
+        if not me:
+            return None, None
+        return me.full_name, me.link
 
     def bot_link(self, obj: ChannelSettings or UserSettings) -> SafeText:
         name, url = self.resolve_bot_name(obj.bot_token)
@@ -64,6 +75,12 @@ class UserSettingsAdmin(admin.ModelAdmin, AdminHelper):
                     'modified', 'created']
     list_filter = ['channels']
 
+    def get_queryset(self, request):
+        channels = ChannelSettings.objects.only('id', 'channel_id', 'channel_username', 'channel_title')
+        return super().get_queryset(request) \
+            .select_related('current_channel') \
+            .prefetch_related(Prefetch('channels', queryset=channels))
+
     def current_channel__link(self, obj: UserSettings) -> SafeText or None:
         if obj.current_channel:
             return self.channel_link(obj.current_channel)
@@ -103,19 +120,114 @@ def migrate_to_bot(modeladmin, request, queryset):
 migrate_to_bot.short_description = 'Migrate to new bot'
 
 
+def job_redirect(jobs: List[Job]) -> HttpResponseRedirect:
+    if len(jobs) == 1:
+        return HttpResponseRedirect(reverse('admin:bot_job_change', args=(jobs[0].pk,)))
+    return HttpResponseRedirect(reverse('admin:bot_job_changelist'))
+
+
+def export_reactions_job(queryset, export_format: str) -> HttpResponseRedirect:
+    return job_redirect([enqueue_job('export_reactions', {
+        'channels': list(queryset.values_list('pk', flat=True)),
+        'format': export_format,
+        'file': export_file_name(export_format),
+    })])
+
+
+def export_reactions_csv(modeladmin, request, queryset):
+    return export_reactions_job(queryset, 'csv')
+
+
+def export_reactions_ndjson(modeladmin, request, queryset):
+    return export_reactions_job(queryset, 'ndjson')
+
+
+class BulkSettingsForm(forms.Form):
+    change = forms.MultipleChoiceField(choices=[(field, field.replace('_', ' ').capitalize())
+                                                for field in PATCHABLE_FIELDS],
+                                       widget=forms.CheckboxSelectMultiple, label='Settings to change')
+    caption = forms.CharField(widget=forms.Textarea, required=False)
+    image_caption = forms.CharField(required=False)
+    image_caption_font = forms.ChoiceField(choices=lambda: [(font, font) for font in Fonts], required=False)
+    image_caption_direction = forms.ChoiceField(choices=[(direction, direction) for direction in DIRECTIONS],
+                                                required=False)
+    image_caption_alpha = forms.IntegerField(min_value=0, max_value=100, required=False)
+    reactions = forms.CharField(required=False, help_text='Emojis, leave empty to clear the reactions')
+
+    def clean(self):
+        data = super().clean()
+        patch = {field: data.get(field) for field in data.get('change', [])}
+        if 'reactions' in patch:
+            patch['reactions'] = parse_reactions(patch['reactions'])
+        try:
+            clean_patch(patch)
+        except ValueError as e:
+            raise forms.ValidationError(str(e))
+        data['patch'] = patch
+        return data
+
+
+def edit_settings(modeladmin, request, queryset):
+    """Change settings of all selected channels at once after previewing how many of them change"""
+    submitted = 'preview' in request.POST or 'apply' in request.POST
+    form = BulkSettingsForm(request.POST if submitted else None)
+    changed = None
+    if submitted and form.is_valid():
+        patch = form.cleaned_data['patch']
+        if 'apply' in request.POST:
+            changed = apply_settings(queryset, patch)
+            modeladmin.message_user(request, f'Changed the settings of {changed} channels')
+            return
+        _, changed = preview_settings(queryset, patch)
+
+    return TemplateResponse(request, 'admin/bulk_settings.html', {
+        **modeladmin.admin_site.each_context(request),
+        'opts': modeladmin.model._meta,
+        'form': form,
+        'selected': queryset.values_list('pk', flat=True),
+        'total': queryset.count(),
+        'changed': changed,
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    })
+
+
+def reapply_settings(modeladmin, request, queryset):
+    return job_redirect([enqueue_reapply(channel) for channel in queryset])
+
+
+def sweep_zombies(modeladmin, request, queryset):
+    bot_ids = queryset.order_by().values_list('bot_id', flat=True).distinct()
+    return job_redirect([enqueue_sweep_job(Bot.objects.token_for(bot_id)) for bot_id in bot_ids])
+
+
+export_reactions_csv.short_description = 'Export reaction stats (CSV)'
+export_reactions_ndjson.short_description = 'Export reaction stats (NDJSON)'
+edit_settings.short_description = 'Edit settings'
+reapply_settings.short_description = f'Apply the settings to the last {REAPPLY_DEFAULT_POSTS} posts'
+sweep_zombies.short_description = 'Check all channels and users of their bots for zombies'
+
+
+# The sidebar only needs to be roughly up to date
+_added_by_lookups = TTLCache(ttl=60)
+
+
 class AddedByFilter(admin.SimpleListFilter):
     title = 'Added by'
     parameter_name = 'added_by'
 
     def lookups(self, request, model_admin):
-        users = {}
-        for channel in model_admin.model.objects.all():
-            users.setdefault(channel.added_by.pk, {'name': channel.added_by.name,
-                                                   'total': 0})
-            users[channel.added_by.pk]['total'] += 1
-
-        return sorted([(pk, '%s (%d)' % (data['name'], data['total']))
-                       for pk, data in users.items()], key=lambda i: i[1])
+        lookups = _added_by_lookups.get(model_admin.model)
+        if lookups is None:
+            # One grouped query instead of loading every channel and its creator
+            rows = model_admin.model.objects.exclude(added_by=None).order_by() \
+                .values('added_by', 'added_by__user_id', 'added_by__username', 'added_by__user_fullname') \
+                .annotate(total=Count('pk'))
+            lookups = sorted([(row['added_by'], '%s (%d)' % (UserSettings(
+                user_id=row['added_by__user_id'], username=row['added_by__username'],
+                user_fullname=row['added_by__user_fullname']).name, row['total'])) for row in rows],
+                key=lambda i: i[1])
+            _added_by_lookups.set(model_admin.model, lookups)
+        return lookups
 
     def queryset(self, request, queryset):
         if self.value():
@@ -137,6 +249,9 @@ class ChannelSettingsAdmin(admin.ModelAdmin, AdminHelper):
         ('Captions', {
             'fields': ('caption', 'image_caption', 'image_caption_font', 'image_caption_direction'),
         }),
+        ('Edit Queue', {
+            'fields': ('edit_weight', 'edit_concurrency'),
+        }),
     )
 
     readonly_fields = ['resolved_added_by_user', 'resolved_users']
@@ -146,14 +261,26 @@ class ChannelSettingsAdmin(admin.ModelAdmin, AdminHelper):
         'bot_link', 'reactions', 'modified', 'created'
     ]
     list_filter = [AddedByFilter]
-    actions = [migrate_to_bot]
+    actions = [edit_settings, reapply_settings, migrate_to_bot, export_reactions_csv, export_reactions_ndjson, sweep_zombies]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('added_by').prefetch_related('users')
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        if db_field.name == 'image_caption_font':
+            # The fonts are loaded in the background, so they are listed here instead of in the model's help text
+            kwargs['help_text'] = f'Available fonts: {", ".join(f"<code>{font}</code>" for font in Fonts)}'
+        return super().formfield_for_dbfield(db_field, request, **kwargs)
 
     def channel_tg(self, obj: ChannelSettings) -> SafeText or str:
-        if obj.pure_link:
-            return format_html(link_template, link=obj.pure_link, text=obj.name, target='_blank')
+        link = obj.cached_pure_link
+        if link:
+            return format_html(link_template, link=link, text=obj.name, target='_blank')
         return obj.name
 
     def resolved_added_by_user(self, obj: ChannelSettings) -> SafeText or str:
+        if not obj.added_by:
+            return ''
         return self.user_link(obj.added_by)
 
     def resolved_users(self, obj: ChannelSettings) -> SafeText or str:
@@ -180,13 +307,61 @@ class ReactionsAdmin(admin.ModelAdmin, AdminHelper):
     list_display = ['reaction', 'message', 'resolved_channel_link', 'users__count', 'created']
     list_filter = ['channel']
 
+    def get_queryset(self, request):
+        # A subquery instead of a join with GROUP BY, so that only the rows of the current page are counted
+        users = Reaction.users.through.objects.filter(reaction=OuterRef('pk')).order_by() \
+            .values('reaction').annotate(count=Count('pk')).values('count')
+        return super().get_queryset(request) \
+            .select_related('channel') \
+            .annotate(users__count=Coalesce(Subquery(users), 0))
+
     def resolved_channel_link(self, obj: Reaction) -> SafeText:
+        if not obj.channel:
+            return ''
         return self.channel_link(obj.channel)
 
     def users__count(self, obj):
-        return obj.users.count()
+        return obj.users__count
 
     users__count.admin_order_field = 'users__count'
 
 
 admin.site.register(Reaction, ReactionsAdmin)
+
+
+class OutboxAdmin(admin.ModelAdmin):
+    list_display = ['key', 'operation', 'state', 'attempts', 'available_at', 'last_error', 'modified', 'created']
+    list_filter = ['state', 'operation']
+    search_fields = ['key']
+
+
+admin.site.register(Outbox, OutboxAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'state', 'progress', 'message', 'result_link', 'attempts', 'last_error', 'modified',
+                    'created']
+    list_filter = ['state', 'name']
+    fields = ['name', 'state', 'progress', 'message', 'result_link', 'attempts', 'available_at', '_payload',
+              '_checkpoint', 'last_error', 'modified', 'created']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, obj: Job) -> SafeText:
+        percent = obj.percent
+        total = f' of {obj.total}' if obj.total is not None else ''
+        if percent is None:
+            return format_html('{}{}', obj.done, total)
+        return format_html('<progress value="{}" max="100"></progress> {}{} ({}%)', percent, obj.done, total, percent)
+
+    def result_link(self, obj: Job) -> SafeText or str:
+        if obj.state != Job.DONE or not obj.result:
+            return ''
+        return format_html(link_template, link=reverse('job_result', args=(obj.pk,)), text='Download', target='_self')
+
+    result_link.short_description = 'Result'
+
+
+admin.site.register(Job, JobAdmin)
@@ -4,14 +4,17 @@ import inspect
 import logging
 import pkgutil
 
-from telegram import Bot, Chat, Message, Update, User
+from telegram import Bot, Chat, ChatMember, Message, Update, User
 from telegram.ext import Handler
 
+from bot.models.bot import Bot as BotModel
 from bot.models.channel_settings import ChannelSettings
 from bot.models.usersettings import UserSettings
 from bot.models.media_group import MediaGroup
 from bot.telegrambot import my_bot
+from bot.utils.chat_cache import member_cache
 from bot.utils.internal import get_class_that_defined_method, set_thread_locals, first
+from bot.utils.startup import startup_timer
 
 _plugin_group_index = 0
 
@@ -39,14 +42,19 @@ class BaseCommand:
         self.message = update.effective_message
         self.update = update
         self.bot = my_bot.bot
+        self.bot_id = BotModel.objects.id_for(self.bot.token)
 
         self.user_settings = None
         if self.user:
-            self.user_settings = UserSettings.objects.get_or_create(user_id=self.user.id, bot_token=self.bot.token)[0]
+            self.user_settings = UserSettings.objects.get_or_create(user_id=self.user.id, bot_id=self.bot_id)[0]
             self.user_settings.auto_update_values(self.user, save=True)
 
         try:
-            self.channel_settings = ChannelSettings.objects.get(channel_id=self.chat.id, bot_token=self.bot.token)
+            self.channel_settings = ChannelSettings.objects.get(channel_id=self.chat.id, bot_id=self.bot_id)
+            if self.channel_settings.zombie:
+                # The update proves the bot is back in the channel
+                self.channel_settings.zombie = False
+                ChannelSettings.objects.filter(pk=self.channel_settings.pk).update(zombie=False)
         except ChannelSettings.DoesNotExist:
             pass
 
@@ -55,13 +63,13 @@ class BaseCommand:
         if self.message.media_group_id and self.channel_settings:
             try:
                 self.media_group = MediaGroup.objects.get(media_group_id=self.message.media_group_id,
-                                                          bot_token=self.bot.token)
+                                                          bot_id=self.bot_id)
                 self.media_group_creator = False
             except MediaGroup.DoesNotExist:
                 self.media_group = MediaGroup(media_group_id=self.message.media_group_id,
                                               message_id=self.message.message_id,
                                               channel=self.channel_settings,
-                                              bot_token=self.bot.token)
+                                              bot_id=self.bot_id)
                 self.media_group.save()
                 self.media_group_creator = True
 
@@ -113,6 +121,10 @@ class BaseCommand:
     def home(self):
         BaseCommand._home(self.bot, self.update)
 
+    def get_member(self, chat_id: int, user_id: int = None) -> ChatMember:
+        """Chat member of the current user, cached for a short time to keep menus responsive"""
+        return member_cache.get_member(self.bot, chat_id, user_id or self.user.id)
+
     @staticmethod
     def _set_thread_locals_async_wrapper(func, *args, **kwargs):
         probably_self = first(args)
@@ -179,7 +191,8 @@ for loader, module_name, is_pkg in pkgutil.walk_packages(__path__):
     _plugin_group_index += 1
     __all__.append(module_name)
     if module_name not in globals():
-        _module = loader.find_module(module_name).load_module(module_name)
+        with startup_timer.phase(f'plugin {module_name}'):
+            _module = loader.find_module(module_name).load_module(module_name)
         globals()[module_name] = _module
 
 BaseCommand._check_home_class()
@@ -54,14 +54,14 @@ class AutoCaption(AutoEdit):
     @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='^change_caption:.*$')
     def pre_set_caption(self):
         channel_id = int(self.update.callback_query.data.split(':')[1])
-        member = self.bot.get_chat_member(chat_id=channel_id, user_id=self.user.id)
+        member = self.get_member(channel_id)
 
         if not member.can_change_info and not member.status == member.CREATOR:
             self.message.reply_text('You must have change channel info permissions to change the default caption.')
             return
 
         self.user_settings.current_channel = ChannelSettings.objects.get(channel_id=channel_id,
-                                                                         bot_token=self.bot.token)
+                                                                         bot_id=self.bot_id)
         self.user_settings.state = UserSettings.SET_CAPTION
 
         self.update.callback_query.answer()
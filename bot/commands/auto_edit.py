@@ -1,31 +1,54 @@
+import json
 import os
 from io import BytesIO
 from typing import Generator, Tuple
-from time import sleep
 
-from telegram import File, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, ParseMode, PhotoSize
+from telegram import Bot, File, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, ParseMode, PhotoSize, \
+    Update
 from telegram.ext import Filters, MessageHandler
-from telegram.error import TimedOut, RetryAfter, Unauthorized, BadRequest
+from telegram.error import Unauthorized, BadRequest
 
 from bot.commands import BaseCommand
 from bot.filters import Filters as OwnFilters
+from bot.models.outbox import Outbox
+from bot.models.post import Post
 from bot.models.reactions import Reaction
+from bot.utils.chat_cache import member_cache
+from bot.utils.forward_graph import forward_graph
+from bot.utils.forwarding import auto_edit_key, forward_to_targets, is_album_copy
+from bot.utils.internal import resolve_promise, set_thread_locals
+from bot.utils.load_shedding import SKIP_WATERMARK, load_shedder
 from bot.utils.media import watermark_text
+from bot.utils.outbox import enqueue, outbox_handler
+from bot.utils.scheduler import EDITS, task_scheduler
 from bot import telegrambot as tb
 
 
+def _in_channel_queue(func, entry: Outbox):
+    """Channels take turns in the edits lane, so that a channel posting a hundred photos at once only delays itself"""
+    payload = entry.payload
+    key = ('edit', payload['channel']) if payload.get('channel') else None
+    task_scheduler.submit(EDITS, func, entry, key=key, weight=payload.get('weight', 1),
+                          limit=payload.get('concurrency', 1))
+
+
 class AutoEdit(BaseCommand):
+    skipped_watermark = False
 
-    @BaseCommand.command_wrapper(MessageHandler, filters=OwnFilters.in_channel & (Filters.text | OwnFilters.is_media),
-                                 is_async=True)
+    @BaseCommand.command_wrapper(MessageHandler, filters=OwnFilters.in_channel & (Filters.text | OwnFilters.is_media))
     def auto_edit(self):
         if self.update.edited_message or self.update.edited_channel_post:
             return
+        if self.is_forwarded_copy():
+            # Already processed in the channel it came from, just pass it on
+            self.forward_message()
+            return
         if not self.channel_settings or (
                 not self.channel_settings.caption and
                 not self.channel_settings.image_caption and
                 not self.channel_settings.reactions
         ):
+            self.remember_post(edited=True)
             self.forward_message()
             return
         elif self.message.forward_from_chat:
@@ -36,53 +59,95 @@ class AutoEdit(BaseCommand):
                 self.forward_message()
                 return
 
+        self.remember_post(edited=False)
+        # The edit itself goes through the outbox, so that it survives restarts and is retried on failures
+        enqueue('auto_edit', self.bot.token, auto_edit_key(self.bot_id, self.chat.id, self.message.message_id), {
+            'update': self.update.to_dict(),
+            'media_group_creator': self.media_group_creator,
+            'channel': self.chat.id,
+            'weight': self.channel_settings.edit_weight,
+            'concurrency': self.channel_settings.edit_concurrency,
+        })
+
+    def remember_post(self, edited: bool):
+        """Keep the post as received, unless it was not written in this channel
+
+        Args:
+            edited (:obj:`bool`): Whether the post already is as the current settings would have it
+        """
+        if not self.channel_settings or self.message.forward_from_chat:
+            return
+        Post.objects.get_or_create(channel=self.channel_settings, message_id=self.message.message_id, defaults={
+            '_update': json.dumps(self.update.to_dict()),
+            'media_group_creator': self.media_group_creator,
+            'media_group_id': self.message.media_group_id,
+            'settings_hash': self.channel_settings.settings_hash if edited else None,
+        })
+
+    @staticmethod
+    @outbox_handler('auto_edit', executor=_in_channel_queue, lane=EDITS)
+    def _auto_edit_from_outbox(bot: Bot, payload: dict):
+        update = Update.de_json(payload['update'], bot)
+        set_thread_locals(bot, update)
+
+        instance = AutoEdit(bot, update)
+        instance.media_group_creator = payload['media_group_creator']
+        # A post without its watermark is not up to date, "Apply to Old Posts" adds it later
+        if instance.edit_post() and not instance.skipped_watermark:
+            Post.objects.filter(channel=instance.channel_settings, message_id=instance.message.message_id) \
+                .update(settings_hash=instance.channel_settings.settings_hash)
+
+    def edit_post(self, retroactive: bool = False) -> bool:
+        """Edit the post according to the settings of the channel and forward it, returns whether the edit went through
+
+        Args:
+            retroactive (:obj:`bool`): The post was edited before. Its text and photo are rebuilt from the post as it
+                was received even if the current settings add nothing, so that a removed caption or watermark goes
+                away as well. The post is not forwarded again.
+        """
         text = (self.message.text_html or self.message.caption_html or '').strip()
         caption = self.new_caption(text)
         if caption and not self.media_group_creator:
             text = f'{text}\n\n{caption}'
+        new_text = (caption or retroactive) and not self.media_group_creator
 
         new_reply_markup = self.new_reply_buttons()
         params = {}
         if new_reply_markup:
             params['reply_markup'] = new_reply_markup
 
-        if self.needs_new_image():
+        if self.needs_new_image(retroactive):
             method = self.message.edit_media
-            params.update(dict(media=self.new_image(text, ParseMode.HTML), timeout=60,
+            params.update(dict(media=self.new_image(text, ParseMode.HTML, retroactive), timeout=60,
                                isgroup=self.channel_settings.channel_id))
-        elif not self.message.effective_attachment and caption and not self.media_group_creator:
+        elif not self.message.effective_attachment and new_text:
             method = self.message.edit_text
             params.update(dict(text=text, parse_mode=ParseMode.HTML, timeout=60,
                                isgroup=self.channel_settings.channel_id))
-        elif caption and not self.media_group_creator:
+        elif new_text:
             method = self.message.edit_caption
             params.update(dict(caption=text, parse_mode=ParseMode.HTML, timeout=60,
                                isgroup=self.channel_settings.channel_id))
-        elif new_reply_markup:
+        elif new_reply_markup or retroactive:
             method = self.message.edit_reply_markup
         else:
             self.forward_message()
-            return
+            return True
 
         new_message = None
-        while True:
-            try:
-                promise = method(**params)
-                new_message = promise.result()
-            except Unauthorized:
-                self.leave()
-                pass
-            except BadRequest as e:
-                pass
-            except TimedOut:
-                continue
-            except RetryAfter as e:
-                print(f'Retry message {method.__name__} to {self.channel_settings.name}')
-                sleep(e.retry_after)
-                continue
-            break
-
-        self.forward_message(new_message)
+        try:
+            new_message = resolve_promise(method(**params))
+        except Unauthorized:
+            member_cache.invalidate(self.bot.token, self.chat.id)
+            self.leave()
+        except BadRequest as e:
+            # Also raised if the post already looks like this
+            if 'not modified' in str(e).lower():
+                new_message = self.message
+
+        if not retroactive:
+            self.forward_message(new_message)
+        return new_message is not None
 
     def leave(self):
         self.chat.leave()
@@ -94,25 +159,25 @@ class AutoEdit(BaseCommand):
             pass
 
     @BaseCommand.command_wrapper(MessageHandler,
-                                 filters=OwnFilters.in_channel & (~ (Filters.text | OwnFilters.is_media)),
-                                 is_async=True)
+                                 filters=OwnFilters.in_channel & (~ (Filters.text | OwnFilters.is_media)))
     def forward_message(self, message=None):
         if self.update.edited_message or self.update.edited_channel_post:
             return
-        if not self.channel_settings or not self.channel_settings.forward_to:
+        if not self.channel_settings:
             return
-        message = message or self.message
-        while True:
-            try:
-                message.forward(int(self.channel_settings.forward_to))
-            except Unauthorized:
-                pass
-            except TimedOut:
-                continue
-            except RetryAfter as e:
-                sleep(e.retry_after)
-                continue
-            break
+        targets = forward_graph.targets(self.bot.token, self.channel_settings.channel_id)
+        forward_to_targets(message or self.message, targets)
+
+    def is_forwarded_copy(self) -> bool:
+        origin = self.message.forward_from_chat
+        if origin and origin.id == self.chat.id:
+            # A copy which came back to where it was posted, passing it on again would loop
+            return False
+        if origin:
+            return forward_graph.is_upstream(self.bot.token, origin.id, self.chat.id)
+        # Albums are sent on as copies, which have no origin
+        return bool(self.message.media_group_id) and forward_graph.is_target(self.bot.token, self.chat.id) \
+            and is_album_copy(self.message)
 
     def new_caption(self, text) -> str or None:
         caption = (self.channel_settings.caption or '').strip()
@@ -121,18 +186,28 @@ class AutoEdit(BaseCommand):
             return
         return caption
 
-    def needs_new_image(self) -> bool:
+    def needs_new_image(self, retroactive: bool = False) -> bool:
         if not self.message.effective_attachment or not isinstance(self.message.effective_attachment, list):
             return False
         attachment = (self.message.effective_attachment or [None])[-1]
-        return self.channel_settings.image_caption and isinstance(attachment, PhotoSize)
+        if not isinstance(attachment, PhotoSize):
+            return False
+        if self.channel_settings.image_caption and not retroactive and load_shedder.sheds(SKIP_WATERMARK):
+            # Rendering backs up first under load, the post still gets its caption and reactions now
+            self.skipped_watermark = True
+            return False
+        return bool(self.channel_settings.image_caption or retroactive)
 
-    def new_image(self, caption: str = None, parse_mode: str = None) -> InputMediaPhoto or None:
-        if not self.channel_settings.image_caption:
-            return
+    def new_image(self, caption: str = None, parse_mode: str = None,
+                  retroactive: bool = False) -> InputMediaPhoto or None:
         attachment = (self.message.effective_attachment or [None])[-1]
-        if isinstance(attachment, PhotoSize):
+        if not isinstance(attachment, PhotoSize):
+            return
+        if self.channel_settings.image_caption:
             return InputMediaPhoto(self.watermark_photo(attachment), caption=caption, parse_mode=parse_mode)
+        elif retroactive:
+            # The photo as it was received
+            return InputMediaPhoto(attachment.file_id, caption=caption, parse_mode=parse_mode)
 
     def watermark_photo(self, photo: PhotoSize) -> BytesIO:
         direction = self.channel_settings.image_caption_direction
@@ -174,7 +249,7 @@ class AutoEdit(BaseCommand):
     def get_reactions(self) -> Generator[Tuple[str, int], None, None]:
         for emoji in self.channel_settings.reactions:
             reaction = Reaction.objects.get_or_create(
-                bot_token=self.bot.token,
+                bot_id=self.bot_id,
                 reaction=emoji,
                 message=self.message.message_id,
                 channel=self.channel_settings
@@ -9,6 +9,8 @@ from bot.filters import Filters as OwnFilters
 from bot.models.channel_settings import ChannelSettings
 from bot.models.usersettings import UserSettings
 from bot.utils.chat import channel_selector_menu
+from bot.utils.chat_cache import chat_cache
+from bot.utils.forward_graph import forward_graph
 
 
 class AutoForward(AutoEdit):
@@ -32,13 +34,13 @@ class AutoForward(AutoEdit):
     @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='^forward_from:.*$')
     def set_forwader_from_menu(self):
         channel_id = int(self.update.callback_query.data.split(':')[1])
-        member = self.bot.get_chat_member(chat_id=channel_id, user_id=self.user.id)
+        member = self.get_member(channel_id)
 
         if not member.can_change_info and not member.status == member.CREATOR:
             self.message.reply_text('You must have change channel info permissions.')
             return
 
-        from_channel = ChannelSettings.objects.get(channel_id=channel_id, bot_token=self.bot.token)
+        from_channel = ChannelSettings.objects.get(channel_id=channel_id, bot_id=self.bot_id)
         self.user_settings.current_channel = from_channel
         self.user_settings.state = UserSettings.SET_FORWARDER_TO
 
@@ -46,11 +48,15 @@ class AutoForward(AutoEdit):
 
         menu = channel_selector_menu(self.user_settings, f'forward_to:{channel_id}')
 
+        forward_to = list(from_channel.forward_to.all())
+        forward_from = list(from_channel.forward_from.all())
+        chat_cache.prefetch_links(self.bot, [channel.channel_id for channel in [from_channel] + forward_to + forward_from])
+
         connections = []
-        if from_channel.forward_to:
-            connections.append(f'{from_channel.link} :arrow_right: {from_channel.forward_to.link}')
+        for channel in forward_to:
+            connections.append(f'{from_channel.link} :arrow_right: {channel.link}')
 
-        for channel in from_channel.forward_from.all():
+        for channel in forward_from:
             connections.append(f'{from_channel.link} :arrow_left: {channel.link}')
 
         if connections:
@@ -66,7 +72,7 @@ class AutoForward(AutoEdit):
         channels = self.update.callback_query.data.split(':')
         channel_from_id, channel_to_id = int(channels[1]), int(channels[2])
 
-        member_to = self.bot.get_chat_member(chat_id=channel_to_id, user_id=self.user.id)
+        member_to = self.get_member(channel_to_id)
 
         if (not member_to.can_send_messages
                 and not member_to.can_post_messages
@@ -74,12 +80,19 @@ class AutoForward(AutoEdit):
             self.message.reply_text('You must have permissions to send messages.')
             return
 
-        from_channel = ChannelSettings.objects.get(channel_id=channel_from_id, bot_token=self.bot.token)
-        to_channel = ChannelSettings.objects.get(channel_id=channel_to_id, bot_token=self.bot.token)
+        from_channel = ChannelSettings.objects.get(channel_id=channel_from_id, bot_id=self.bot_id)
+        to_channel = ChannelSettings.objects.get(channel_id=channel_to_id, bot_id=self.bot_id)
 
-        from_channel.forward_to = to_channel
-        from_channel.save()
+        if from_channel.forward_to.filter(pk=to_channel.pk).exists():
+            from_channel.forward_to.remove(to_channel)
+            message = f'Messages from {from_channel.link} are no longer forwarded to {to_channel.link}'
+        elif forward_graph.creates_cycle(self.bot.token, from_channel.channel_id, to_channel.channel_id):
+            self.message.reply_html(f'Messages from {to_channel.link} already end up in {from_channel.link}, '
+                                    f'forwarding them back would create a loop.', disable_web_page_preview=True)
+            return
+        else:
+            from_channel.forward_to.add(to_channel)
+            message = f'Messages from {from_channel.link} are now forwarded to {to_channel.link}'
 
-        self.message.reply_html(f'Messages from {from_channel.link} are now forwarded to {to_channel.link}',
-                                disable_web_page_preview=True)
+        self.message.reply_html(message, disable_web_page_preview=True)
         self.home()
@@ -77,7 +77,7 @@ class AutoImageCaption(AutoEdit):
         else:
             channel_id = self.user_settings.current_channel.channel_id
 
-        member = self.bot.get_chat_member(chat_id=channel_id, user_id=self.user.id)
+        member = self.get_member(channel_id)
 
         if not member.can_change_info and not member.status == member.CREATOR:
             self.message.reply_text('You must have change channel info permissions '
@@ -85,7 +85,7 @@ class AutoImageCaption(AutoEdit):
             return
 
         self.user_settings.current_channel = ChannelSettings.objects.get(channel_id=channel_id,
-                                                                         bot_token=self.bot.token)
+                                                                         bot_id=self.bot_id)
         self.user_settings.state = UserSettings.SET_IMAGE_CAPTION_NEXT
 
         kwargs = {
@@ -210,7 +210,7 @@ class AutoImageCaption(AutoEdit):
 
     @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='change_image_caption$')
     def pre_set_caption(self):
-        member = self.bot.get_chat_member(chat_id=self.user_settings.current_channel.channel_id, user_id=self.user.id)
+        member = self.get_member(self.user_settings.current_channel.channel_id)
 
         if not member.can_change_info and not member.status == member.CREATOR:
             self.message.reply_text('You must have change channel info permissions '
@@ -232,7 +232,7 @@ class AutoImageCaption(AutoEdit):
 
     @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='change_image_caption_alpha')
     def pre_set_caption_alpha(self):
-        member = self.bot.get_chat_member(chat_id=self.user_settings.current_channel.channel_id, user_id=self.user.id)
+        member = self.get_member(self.user_settings.current_channel.channel_id)
 
         if not member.can_change_info and not member.status == member.CREATOR:
             self.message.reply_text('You must have change channel info permissions '
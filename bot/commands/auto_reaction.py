@@ -25,7 +25,7 @@ class AutoReaction(AutoEdit):
         _, message_id, emoji = data.split(':')
         try:
             reactions = Reaction.objects.filter(message=message_id, channel=self.channel_settings,
-                                                bot_token=self.bot.token)
+                                                bot_id=self.bot_id)
 
             clicked = reactions.get(reaction=emoji)
         except Exception:
@@ -80,14 +80,14 @@ class AutoReaction(AutoEdit):
     @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='^change_reactions:.*$')
     def pre_set_reaction(self):
         channel_id = int(self.update.callback_query.data.split(':')[1])
-        member = self.bot.get_chat_member(chat_id=channel_id, user_id=self.user.id)
+        member = self.get_member(channel_id)
 
         if not member.can_change_info and not member.status == member.CREATOR:
             self.message.reply_text('You must have change channel info permissions to change the reactions.')
             return
 
         self.user_settings.current_channel = ChannelSettings.objects.get(channel_id=channel_id,
-                                                                         bot_token=self.bot.token)
+                                                                         bot_id=self.bot_id)
         self.user_settings.state = UserSettings.SET_REACTIONS
 
         self.update.callback_query.answer()
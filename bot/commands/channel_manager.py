@@ -1,12 +1,21 @@
 from telegram import Chat, InlineKeyboardButton, ReplyKeyboardMarkup, ParseMode
-from telegram.error import Unauthorized
+from telegram.error import BadRequest, Unauthorized
 from telegram.ext import CallbackQueryHandler, Filters, MessageHandler
 
 from bot.commands import BaseCommand
 from bot.filters import Filters as OwnFilters
 from bot.models.channel_settings import ChannelSettings
 from bot.models.usersettings import UserSettings
-from bot.utils.chat import build_menu, channel_selector_menu, check_bot_permissions, check_user_permissions
+from bot.utils.chat import (CHANNEL_PAGE, build_menu, channel_selector_menu, channel_selector_page,
+                            check_bot_permissions, check_user_permissions, invalidate_channel_menus)
+from bot.utils.chat_cache import chat_cache
+from bot.utils.jobs import active_job
+from bot.utils.load_shedding import REJECT_BACKGROUND, load_shedder
+from bot.utils.rate_limit import RateLimiter
+from bot.utils.reapply import enqueue_reapply
+
+# Chat lookups per second and bot when an admin updates their channels
+update_channels_limiter = RateLimiter(rate=20, per=1, burst=10)
 
 
 class ChannelManager(BaseCommand):
@@ -28,9 +37,9 @@ class ChannelManager(BaseCommand):
 
         created = False
         try:
-            channel = ChannelSettings.objects.get(channel_id=possible_channel.id, bot_token=self.bot.token)
+            channel = ChannelSettings.objects.get(channel_id=possible_channel.id, bot_id=self.bot_id)
         except ChannelSettings.DoesNotExist:
-            channel = ChannelSettings.objects.create(channel_id=possible_channel.id, bot_token=self.bot.token)
+            channel = ChannelSettings.objects.create(channel_id=possible_channel.id, bot_id=self.bot_id)
             channel.added_by = self.user_settings
             created = True
 
@@ -61,18 +70,49 @@ class ChannelManager(BaseCommand):
         self.message.reply_text('Here you can find global settings.', reply_markup=ReplyKeyboardMarkup([['Cancel']]))
         self.message.reply_text('What do you want to do?', reply_markup=menu)
 
-    @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='^update_channels$')
+    @BaseCommand.command_wrapper(CallbackQueryHandler, is_async=True, pattern='^update_channels$')
     def update_channels(self):
-        channels = self.user_settings.channels.all()
+        self.update.callback_query.answer('Updating channels...')
+
+        channels = list(self.user_settings.channels.only('id', 'channel_id', 'channel_username', 'channel_title',
+                                                          'zombie', 'bot'))
         if not channels:
             self.message.reply_text('No channels added yet.')
             return
 
+        results = chat_cache.fetch_many(self.bot, [channel.channel_id for channel in channels],
+                                        limiter=update_channels_limiter)
+        changed = []
+        failed = []
         for channel in channels:
-            if not channel.auto_update_values():
-                self.message.reply_text(f'Channel {channel.name} could not be updated')
-
-        self.message.reply_text('Channels updated')
+            chat = results.get(channel.channel_id)
+            if not isinstance(chat, Chat):
+                if isinstance(chat, (Unauthorized, BadRequest)) and not channel.zombie:
+                    channel.zombie = True
+                    changed.append(channel)
+                failed.append(channel.name)
+                continue
+
+            values = (channel.channel_username, channel.channel_title, channel.zombie)
+            channel.auto_update_values(chat=chat, save=False)
+            if values != (channel.channel_username, channel.channel_title, channel.zombie):
+                changed.append(channel)
+
+        ChannelSettings.objects.bulk_update(changed, ['channel_username', 'channel_title', 'zombie'])
+        if changed:
+            invalidate_channel_menus(ChannelSettings.users.through.objects.filter(channelsettings__in=changed)
+                                     .values_list('usersettings_id', flat=True))
+
+        summary = f'Channels updated: {len(channels) - len(failed)} of {len(channels)}'
+        if failed:
+            summary += '\nCould not be updated: ' + ', '.join(failed)
+        self.message.reply_text(summary)
+
+    @BaseCommand.command_wrapper(CallbackQueryHandler, pattern=f'^{CHANNEL_PAGE}:.*$')
+    def switch_channel_page(self):
+        menu = channel_selector_page(self.user_settings, self.update.callback_query.data, self.message.reply_markup)
+        if menu:
+            self.message.edit_reply_markup(reply_markup=menu)
         self.update.callback_query.answer()
 
     @BaseCommand.command_wrapper(CallbackQueryHandler, pattern='^change_settings_menu:.*$')
@@ -83,7 +123,8 @@ class ChannelManager(BaseCommand):
         self.user_settings.current_channel_id = channel_id
         self.user_settings.state = UserSettings.CHANNEL_SETTINGS_MENU
 
-        buttons = ReplyKeyboardMarkup(build_menu('Remove', 'Remove Forwarders', footer_buttons=['Back', 'Cancel']))
+        buttons = ReplyKeyboardMarkup(build_menu('Remove', 'Remove Forwarders', 'Apply to Old Posts',
+                                                 footer_buttons=['Back', 'Cancel']))
         self.message.reply_text(f'Settings for {self.user_settings.current_channel.name}', reply_markup=buttons)
 
     @BaseCommand.command_wrapper(MessageHandler, filters=(OwnFilters.text_is('Remove') &
@@ -106,10 +147,30 @@ class ChannelManager(BaseCommand):
     @BaseCommand.command_wrapper(MessageHandler, filters=(OwnFilters.text_is('Remove Forwarders') &
                                                           OwnFilters.state_is(UserSettings.CHANNEL_SETTINGS_MENU)))
     def remove_forwarders(self):
-        self.user_settings.current_channel.forward_to = None
-        self.user_settings.current_channel.save()
+        self.user_settings.current_channel.forward_to.clear()
         self.message.reply_text('Forwarders removed')
 
+    @BaseCommand.command_wrapper(MessageHandler, filters=(OwnFilters.text_is('Apply to Old Posts') &
+                                                          OwnFilters.state_is(UserSettings.CHANNEL_SETTINGS_MENU)))
+    def reapply_settings(self):
+        channel = self.user_settings.current_channel
+        member = self.get_member(channel.channel_id)
+        if not member.can_edit_messages and not member.status == member.CREATOR:
+            self.message.reply_text('You must have edit messages permissions to change old posts.')
+            return
+
+        if load_shedder.sheds(REJECT_BACKGROUND):
+            self.message.reply_text('I am busy with new posts right now, please try again in a few minutes.')
+            return
+
+        if active_job('reapply_settings', channel=channel.pk):
+            self.message.reply_text(f'The settings of {channel.name} are already being applied to its last posts.')
+            return
+
+        job = enqueue_reapply(channel)
+        self.message.reply_text(f'The current settings of {channel.name} will be applied to its last {job.total} '
+                                f'posts. This happens slowly in the background so that new posts are not held up.')
+
     @BaseCommand.command_wrapper(MessageHandler, filters=OwnFilters.state_is(UserSettings.PRE_REMOVE_CHANNEL))
     def remove_channel_confirmation(self):
         if self.message.text.lower() == 'yes':
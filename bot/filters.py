@@ -3,6 +3,7 @@ from typing import List
 from telegram import Chat
 from telegram.ext import BaseFilter
 
+from bot.models.bot import Bot
 from bot.models.channel_settings import ChannelSettings
 from bot.models.usersettings import UserSettings
 from bot.utils.chat import is_media_message
@@ -48,7 +49,8 @@ class Filters:
         name = 'Filters.text_is_channel'
 
         def filter(self, message):
-            return message.text in list(map(lambda obj: obj.name, ChannelSettings.objects.get(bot_token=my_bot.token)))
+            channels = ChannelSettings.objects.filter(bot_id=Bot.objects.id_for(my_bot.token))
+            return message.text in list(map(lambda obj: obj.name, channels))
 
     text_is_channel = _TextIsChannel()
     """:obj:`Filter`: Message text is name of channel."""
@@ -64,7 +66,8 @@ class Filters:
                 if not message.from_user:
                     return False
                 try:
-                    user = UserSettings.objects.get(user_id=message.from_user.id, bot_token=my_bot.token)
+                    user = UserSettings.objects.get(user_id=message.from_user.id,
+                                                    bot_id=Bot.objects.id_for(my_bot.token))
                 except UserSettings.DoesNotExist:
                     return False
                 return user.state == state
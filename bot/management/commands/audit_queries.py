@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.utils.query_audit import ADMIN_QUERY_CAP, SEQ_SCAN_THRESHOLD, audit
+
+
+class Command(BaseCommand):
+    help = ('Seed a realistic amount of data, explain the queries of the commands and the admin and fail on sequential '
+            'scans of big tables or admin pages which take too many queries. Everything is rolled back afterwards, run '
+            'it against a local database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help='Factor for the amount of seeded rows')
+        parser.add_argument('--threshold', type=int, default=SEQ_SCAN_THRESHOLD,
+                            help='Tables with more rows than this must not be scanned sequentially')
+        parser.add_argument('--query-cap', type=int, default=ADMIN_QUERY_CAP,
+                            help='Queries a page of an admin changelist may take')
+
+    def handle(self, *args, scale=1, threshold=SEQ_SCAN_THRESHOLD, query_cap=ADMIN_QUERY_CAP, **options):
+        failed = []
+        for result in audit(scale, threshold, query_cap):
+            if 'queries' in result:
+                line = f'{result["query"]}: {result["queries"]} queries'
+            else:
+                scans = ', '.join(f'{table} ({rows} rows)' for table, rows in result['seq_scans'].items())
+                line = f'{result["query"]}: {scans or "no sequential scans"}'
+            if result['ok']:
+                self.stdout.write(self.style.SUCCESS(f'OK   {line}'))
+            else:
+                self.stdout.write(self.style.ERROR(f'FAIL {line}'))
+                failed.append(result['query'])
+
+        if failed:
+            raise CommandError(f'Failed: {", ".join(failed)}')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.models.channel_settings import ChannelSettings
+from bot.utils.export import EXPORT_FORMATS, export_reactions
+
+
+class Command(BaseCommand):
+    help = 'Stream per channel and message reaction counts as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', dest='channels', type=int, action='append',
+                            help='Telegram channel id to export, can be given multiple times. Defaults to all channels')
+        parser.add_argument('--bot-token', help='Only export channels of this bot')
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write to, defaults to stdout')
+
+    def handle(self, *args, channels=None, bot_token=None, export_format='csv', output=None, **options):
+        queryset = None
+        if channels or bot_token:
+            queryset = ChannelSettings.objects.all()
+            if channels:
+                queryset = queryset.filter(channel_id__in=[-abs(channel) for channel in channels])
+            if bot_token:
+                queryset = queryset.filter(bot__token=bot_token)
+            if not queryset.exists():
+                raise CommandError('No channels found')
+
+        chunks = export_reactions(queryset, export_format)
+        if not output:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(output, 'w', newline='') as file:
+            for chunk in chunks:
+                file.write(chunk)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from bot.utils import bot_migration, export, reapply, zombies  # noqa, imported for the job handlers they register
+from bot.utils.jobs import job_runner
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs, like bot migrations, exports, zombie sweeps and settings applied to old posts. '
+            'Keep this running next to the web server, interrupted jobs are continued from their last checkpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of jobs to run at the same time')
+
+    def handle(self, *args, workers=2, **options):
+        job_runner.start(workers)
+        self.stdout.write(f'Running jobs on {workers} workers')
+        job_runner.join()
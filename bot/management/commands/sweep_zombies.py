@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot import telegrambot as tb
+from bot.models.channel_settings import ChannelSettings
+from bot.models.usersettings import UserSettings
+from bot.utils.zombies import sweep_model
+
+
+class Command(BaseCommand):
+    help = 'Check all channels and users right away and update their zombie flags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bot-token', help='Only sweep this bot')
+
+    def handle(self, *args, bot_token=None, **options):
+        bots = [tb.my_bot.get_bot(bot_token)] if bot_token else tb.my_bot.bots
+        if not all(bots):
+            raise CommandError('Bot not found')
+
+        for bot in bots:
+            channels = sweep_model(bot, ChannelSettings, 'channel_id')
+            users = sweep_model(bot, UserSettings, 'user_id')
+            self.stdout.write(f'[{bot.token}] {channels} channels and {users} users changed')
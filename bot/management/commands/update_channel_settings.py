@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.models.bot import Bot
+from bot.models.channel_settings import ChannelSettings
+from bot.utils.bulk_settings import DIRECTIONS, apply_settings, parse_reactions, preview_settings
+
+
+class Command(BaseCommand):
+    help = ('Change settings of many channels with a single update. Shows how many channels would change, pass --yes '
+            'to apply the change.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bot-token', help='Only channels of this bot')
+        parser.add_argument('--channel-ids', type=int, nargs='+', help='Only these channels (telegram ids)')
+        parser.add_argument('--added-by', type=int, help='Only channels added by this user (telegram id)')
+        parser.add_argument('--all', action='store_true', help='All channels, needed when no other filter is given')
+
+        parser.add_argument('--caption', help='Caption, an empty string clears it')
+        parser.add_argument('--image-caption', help='Watermark text, an empty string clears it')
+        parser.add_argument('--image-caption-font')
+        parser.add_argument('--image-caption-direction', choices=DIRECTIONS)
+        parser.add_argument('--image-caption-alpha', type=int, help='Opacity of the watermark from 0 to 100')
+        parser.add_argument('--reactions', help='Emojis, an empty string clears the reactions')
+
+        parser.add_argument('--yes', action='store_true', help='Apply the change instead of only showing the preview')
+
+    def handle(self, *args, bot_token=None, channel_ids=None, added_by=None, all=False, yes=False, **options):
+        channels = ChannelSettings.objects.all()
+        if bot_token:
+            channels = channels.filter(bot_id=Bot.objects.id_for(bot_token, create=False))
+        if channel_ids:
+            channels = channels.filter(channel_id__in=channel_ids)
+        if added_by:
+            channels = channels.filter(added_by__user_id=added_by)
+        if not (bot_token or channel_ids or added_by or all):
+            raise CommandError('Select channels with --bot-token, --channel-ids or --added-by, or pass --all')
+
+        patch = {field: options[field] for field in ('caption', 'image_caption', 'image_caption_font',
+                                                     'image_caption_direction', 'image_caption_alpha', 'reactions')
+                 if options[field] is not None}
+        if 'reactions' in patch:
+            patch['reactions'] = parse_reactions(patch['reactions'])
+        if not patch:
+            raise CommandError('Nothing to change')
+
+        try:
+            total, changed = preview_settings(channels, patch)
+            if not yes:
+                self.stdout.write(f'{changed} of {total} channels would change, pass --yes to apply')
+                return
+            changed = apply_settings(channels, patch)
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(f'Changed the settings of {changed} of {total} channels'))
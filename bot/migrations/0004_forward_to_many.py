@@ -0,0 +1,53 @@
+# Generated by Django 2.2.15 on 2026-10-19 00:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_forwarders(apps, schema_editor):
+    ChannelSettings = apps.get_model('bot', 'ChannelSettings')
+    Through = ChannelSettings.forward_to.through
+
+    Through.objects.bulk_create([
+        Through(from_channelsettings_id=channel_id, to_channelsettings_id=target_id)
+        for channel_id, target_id in ChannelSettings.objects.filter(old_forward_to__isnull=False)
+                                                            .values_list('pk', 'old_forward_to')
+    ])
+
+
+def restore_forwarders(apps, schema_editor):
+    ChannelSettings = apps.get_model('bot', 'ChannelSettings')
+    Through = ChannelSettings.forward_to.through
+
+    for channel_id, target_id in Through.objects.values_list('from_channelsettings_id', 'to_channelsettings_id'):
+        ChannelSettings.objects.filter(pk=channel_id).update(old_forward_to=target_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_remove_mediagroup_edited'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='channelsettings',
+            old_name='forward_to',
+            new_name='old_forward_to',
+        ),
+        migrations.AlterField(
+            model_name='channelsettings',
+            name='old_forward_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='bot.ChannelSettings'),
+        ),
+        migrations.AddField(
+            model_name='channelsettings',
+            name='forward_to',
+            field=models.ManyToManyField(blank=True, related_name='forward_from', to='bot.ChannelSettings'),
+        ),
+        migrations.RunPython(copy_forwarders, restore_forwarders),
+        migrations.RemoveField(
+            model_name='channelsettings',
+            name='old_forward_to',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.15 on 2026-10-19 00:52
+
+from django.db import migrations, models
+import django.utils.timezone
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_forward_to_many'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Outbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('key', models.CharField(help_text='Idempotency key', max_length=255, unique=True)),
+                ('bot_token', models.CharField(max_length=200)),
+                ('operation', models.CharField(max_length=50)),
+                ('_payload', models.TextField(blank=True, null=True)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Outbox',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outbox',
+            index=models.Index(fields=['state', 'available_at'], name='outbox_state_available'),
+        ),
+    ]
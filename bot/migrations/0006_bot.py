@@ -0,0 +1,68 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('token', models.CharField(max_length=200, unique=True)),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='channelsettings',
+            name='bot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='channels', to='bot.Bot'),
+        ),
+        migrations.AddField(
+            model_name='usersettings',
+            name='bot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='users', to='bot.Bot'),
+        ),
+        migrations.AddField(
+            model_name='reaction',
+            name='bot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reactions', to='bot.Bot'),
+        ),
+        migrations.AddField(
+            model_name='mediagroup',
+            name='bot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='media_groups', to='bot.Bot'),
+        ),
+        # Nullable so that the migrations can be reverted, the tokens are only restored by 0007
+        migrations.AlterField(
+            model_name='channelsettings',
+            name='bot_token',
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='usersettings',
+            name='bot_token',
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='reaction',
+            name='bot_token',
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mediagroup',
+            name='bot_token',
+            field=models.CharField(max_length=200, null=True),
+        ),
+    ]
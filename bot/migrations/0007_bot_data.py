@@ -0,0 +1,55 @@
+from django.db import migrations, transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+
+MODELS = ('ChannelSettings', 'UserSettings', 'Reaction', 'MediaGroup')
+# Rows updated per transaction, keeps locks and the WAL of a single transaction small on big tables
+BATCH_SIZE = 5000
+
+
+def _batches(model):
+    bounds = model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+        yield model.objects.filter(pk__gte=start, pk__lt=start + BATCH_SIZE)
+
+
+def fill_bots(apps, schema_editor):
+    Bot = apps.get_model('bot', 'Bot')
+
+    tokens = set()
+    for model_name in MODELS:
+        model = apps.get_model('bot', model_name)
+        tokens.update(model.objects.order_by().values_list('bot_token', flat=True).distinct())
+    for token in filter(None, tokens):
+        Bot.objects.get_or_create(token=token)
+
+    for model_name in MODELS:
+        model = apps.get_model('bot', model_name)
+        for batch in _batches(model):
+            with transaction.atomic():
+                batch.filter(bot__isnull=True) \
+                    .update(bot_id=Subquery(Bot.objects.filter(token=OuterRef('bot_token')).values('pk')[:1]))
+
+
+def restore_tokens(apps, schema_editor):
+    Bot = apps.get_model('bot', 'Bot')
+
+    for model_name in MODELS:
+        model = apps.get_model('bot', model_name)
+        for batch in _batches(model):
+            with transaction.atomic():
+                batch.update(bot_token=Subquery(Bot.objects.filter(pk=OuterRef('bot_id')).values('token')[:1]))
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed on its own, an interrupted run continues where it stopped
+    atomic = False
+
+    dependencies = [
+        ('bot', '0006_bot'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_bots, restore_tokens),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_bot_data'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='channelsettings',
+            name='channel_bot_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='usersettings',
+            name='user_bot_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='mediagroup',
+            name='mediagroup_bot_unique',
+        ),
+        migrations.RemoveField(
+            model_name='channelsettings',
+            name='bot_token',
+        ),
+        migrations.RemoveField(
+            model_name='usersettings',
+            name='bot_token',
+        ),
+        migrations.RemoveField(
+            model_name='reaction',
+            name='bot_token',
+        ),
+        migrations.RemoveField(
+            model_name='mediagroup',
+            name='bot_token',
+        ),
+        migrations.AlterField(
+            model_name='channelsettings',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='channels', to='bot.Bot'),
+        ),
+        migrations.AlterField(
+            model_name='usersettings',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='users', to='bot.Bot'),
+        ),
+        migrations.AlterField(
+            model_name='reaction',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reactions', to='bot.Bot'),
+        ),
+        migrations.AlterField(
+            model_name='mediagroup',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='media_groups', to='bot.Bot'),
+        ),
+        migrations.AddConstraint(
+            model_name='channelsettings',
+            constraint=models.UniqueConstraint(fields=('channel_id', 'bot'), name='channel_bot_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='usersettings',
+            constraint=models.UniqueConstraint(fields=('user_id', 'bot'), name='user_bot_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='mediagroup',
+            constraint=models.UniqueConstraint(fields=('media_group_id', 'bot'), name='mediagroup_bot_unique'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_remove_bot_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outbox',
+            index=models.Index(fields=['state', 'modified'], name='outbox_state_modified'),
+        ),
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['channel', 'message', 'reaction'], name='reaction_channel_message'),
+        ),
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['-modified', '-created'], name='reaction_modified'),
+        ),
+    ]
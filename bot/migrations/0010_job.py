@@ -0,0 +1,43 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:13
+
+from django.db import migrations, models
+import django.utils.timezone
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('name', models.CharField(max_length=50)),
+                ('_payload', models.TextField(blank=True, null=True)),
+                ('_checkpoint', models.TextField(blank=True, help_text='Where to continue after a restart', null=True)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('done', models.IntegerField(default=0)),
+                ('total', models.IntegerField(blank=True, null=True)),
+                ('message', models.TextField(blank=True, null=True)),
+                ('result', models.CharField(blank=True, help_text='File the job produced', max_length=255, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['state', 'available_at'], name='job_state_available'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Post',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('message_id', models.BigIntegerField()),
+                ('media_group_creator', models.BooleanField(null=True)),
+                ('_update', models.TextField()),
+                ('settings_hash', models.CharField(blank=True, help_text='Settings the post was last edited with, empty while pending', max_length=40, null=True)),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='channel',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posts', to='bot.ChannelSettings'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created'], name='post_created'),
+        ),
+        migrations.AddConstraint(
+            model_name='post',
+            constraint=models.UniqueConstraint(fields=('channel', 'message_id'), name='post_channel_message_unique'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channelsettings',
+            name='edit_concurrency',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Posts of the channel which may be edited at the same time'),
+        ),
+        migrations.AddField(
+            model_name='channelsettings',
+            name='edit_weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Posts edited per turn when several channels are waiting, see bot.utils.scheduler'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:25
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_edit_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('key', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='processedupdate',
+            index=models.Index(fields=['created'], name='processed_update_created'),
+        ),
+    ]
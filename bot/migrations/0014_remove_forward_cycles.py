@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def remove_forward_cycles(apps, schema_editor):
+    """Forwarders copied from the single forward_to field may form loops like A -> B -> A, which the bot no longer
+    allows to be set up. The forwarder which closes a loop is removed, the older ones are kept."""
+    ChannelSettings = apps.get_model('bot', 'ChannelSettings')
+    Through = ChannelSettings.forward_to.through
+
+    targets = {}
+    closing = []
+
+    def reaches(source, channel):
+        seen = set()
+        todo = [source]
+        while todo:
+            for target in targets.get(todo.pop(), ()):
+                if target == channel:
+                    return True
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+        return False
+
+    for pk, source, target in Through.objects.order_by('pk') \
+            .values_list('pk', 'from_channelsettings_id', 'to_channelsettings_id'):
+        if source == target or reaches(target, source):
+            closing.append(pk)
+        else:
+            targets.setdefault(source, set()).add(target)
+
+    Through.objects.filter(pk__in=closing).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_processed_update'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_forward_cycles, migrations.RunPython.noop),
+    ]
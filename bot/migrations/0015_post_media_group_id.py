@@ -0,0 +1,22 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_remove_forward_cycles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='media_group_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['channel', 'media_group_id'], name='post_channel_media_group'),
+        ),
+    ]
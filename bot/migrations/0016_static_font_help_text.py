@@ -0,0 +1,18 @@
+# Generated by Django 2.2.15 on 2026-10-19 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0015_post_media_group_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='channelsettings',
+            name='image_caption_font',
+            field=models.TextField(default='default', help_text='Id of one of the AVAILABLE_FONTS, the admin lists them'),
+        ),
+    ]
@@ -0,0 +1,11 @@
+# Every model is imported here, otherwise models which only the bot's plugins use are missing from the app registry in
+# processes which don't load the plugins, and makemigrations would drop their tables
+from bot.models.bot import Bot  # noqa
+from bot.models.channel_settings import ChannelSettings  # noqa
+from bot.models.job import Job  # noqa
+from bot.models.media_group import MediaGroup  # noqa
+from bot.models.outbox import Outbox  # noqa
+from bot.models.post import Post  # noqa
+from bot.models.processed_update import ProcessedUpdate  # noqa
+from bot.models.reactions import Reaction  # noqa
+from bot.models.usersettings import UserSettings  # noqa
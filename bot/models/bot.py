@@ -0,0 +1,67 @@
+import threading
+from typing import Dict
+
+from django.db import models
+from django_extensions.db.models import TimeStampedModel
+
+
+class BotManager(models.Manager):
+    """Resolves tokens to primary keys and back
+
+    Neither changes once a row exists, so both directions are cached for the lifetime of the process.
+    """
+    _lock = threading.Lock()
+    _ids: Dict[str, int] = {}
+    _tokens: Dict[int, str] = {}
+
+    def _remember(self, pk: int, token: str):
+        with self._lock:
+            self._ids[token] = pk
+            self._tokens[pk] = token
+
+    def id_for(self, token: str, create: bool = True) -> int or None:
+        pk = self._ids.get(token)
+        if pk is None and token:
+            if create:
+                pk = self.get_or_create(token=token)[0].pk
+            else:
+                pk = self.filter(token=token).values_list('pk', flat=True).first()
+                if pk is None:
+                    return
+            self._remember(pk, token)
+        return pk
+
+    def token_for(self, pk: int) -> str or None:
+        token = self._tokens.get(pk)
+        if token is None and pk is not None:
+            token = self.filter(pk=pk).values_list('token', flat=True).first()
+            if token:
+                self._remember(pk, token)
+        return token
+
+
+class Bot(TimeStampedModel):
+    """Telegram bot referenced by the other models instead of storing its token in every row"""
+    token = models.fields.CharField(max_length=200, unique=True)
+
+    objects = BotManager()
+
+    def __str__(self):
+        from bot import telegrambot as tb
+        me = tb.my_bot.identity(self.token) if tb.my_bot else None
+        return f'@{me.username}' if me else f'Bot {self.pk}'
+
+
+class BotTokenMixin:
+    """Keeps `bot_token` usable as attribute and constructor argument of models with a `bot` foreign key
+
+    Queries have to filter by `bot_id`, see Bot.objects.id_for.
+    """
+
+    @property
+    def bot_token(self) -> str or None:
+        return Bot.objects.token_for(self.bot_id)
+
+    @bot_token.setter
+    def bot_token(self, value: str):
+        self.bot_id = Bot.objects.id_for(value)
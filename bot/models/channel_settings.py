@@ -1,22 +1,23 @@
+import hashlib
 import json
 from typing import List
 
-from cached_property import cached_property_ttl
 from django.db import models
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django_extensions.db.models import TimeStampedModel
-from telegram import Chat
+from telegram import Chat, TelegramError
 from telegram.error import Unauthorized, BadRequest
 
+from bot.models.bot import BotTokenMixin
+from bot.utils.chat_cache import chat_cache
 from bot.utils.internal import bot_not_running_protect
-from bot.utils.media import Fonts
 
 
-class ChannelSettings(TimeStampedModel):
+class ChannelSettings(BotTokenMixin, TimeStampedModel):
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['channel_id', 'bot_token'],
+            models.UniqueConstraint(fields=['channel_id', 'bot'],
                                     name='channel_bot_unique')
         ]
 
@@ -26,20 +27,19 @@ class ChannelSettings(TimeStampedModel):
     channel_username = models.fields.CharField(max_length=200, blank=True, null=True)
     channel_title = models.fields.CharField(max_length=200, blank=True, null=True)
 
-    bot_token = models.fields.CharField(max_length=200)
+    bot = models.ForeignKey('Bot', related_name='channels', on_delete=models.PROTECT)
 
     added_by = models.ForeignKey('UserSettings', on_delete=models.DO_NOTHING, null=True)
     users = models.ManyToManyField('UserSettings', related_name='channels', blank=True)
 
-    forward_to = models.ForeignKey('ChannelSettings',
-                                   related_name='forward_from',
-                                   on_delete=models.SET_NULL,
-                                   blank=True,
-                                   null=True)
+    forward_to = models.ManyToManyField('ChannelSettings',
+                                        related_name='forward_from',
+                                        symmetrical=False,
+                                        blank=True)
     caption = models.fields.TextField(blank=True, null=True)
     image_caption = models.fields.TextField(blank=True, null=True)
     image_caption_font = models.fields.TextField(
-        default='default', help_text=f'Available fonts: {", ".join(map(lambda font: f"<code>{font}</code>", Fonts))}')
+        default='default', help_text='Id of one of the AVAILABLE_FONTS, the admin lists them')
     image_caption_direction = models.fields.CharField(
         default='nw',
         choices=[
@@ -58,6 +58,10 @@ class ChannelSettings(TimeStampedModel):
     image_caption_alpha = models.fields.IntegerField(default=100)
     _reactions = models.fields.TextField(blank=True, null=True)
     zombie = models.fields.BooleanField(default=False)
+    edit_weight = models.fields.PositiveSmallIntegerField(
+        default=1, help_text='Posts edited per turn when several channels are waiting, see bot.utils.scheduler')
+    edit_concurrency = models.fields.PositiveSmallIntegerField(
+        default=1, help_text='Posts of the channel which may be edited at the same time')
     _chat = None
 
     def __int__(self):
@@ -77,19 +81,16 @@ class ChannelSettings(TimeStampedModel):
     @property
     @bot_not_running_protect
     def chat(self) -> Chat:
-        if not self._chat:
+        # Zombies are rechecked by the sweeper (bot.utils.zombies), don't spend an API call on them here
+        if not self._chat and not self.zombie:
             from bot.telegrambot import my_bot
             try:
                 bot = my_bot.get_bot(self.bot_token)
-                self._chat = bot.get_chat(self.channel_id)
-                if self.zombie:
-                    print(f'Unmarked {self.name}[{self.channel_id}] as a zombie')
-                    self.save(update_fields=['zombie'])
+                self._chat = chat_cache.get_chat(bot, self.channel_id)
             except (Unauthorized, BadRequest):
-                if not self.zombie:
-                    print(f'Marked {self.name}[{self.channel_id}] as a zombie')
-                    self.save(update_fields=['zombie'])
-                    return
+                self.zombie = True
+                self.save(update_fields=['zombie'])
+                print(f'Marked {self.name}[{self.channel_id}] as a zombie')
                 return
             except Exception:
                 pass
@@ -110,12 +111,20 @@ class ChannelSettings(TimeStampedModel):
         if chat:
             self.channel_username = chat.username
             self.channel_title = chat.title
+            self.zombie = False
 
             if save:
                 self.save()
             return True
         return False
 
+    @property
+    def settings_hash(self) -> str:
+        """Fingerprint of the settings which change posts, equal for channels whose posts would be edited the same"""
+        settings = [self.caption, self.image_caption, self.image_caption_font, self.image_caption_direction,
+                    self.image_caption_alpha, self.reactions]
+        return hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+
     @property
     def reactions(self) -> List[str]:
         return json.loads(self._reactions or '[]')
@@ -130,15 +139,26 @@ class ChannelSettings(TimeStampedModel):
         self.image_caption_direction = 'nw'
         self.image_caption_font = 'default'
         self.reactions = []
-        self.forward_to = None
         self.save()
+        self.forward_to.clear()
 
-    @cached_property_ttl(ttl=3600)
+    @property
     def pure_link(self) -> str or None:
         link = None
         if self.chat:
-            link = self.chat.link or self.chat.invite_link or self.chat.bot.export_chat_invite_link(self.chat.id)
-        elif self.channel_username:
+            try:
+                link = chat_cache.get_link(self.chat.bot, self.channel_id)
+            except TelegramError:
+                pass
+        if not link and self.channel_username:
+            link = f'https://t.me/{self.channel_username}'
+        return link
+
+    @property
+    def cached_pure_link(self) -> str or None:
+        """Like pure_link but never calls the API, for pages which list many channels"""
+        link = chat_cache.cached_link(self.bot_token, self.channel_id)
+        if not link and self.channel_username:
             link = f'https://t.me/{self.channel_username}'
         return link
 
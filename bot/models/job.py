@@ -0,0 +1,61 @@
+import json
+
+from django.db import models
+from django.utils import timezone
+from django_extensions.db.models import TimeStampedModel
+
+
+class Job(TimeStampedModel):
+    """Long running operation started from the admin and run by `manage.py runjobs`, see bot.utils.jobs"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATES = (PENDING, RUNNING, DONE, FAILED)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['state', 'available_at'], name='job_state_available'),
+        ]
+
+    name = models.fields.CharField(max_length=50)
+    _payload = models.fields.TextField(blank=True, null=True)
+    _checkpoint = models.fields.TextField(blank=True, null=True, help_text='Where to continue after a restart')
+
+    state = models.fields.CharField(max_length=20, choices=map(lambda s: (s, s), STATES), default=PENDING)
+    attempts = models.fields.IntegerField(default=0)
+    available_at = models.fields.DateTimeField(default=timezone.now)
+
+    done = models.fields.IntegerField(default=0)
+    total = models.fields.IntegerField(blank=True, null=True)
+    message = models.fields.TextField(blank=True, null=True)
+    result = models.fields.CharField(max_length=255, blank=True, null=True, help_text='File the job produced')
+    last_error = models.fields.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.name}:{self.pk} ({self.state})'
+
+    @property
+    def payload(self) -> dict:
+        return json.loads(self._payload or '{}')
+
+    @payload.setter
+    def payload(self, value: dict):
+        self._payload = json.dumps(value or {})
+
+    @property
+    def checkpoint(self) -> dict or None:
+        return json.loads(self._checkpoint) if self._checkpoint else None
+
+    @checkpoint.setter
+    def checkpoint(self, value: dict or None):
+        self._checkpoint = json.dumps(value) if value is not None else None
+
+    @property
+    def percent(self) -> int or None:
+        if self.state == self.DONE:
+            return 100
+        if not self.total:
+            return
+        return min(100, self.done * 100 // self.total)
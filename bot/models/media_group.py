@@ -1,18 +1,20 @@
 from django.db import models
 from django_extensions.db.models import TimeStampedModel
 
+from bot.models.bot import BotTokenMixin
 
-class MediaGroup(TimeStampedModel):
+
+class MediaGroup(BotTokenMixin, TimeStampedModel):
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['media_group_id', 'bot_token'],
+            models.UniqueConstraint(fields=['media_group_id', 'bot'],
                                     name='mediagroup_bot_unique')
         ]
 
     media_group_id = models.fields.BigIntegerField(null=True)
     message_id = models.fields.BigIntegerField()
 
-    bot_token = models.fields.CharField(max_length=200)
+    bot = models.ForeignKey('Bot', related_name='media_groups', on_delete=models.PROTECT)
 
     channel = models.ForeignKey('ChannelSettings',
                                 related_name='media_groups',
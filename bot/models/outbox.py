@@ -0,0 +1,42 @@
+import json
+
+from django.db import models
+from django.utils import timezone
+from django_extensions.db.models import TimeStampedModel
+
+
+class Outbox(TimeStampedModel):
+    """Outbound Telegram API operation which is kept until it went through, see bot.utils.outbox"""
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATES = (PENDING, DONE, FAILED)
+
+    class Meta:
+        verbose_name_plural = 'Outbox'
+        indexes = [
+            models.Index(fields=['state', 'available_at'], name='outbox_state_available'),
+            models.Index(fields=['state', 'modified'], name='outbox_state_modified'),
+        ]
+
+    key = models.fields.CharField(max_length=255, unique=True, help_text='Idempotency key')
+    bot_token = models.fields.CharField(max_length=200)
+    operation = models.fields.CharField(max_length=50)
+    _payload = models.fields.TextField(blank=True, null=True)
+
+    state = models.fields.CharField(max_length=20, choices=map(lambda s: (s, s), STATES), default=PENDING)
+    attempts = models.fields.IntegerField(default=0)
+    available_at = models.fields.DateTimeField(default=timezone.now)
+    last_error = models.fields.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.operation}:{self.key} ({self.state})'
+
+    @property
+    def payload(self) -> dict:
+        return json.loads(self._payload or '{}')
+
+    @payload.setter
+    def payload(self, value: dict):
+        self._payload = json.dumps(value or {})
@@ -0,0 +1,40 @@
+import json
+from datetime import timedelta
+
+from django.db import models
+from django_extensions.db.models import TimeStampedModel
+
+
+class Post(TimeStampedModel):
+    """Channel post as the bot received it, so that changed settings can be applied to it later, see
+    bot.utils.reapply"""
+    # Posts older than this are forgotten
+    KEEP = timedelta(days=30)
+
+    class Meta(TimeStampedModel.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['channel', 'message_id'], name='post_channel_message_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created'], name='post_created'),
+            models.Index(fields=['channel', 'media_group_id'], name='post_channel_media_group'),
+        ]
+
+    channel = models.ForeignKey('ChannelSettings', related_name='posts', on_delete=models.CASCADE)
+    message_id = models.fields.BigIntegerField()
+    media_group_creator = models.fields.BooleanField(null=True)
+    media_group_id = models.fields.CharField(max_length=64, blank=True, null=True)
+    _update = models.fields.TextField()
+    settings_hash = models.fields.CharField(max_length=40, blank=True, null=True,
+                                            help_text='Settings the post was last edited with, empty while pending')
+
+    def __str__(self):
+        return f'{self.channel_id}:{self.message_id}'
+
+    @property
+    def update(self) -> dict:
+        return json.loads(self._update or '{}')
+
+    @update.setter
+    def update(self, value: dict):
+        self._update = json.dumps(value or {})
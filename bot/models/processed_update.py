@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.db import models
+from django_extensions.db.models import TimeStampedModel
+
+
+class ProcessedUpdate(TimeStampedModel):
+    """Key of an update which was handled already, so that other processes skip redeliveries, see bot.utils.dedup"""
+    # Telegram keeps undelivered updates for a day, keys older than this can't come up again
+    KEEP = timedelta(days=2)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['created'], name='processed_update_created'),
+        ]
+
+    key = models.fields.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.key
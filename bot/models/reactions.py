@@ -1,14 +1,23 @@
 from django.db import models
 from django_extensions.db.models import TimeStampedModel
 
+from bot.models.bot import BotTokenMixin
+
+
+class Reaction(BotTokenMixin, TimeStampedModel):
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['channel', 'message', 'reaction'], name='reaction_channel_message'),
+            # Default ordering, used by the admin
+            models.Index(fields=['-modified', '-created'], name='reaction_modified'),
+        ]
 
-class Reaction(TimeStampedModel):
     reaction = models.fields.CharField(max_length=100)
     message = models.fields.BigIntegerField()
     users = models.ManyToManyField('UserSettings', related_name='reactions', blank=True)
     channel = models.ForeignKey('ChannelSettings', on_delete=models.CASCADE, null=True)
 
-    bot_token = models.fields.CharField(max_length=200)
+    bot = models.ForeignKey('Bot', related_name='reactions', on_delete=models.PROTECT)
 
     def __str__(self):
         return f'{self.reaction}@{self.channel_id}:{self.message}'
@@ -4,10 +4,11 @@ from django_extensions.db.models import TimeStampedModel
 from telegram import User
 from telegram.error import Unauthorized, BadRequest
 
+from bot.models.bot import BotTokenMixin
 from bot.utils.internal import bot_not_running_protect, first
 
 
-class UserSettings(TimeStampedModel):
+class UserSettings(BotTokenMixin, TimeStampedModel):
     SET_REACTIONS_MENU = 'set reactions menu'
     SET_REACTIONS = 'set reactions'
     IDLE = 'idle'
@@ -29,14 +30,14 @@ class UserSettings(TimeStampedModel):
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['user_id', 'bot_token'],
+            models.UniqueConstraint(fields=['user_id', 'bot'],
                                     name='user_bot_unique')
         ]
 
     user_id = models.fields.BigIntegerField()
     _user: User = None  # Actual telegram User object
 
-    bot_token = models.fields.CharField(max_length=200)
+    bot = models.ForeignKey('Bot', related_name='users', on_delete=models.PROTECT)
 
     current_channel = models.ForeignKey('ChannelSettings',
                                         related_name='current_user',
@@ -88,6 +89,7 @@ class UserSettings(TimeStampedModel):
         if user:
             self.username = user.username
             self.user_fullname = user.full_name
+            self.zombie = False
 
             if save:
                 self.save()
@@ -103,20 +105,15 @@ class UserSettings(TimeStampedModel):
     @bot_not_running_protect
     def user(self) -> User:
         from bot.telegrambot import my_bot
-        if not self._user:
+        # Zombies are rechecked by the sweeper (bot.utils.zombies), don't spend an API call on them here
+        if not self._user and not self.zombie:
             try:
                 bot = my_bot.get_bot(self.bot_token)
                 self._user = bot.get_chat(self.user_id)
-
-                if self.zombie:
-                    self.zombie = False
-                    self.save(update_fields=['zombie'])
-                    print(f'Unmarked {self.name}[{self.user_id}] as a zombie')
             except (Unauthorized, BadRequest):
-                if not self.zombie:
-                    self.zombie = True
-                    self.save(update_fields=['zombie'])
-                    print(f'Marked {self.name}[{self.user_id}] as a zombie')
+                self.zombie = True
+                self.save(update_fields=['zombie'])
+                print(f'Marked {self.name}[{self.user_id}] as a zombie')
                 return None
             except Exception:
                 return None
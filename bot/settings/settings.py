@@ -98,6 +98,22 @@ class Base(Configuration):
 
     AVAILABLE_FONTS = os.environ['AVAILABLE_FONTS']
 
+    # Threads handling updates and the bot's background work, the lanes they are shared by and the number of tasks each
+    # lane may run at the same time are in bot.utils.scheduler. Lane limits can be overridden with
+    # SCHEDULER_LANE_LIMITS = {'edits': 2, ...}
+    SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', 12))
+
+    # Database connections the bot's threads may use at the same time and keep open between jobs, see
+    # bot.utils.db.ConnectionPool. Every scheduler worker may hold one, the rest is left to the outbox, album and
+    # scheduling threads.
+    DB_POOL_SIZE = max(int(os.environ.get('DB_POOL_SIZE', 0)), SCHEDULER_WORKERS + 4)
+
+    # Required as ?token= or bearer token to read /metrics/, which is open if not set
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # File the startup timings are written to, they are only logged if not set
+    STARTUP_REPORT = os.environ.get('STARTUP_REPORT')
+
 
 _bot_config = json.loads((BASE_PATH / os.environ.get('BOT_CONFIG_FILE')).read_text())
 
@@ -112,6 +128,7 @@ class Production(Base):
             'PASSWORD': os.environ.get('DJANGO_DB_PASSWD', ),
             'HOST': 'localhost',
             'PORT': '5432',
+            'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 300)),
         }
     }
 
@@ -137,6 +154,7 @@ class Development(Base):
             'PASSWORD': '',
             'HOST': 'localhost',
             'PORT': '5432',
+            'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 300)),
         }
     }
 
@@ -1,26 +1,61 @@
 import logging
 import threading
-from typing import Callable, List, Type
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Type
 
 from django_telegrambot.apps import DjangoTelegramBot
 from telegram import Bot, TelegramError, Update, User
+from telegram.error import Unauthorized
 from telegram.ext import CallbackQueryHandler, CommandHandler, Filters, Handler, MessageHandler, Dispatcher
 
-from bot.utils.internal import set_thread_locals, first
+from bot.utils.cache import TTLCache
+from bot.utils.chat_cache import member_cache
+from bot.utils.dedup import update_dedup, update_keys
+from bot.utils.internal import is_bot_process, set_thread_locals
+from bot.utils.media import Fonts
+from bot.utils.scheduler import lane_for_update, task_scheduler
+from bot.utils.startup import startup_timer
 
 # Patch dispatcher
 original__process_update = Dispatcher.process_update
 
 
-def process_update(self, update: Update):
+def _process_update(self, update: Update, keys: List[str] or None):
     set_thread_locals(self, update)
+    if keys and not update_dedup.claim(keys):
+        return
     return original__process_update(self, update)
 
 
+def process_update(self, update: Update):
+    """Handle the update in the lane of its kind, so that callbacks and private chats don't wait behind channel posts
+
+    Updates of the same chat are handled one after another in the order they arrived. Updates which Telegram delivered
+    before are skipped, an update is handled at most once, see `UpdateDedup`.
+    """
+    keys = None
+    if isinstance(update, Update):
+        keys = update_keys(self.bot, update)
+        if update_dedup.seen_recently(keys):
+            return
+
+    lane, key = lane_for_update(update)
+    task_scheduler.submit(lane, _process_update, self, update, keys, key=key)
+
+
+def run_async(self, func: Callable, *args, **kwargs):
+    lane, _ = lane_for_update(my_bot.update if my_bot else None)
+    return task_scheduler.submit(lane, func, *args, **kwargs)
+
+
 Dispatcher.process_update = process_update
+Dispatcher.run_async = run_async
 
 
 class MyBot:
+    # Seconds after which bot identities (get_me) are refreshed in the background
+    IDENTITY_REFRESH = 3600
+
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.INFO)
@@ -29,21 +64,66 @@ class MyBot:
 
         self.dispatchers: List[Dispatcher] = DjangoTelegramBot.dispatchers
         self.bots: List[Bot] = [dp.bot for dp in self.dispatchers]
+        self._dispatchers: Dict[str, Dispatcher] = {dp.bot.token: dp for dp in self.dispatchers}
+        self._bots: Dict[str, Bot] = {bot.token: bot for bot in self.bots}
         self.threadlocal = threading.local()
 
-        for bot in self.bots:
-            self.logger.info('Bot {} [{}] up'.format(bot.get_me().username, bot.token))
+        self._identities = TTLCache(ttl=24 * 3600, max_size=max(len(self.bots), 1))
+        self._identity_executor = ThreadPoolExecutor(max_workers=min(max(len(self.bots), 1), 16),
+                                                     thread_name_prefix='BotIdentity')
+        self._refreshing: Dict[str, Future] = {}
+        self.refresh_identities()
 
         self.add_command(func=self.error, is_error=True)
 
+    def _fetch_identity(self, bot: Bot) -> User or None:
+        try:
+            me = bot.get_me()
+            if bot.token not in self._identities:
+                self.logger.info('Bot {} [{}] up'.format(me.username, bot.token))
+            self._identities.set(bot.token, me)
+            return me
+        except TelegramError as e:
+            self.logger.warning(f'Could not get identity of bot [{bot.token}]: {e}')
+
+    def refresh_identities(self, tokens: List[str] = None):
+        """Fetch the identities of the given or all bots concurrently in the background"""
+        for token in tokens or self._bots:
+            if token in self._refreshing:
+                continue
+            future = self._refreshing[token] = self._identity_executor.submit(self._fetch_identity, self._bots[token])
+            future.add_done_callback(lambda _, token=token: self._refreshing.pop(token, None))
+
+    def identity(self, token: str = None) -> User or None:
+        """Cached identity (get_me) of the bot with the given or the current token"""
+        token = token or self.token
+        bot = self._bots.get(token)
+        if not bot:
+            return
+
+        entry = self._identities.get_entry(token)
+        if entry is None:
+            pending = self._refreshing.get(token)
+            return pending.result() if pending else self._fetch_identity(bot)
+
+        me, age = entry
+        if age > self.IDENTITY_REFRESH:
+            self.refresh_identities([token])
+        return me
+
     def error(self, bot: Bot, update: Update, error: TelegramError):
+        if isinstance(error, Unauthorized) and update and update.effective_chat:
+            member_cache.invalidate(bot.token, update.effective_chat.id)
         self.logger.warning(f'Update "{update}" caused error "{error}"')
 
-    def me(self) -> User:
-        return self.bot.get_me()
+    def me(self) -> User or None:
+        return self.identity()
+
+    def get_bot(self, token: str) -> Bot or None:
+        return self._bots.get(token)
 
-    def get_bot(self, token):
-        return first([bot for bot in self.bots if bot.token == token])
+    def get_dispatcher(self, token: str) -> Dispatcher or None:
+        return self._dispatchers.get(token)
 
     @property
     def bot(self):
@@ -104,6 +184,22 @@ my_bot: MyBot = None
 
 def main():
     global my_bot
-    my_bot = MyBot()
-    # noinspection PyUnresolvedReferences
-    from . import commands
+    with startup_timer.phase('bot init'):
+        my_bot = MyBot()
+
+    # Management commands like migrate and processes which only serve the admin don't need the plugins
+    if not is_bot_process():
+        return
+
+    with startup_timer.phase('plugins'):
+        # noinspection PyUnresolvedReferences
+        from . import commands
+    from bot.utils.cleanup import cleanup_scheduler
+    from bot.utils.outbox import outbox_worker
+    from bot.utils.zombies import zombie_scheduler
+    outbox_worker.start()
+    zombie_scheduler.start()
+    cleanup_scheduler.start()
+
+    Fonts.load_in_background()
+    startup_timer.write_report()
@@ -1 +1,572 @@
-# Create your tests here.
+import csv
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from typing import List
+from unittest import mock, skipIf
+
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from telegram.error import BadRequest
+
+from bot import telegrambot as tb
+from bot.admin import _added_by_lookups
+from bot.models.bot import Bot, BotManager
+from bot.models.channel_settings import ChannelSettings
+from bot.models.job import Job
+from bot.models.outbox import Outbox
+from bot.models.post import Post
+from bot.models.processed_update import ProcessedUpdate
+from bot.models.reactions import Reaction
+from bot.models.usersettings import UserSettings
+from bot.utils import cleanup, jobs, outbox
+from bot.utils.bot_migration import migrate_chunk
+from bot.utils.bulk_settings import apply_settings, preview_settings
+from bot.utils.chat_cache import chat_cache, member_cache
+from bot.utils.dedup import UpdateDedup
+from bot.utils.export import export_reactions, export_reactions_job
+from bot.utils.forward_graph import ForwardGraph
+from bot.utils.forwarding import AlbumCollector, is_album_copy
+from bot.utils.query_audit import ADMIN_QUERY_CAP, changelist_queries, seed
+from bot.utils.reapply import enqueue_reapply, reapply_settings_job
+from bot.utils.scheduler import BACKGROUND, CALLBACKS, EDITS, TaskScheduler
+
+
+def forget_bots():
+    """Drop the process wide token cache, rolled back bots may come back with the same pk and another token"""
+    BotManager._ids.clear()
+    BotManager._tokens.clear()
+
+
+class TaskSchedulerTest(SimpleTestCase):
+    def hold(self, scheduler: TaskScheduler, lane: str) -> threading.Event:
+        """Keep a worker busy until the returned event is set, so that tasks can be queued up first"""
+        release = threading.Event()
+        started = threading.Event()
+        scheduler.submit(lane, lambda: started.set() or release.wait(5))
+        started.wait(5)
+        return release
+
+    def test_keys_take_turns_by_weight(self):
+        scheduler = TaskScheduler(workers=1, limits={EDITS: 1})
+        order = []
+        release = self.hold(scheduler, EDITS)
+        promises = [scheduler.submit(EDITS, order.append, f'noisy{i}', key='noisy') for i in range(6)]
+        promises += [scheduler.submit(EDITS, order.append, f'quiet{i}', key='quiet') for i in range(2)]
+        promises += [scheduler.submit(EDITS, order.append, f'heavy{i}', key='heavy', weight=2) for i in range(4)]
+        release.set()
+        for promise in promises:
+            promise.result(5)
+
+        self.assertEqual(order, ['noisy0', 'quiet0', 'heavy0', 'heavy1', 'noisy1', 'quiet1', 'heavy2', 'heavy3',
+                                 'noisy2', 'noisy3', 'noisy4', 'noisy5'])
+
+    def test_key_limit(self):
+        scheduler = TaskScheduler(workers=6, limits={EDITS: 6})
+        lock = threading.Lock()
+        running = {'now': 0, 'peak': 0}
+        order = []
+
+        def task(index):
+            with lock:
+                running['now'] += 1
+                running['peak'] = max(running['peak'], running['now'])
+                order.append(index)
+            time.sleep(0.02)
+            with lock:
+                running['now'] -= 1
+
+        for promise in [scheduler.submit(EDITS, task, i, key='channel', limit=2) for i in range(8)]:
+            promise.result(5)
+        self.assertEqual(running['peak'], 2)
+        self.assertEqual(order, list(range(8)))
+
+    def test_same_key_runs_in_order(self):
+        scheduler = TaskScheduler(workers=4, limits={EDITS: 4})
+        order = []
+        promises = [scheduler.submit(EDITS, lambda i: time.sleep(0.01) or order.append(i), i, key='chat')
+                    for i in range(5)]
+        for promise in promises:
+            promise.result(5)
+        self.assertEqual(order, list(range(5)))
+
+    def test_lane_priority(self):
+        scheduler = TaskScheduler(workers=1)
+        order = []
+        release = self.hold(scheduler, BACKGROUND)
+        promises = [scheduler.submit(BACKGROUND, order.append, 'background'),
+                    scheduler.submit(EDITS, order.append, 'edit'),
+                    scheduler.submit(CALLBACKS, order.append, 'callback')]
+        release.set()
+        for promise in promises:
+            promise.result(5)
+        self.assertEqual(order, ['callback', 'edit', 'background'])
+
+    def test_lane_limit_leaves_workers_to_higher_lanes(self):
+        scheduler = TaskScheduler(workers=3, limits={BACKGROUND: 1})
+        background = self.hold(scheduler, BACKGROUND)
+        queued = scheduler.submit(BACKGROUND, lambda: None)
+        done = scheduler.submit(CALLBACKS, lambda: 'answered')
+        self.assertEqual(done.result(5), 'answered')
+        self.assertFalse(queued.done.is_set())
+        background.set()
+        queued.result(5)
+
+
+class AdminQueriesTest(TestCase):
+    def changelist_queries(self, model) -> int:
+        """Queries of the changelist once the process wide caches, e.g. of bot tokens, are filled"""
+        changelist_queries(model)
+        _added_by_lookups.clear()
+        return changelist_queries(model)
+
+    def test_changelists_stay_below_cap(self):
+        for model in (ChannelSettings, UserSettings):
+            with self.subTest(model=model.__name__):
+                with transaction.atomic():
+                    seed(0.001)
+                    queries = self.changelist_queries(model)
+                    transaction.set_rollback(True)
+                self.assertLessEqual(queries, ADMIN_QUERY_CAP)
+
+                # A full page takes as many queries as a nearly empty one
+                with transaction.atomic():
+                    seed(0.02)
+                    changelist_queries(model)
+                    _added_by_lookups.clear()
+                    with self.assertNumQueries(queries):
+                        changelist_queries(model)
+                    transaction.set_rollback(True)
+
+
+class OutboxMixin:
+    """Outbox with a fake bot and a 'test' operation whose handler records its payloads and raises `self.error`"""
+
+    def setUp(self):
+        super().setUp()
+        self.bot = mock.MagicMock(token='123:test')
+        patcher = mock.patch.object(tb, 'my_bot', mock.MagicMock(bots=[self.bot]))
+        patcher.start().get_bot.return_value = self.bot
+        self.addCleanup(patcher.stop)
+
+        self.handled = []
+        self.done = threading.Event()
+        self.error = None
+
+        def handler(bot, payload):
+            self.handled.append((bot, payload))
+            self.done.set()
+            if self.error:
+                raise self.error
+
+        outbox.outbox_handler('test')(handler)
+        self.addCleanup(outbox._handlers.pop, 'test')
+        self.addCleanup(outbox._lanes.pop, 'test')
+
+
+class OutboxTest(OutboxMixin, TestCase):
+    def claim(self) -> List[Outbox]:
+        return outbox.OutboxWorker.claim(['test'])
+
+    def test_same_key_is_enqueued_once(self):
+        self.assertTrue(outbox.enqueue('test', self.bot.token, 'test:1', {'value': 1}))
+        self.assertFalse(outbox.enqueue('test', self.bot.token, 'test:1', {'value': 2}))
+        self.assertEqual(Outbox.objects.get().payload, {'value': 1})
+
+    def test_claim_leases_entries_without_counting_an_attempt(self):
+        outbox.enqueue('test', self.bot.token, 'test:1', {})
+        self.assertEqual(len(self.claim()), 1)
+        self.assertEqual(self.claim(), [])
+        self.assertEqual(Outbox.objects.get().attempts, 0)
+
+    def test_entry_claimed_again_only_runs_for_the_latest_claim(self):
+        outbox.enqueue('test', self.bot.token, 'test:1', {})
+        stale, = self.claim()
+        # The lease ran out while the entry waited for its lane
+        Outbox.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        fresh, = self.claim()
+
+        outbox.OutboxWorker.execute(stale)
+        self.assertEqual(self.handled, [])
+        outbox.OutboxWorker.execute(fresh)
+        self.assertEqual(len(self.handled), 1)
+        entry = Outbox.objects.get()
+        self.assertEqual((entry.state, entry.attempts), (Outbox.DONE, 1))
+
+    def test_failed_attempt_is_retried_later(self):
+        outbox.enqueue('test', self.bot.token, 'test:1', {})
+        self.error = ValueError('flaky')
+        outbox.OutboxWorker.execute(*self.claim())
+
+        entry = Outbox.objects.get()
+        self.assertEqual((entry.state, entry.attempts), (Outbox.PENDING, 1))
+        self.assertGreater(entry.available_at, timezone.now())
+        self.assertIn('flaky', entry.last_error)
+
+    def test_bad_request_is_not_retried(self):
+        outbox.enqueue('test', self.bot.token, 'test:1', {})
+        self.error = BadRequest('Message to forward not found')
+        outbox.OutboxWorker.execute(*self.claim())
+        self.assertEqual(Outbox.objects.get().state, Outbox.FAILED)
+
+    def test_postponed_entries_were_not_attempted(self):
+        outbox.enqueue('test', self.bot.token, 'test:1', {})
+        outbox.OutboxWorker.postpone(self.claim(), 60)
+        entry = Outbox.objects.get()
+        self.assertEqual(entry.attempts, 0)
+        self.assertEqual(self.claim(), [])
+
+
+class OutboxWorkerTest(OutboxMixin, TransactionTestCase):
+    """The worker runs on its own thread, so the entries have to be committed"""
+
+    def test_worker_drains_entry(self):
+        self.assertTrue(outbox.enqueue('test', self.bot.token, 'test:1', {'value': 1}))
+        worker = outbox.OutboxWorker()
+        worker.start()
+        self.addCleanup(worker.stop, 5)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.handled, [(self.bot, {'value': 1})])
+        for _ in range(50):
+            entry = Outbox.objects.get(key='test:1')
+            if entry.state == Outbox.DONE:
+                break
+            time.sleep(0.1)
+        self.assertEqual(entry.state, Outbox.DONE)
+        self.assertEqual(entry.attempts, 1)
+
+
+class ForwardGraphTest(TestCase):
+    def setUp(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        self.token = '1:graph'
+        bot_id = Bot.objects.id_for(self.token)
+        self.a, self.b, self.c = [ChannelSettings.objects.create(channel_id=-1001 - i, bot_id=bot_id) for i in range(3)]
+        self.a.forward_to.add(self.b)
+        self.b.forward_to.add(self.c)
+
+    def test_targets(self):
+        graph = ForwardGraph()
+        self.assertEqual(graph.targets(self.token, self.a.channel_id), {self.b.channel_id})
+        self.assertEqual(graph.reachable(self.token, self.a.channel_id), {self.b.channel_id, self.c.channel_id})
+        self.assertTrue(graph.creates_cycle(self.token, self.c.channel_id, self.a.channel_id))
+        self.assertFalse(graph.creates_cycle(self.token, self.a.channel_id, self.c.channel_id))
+
+    def test_zombies_are_no_targets_but_still_close_loops(self):
+        ChannelSettings.objects.filter(pk=self.b.pk).update(zombie=True)
+        graph = ForwardGraph()
+        self.assertEqual(graph.targets(self.token, self.a.channel_id), set())
+        self.assertTrue(graph.creates_cycle(self.token, self.c.channel_id, self.a.channel_id))
+
+
+class AlbumCollectorTest(SimpleTestCase):
+    def collect(self, collector: AlbumCollector, pending, *message_ids: int, pause: float = 0.2):
+        albums = []
+        flushed = threading.Event()
+        for message_id in message_ids:
+            collector.add('album', mock.MagicMock(message_id=message_id),
+                          lambda messages: albums.append([message.message_id for message in messages]) or flushed.set(),
+                          pending)
+            time.sleep(pause)
+        return albums, flushed
+
+    def test_waits_for_pending_edits(self):
+        # Messages 2 and 3 are still being edited when the collector would otherwise flush
+        collector = AlbumCollector(delay=0.05, max_wait=5)
+        albums, flushed = self.collect(collector, lambda message_ids: len(message_ids) < 3, 1, 3, 2)
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(albums, [[1, 2, 3]])
+
+    def test_sends_incomplete_album_after_max_wait(self):
+        collector = AlbumCollector(delay=0.05, max_wait=0.3)
+        albums, flushed = self.collect(collector, lambda message_ids: True, 1, pause=0)
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(albums, [[1]])
+
+
+class AlbumCopiesTest(TestCase):
+    def setUp(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        self.bot = mock.MagicMock(token='1:album')
+
+    def album(self, target: int, **payload):
+        Outbox.objects.create(key=f'album:{Bot.objects.id_for(self.bot.token)}:{target}:-1001:group',
+                              bot_token=self.bot.token, operation='album', _payload=json.dumps(payload))
+
+    def message(self, chat_id: int, message_id: int):
+        return mock.MagicMock(bot=self.bot, chat_id=chat_id, message_id=message_id)
+
+    def test_copies(self):
+        self.album(-1002, copies=[5, 6])
+        self.assertTrue(is_album_copy(self.message(-1002, 6), wait=0))
+        self.assertFalse(is_album_copy(self.message(-1002, 7), wait=0))
+        self.assertFalse(is_album_copy(self.message(-1003, 6), wait=0))
+
+    def test_waits_for_album_being_sent(self):
+        self.album(-1002, sending_at=time.time())
+        started = time.monotonic()
+        self.assertFalse(is_album_copy(self.message(-1002, 6), wait=1))
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+
+        self.album(-1003, sending_at=time.time() - 120)
+        started = time.monotonic()
+        self.assertFalse(is_album_copy(self.message(-1003, 6), wait=1))
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class BotMigrationTest(TestCase):
+    def setUp(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        self.old_bot, self.new_bot = Bot.objects.id_for('1:old'), Bot.objects.id_for('2:new')
+
+    def channel_with_reaction(self, bot_id: int, user_id: int):
+        channel = ChannelSettings.objects.create(channel_id=-1001, bot_id=bot_id)
+        user = UserSettings.objects.create(user_id=user_id, bot_id=bot_id)
+        channel.users.add(user)
+        reaction = Reaction.objects.create(channel=channel, bot_id=bot_id, message=1, reaction='👍')
+        reaction.users.add(user)
+        return channel
+
+    def test_merges_duplicate_channel_and_its_reactions(self):
+        channel = self.channel_with_reaction(self.old_bot, 1)
+        self.channel_with_reaction(self.new_bot, 2)
+
+        result = migrate_chunk([channel.pk], self.new_bot)
+        self.assertEqual((result['duplicates'], result['merged_reactions']), (1, 1))
+
+        channel = ChannelSettings.objects.get(channel_id=-1001)
+        self.assertEqual(channel.bot_id, self.new_bot)
+        reaction = Reaction.objects.get()
+        self.assertEqual((reaction.channel_id, reaction.bot_id), (channel.pk, self.new_bot))
+        self.assertEqual(sorted(reaction.users.values_list('user_id', flat=True)), [1, 2])
+
+
+class UpdateDedupTest(TestCase):
+    keys = ['update:1:1', 'channel_post:1:-1001:1']
+
+    def test_skips_redelivered_update(self):
+        dedup = UpdateDedup()
+        self.assertFalse(dedup.seen_recently(self.keys))
+        self.assertTrue(dedup.claim(self.keys))
+        self.assertTrue(dedup.seen_recently(self.keys))
+
+        # Another process which did not see the update yet
+        other = UpdateDedup()
+        self.assertFalse(other.seen_recently(self.keys))
+        self.assertFalse(other.claim(self.keys))
+
+    def test_claim_is_all_or_nothing(self):
+        # Telegram counting update ids anew, the message is still the same
+        self.assertTrue(UpdateDedup.claim(self.keys))
+        self.assertFalse(UpdateDedup.claim(['update:1:7', 'channel_post:1:-1001:1']))
+        self.assertFalse(ProcessedUpdate.objects.filter(key='update:1:7').exists())
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite fails concurrent writes with "database table is locked"')
+class UpdateDedupRaceTest(TransactionTestCase):
+    def test_one_of_concurrent_claims_wins(self):
+        barrier = threading.Barrier(4)
+        results = []
+
+        def claim():
+            try:
+                barrier.wait(5)
+                results.append(UpdateDedup.claim(['update:1:1', 'channel_post:1:-1001:1']))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(sorted(results), [False, False, False, True])
+        self.assertEqual(ProcessedUpdate.objects.count(), 2)
+
+
+class BulkSettingsTest(TestCase):
+    def setUp(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        self.token = '1:bulk'
+        bot_id = Bot.objects.id_for(self.token)
+        self.channels = [ChannelSettings.objects.create(channel_id=-1001 - i, bot_id=bot_id, caption=caption)
+                         for i, caption in enumerate(['old', 'new', 'old'])]
+
+    def test_changes_and_invalidates_only_differing_channels(self):
+        self.addCleanup(chat_cache._chats.clear)
+        self.addCleanup(member_cache._members.clear)
+        for channel in self.channels:
+            chat_cache._chats.set((self.token, channel.channel_id), 'chat')
+            member_cache._members.set((self.token, channel.channel_id, 1), 'member')
+        patch = {'caption': 'new'}
+        channels = ChannelSettings.objects.filter(pk__in=[channel.pk for channel in self.channels])
+
+        self.assertEqual(preview_settings(channels, patch), (3, 2))
+        self.assertEqual(apply_settings(channels, patch), 2)
+        self.assertEqual(set(channels.values_list('caption', flat=True)), {'new'})
+        self.assertEqual([chat_cache._chats.get((self.token, channel.channel_id)) for channel in self.channels],
+                         [None, 'chat', None])
+        self.assertEqual([member_cache._members.get((self.token, channel.channel_id, 1)) for channel in self.channels],
+                         [None, 'member', None])
+        self.assertEqual(apply_settings(channels, patch), 0)
+
+
+class ReactionExportTest(TestCase):
+    def setUp(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        bot_id = Bot.objects.id_for('1:export')
+        users = [UserSettings.objects.create(user_id=user_id, bot_id=bot_id) for user_id in range(3)]
+        self.channel = ChannelSettings.objects.create(channel_id=-1001, bot_id=bot_id, channel_username='first')
+        other = ChannelSettings.objects.create(channel_id=-1002, bot_id=bot_id, channel_title='Second')
+        for channel, message, reaction, reacted in [(self.channel, 2, '👍', users), (self.channel, 1, '👎', users[:1]),
+                                                    (self.channel, 1, '👍', []), (other, 1, '👍', users[:2])]:
+            Reaction.objects.create(channel=channel, bot_id=bot_id, message=message, reaction=reaction).users.set(reacted)
+
+    def test_csv(self):
+        rows = list(csv.reader(''.join(export_reactions()).splitlines()))
+        self.assertEqual(rows, [
+            ['channel_id', 'channel', 'message', 'reaction', 'total'],
+            ['-1002', 'Second', '1', '👍', '2'],
+            ['-1001', '@first', '1', '👍', '0'],
+            ['-1001', '@first', '1', '👎', '1'],
+            ['-1001', '@first', '2', '👍', '3'],
+        ])
+
+    def test_ndjson_of_selected_channels(self):
+        lines = list(export_reactions(ChannelSettings.objects.filter(pk=self.channel.pk), 'ndjson'))
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'channel_id': -1001, 'channel': '@first', 'message': message, 'reaction': reaction, 'total': total}
+            for message, reaction, total in [(1, '👍', 0), (1, '👎', 1), (2, '👍', 3)]])
+
+    def test_job_writes_file(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            progress = list(export_reactions_job({'file': 'reactions.csv', 'format': 'csv', 'channels': None}, None))
+            self.assertEqual((progress[-1].done, progress[-1].total), (5, 5))
+            with open(progress[-1].result, encoding='utf-8', newline='') as file:
+                self.assertEqual(file.read(), ''.join(export_reactions()))
+
+
+class JobRunnerTest(TestCase):
+    def setUp(self):
+        self.processed = []
+        self.fail_at = None
+
+        def handler(payload, checkpoint):
+            for item in range(checkpoint['next'] if checkpoint else 0, payload['items']):
+                if item == self.fail_at:
+                    self.fail_at = None
+                    raise ValueError('interrupted')
+                self.processed.append(item)
+                yield jobs.Progress(done=item + 1, total=payload['items'], checkpoint={'next': item + 1})
+
+        jobs.job_handler('test')(handler)
+        self.addCleanup(jobs._handlers.pop, 'test')
+
+    def run_job(self) -> Job:
+        job = jobs.JobRunner.claim()
+        jobs.JobRunner.execute(job)
+        return Job.objects.get(pk=job.pk)
+
+    def test_failed_job_continues_from_its_checkpoint(self):
+        self.fail_at = 3
+        jobs.enqueue_job('test', {'items': 5})
+        job = self.run_job()
+        self.assertEqual((job.state, job.done, job.checkpoint), (Job.PENDING, 3, {'next': 3}))
+        self.assertIsNone(jobs.JobRunner.claim())
+
+        Job.objects.update(available_at=timezone.now())
+        job = self.run_job()
+        self.assertEqual((job.state, job.done, job.total, job.attempts), (Job.DONE, 5, 5, 2))
+        self.assertEqual(self.processed, [0, 1, 2, 3, 4])
+
+    def test_runner_which_lost_its_lease_stops(self):
+        jobs.enqueue_job('test', {'items': 3})
+        stale = jobs.JobRunner.claim()
+        Job.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        fresh = jobs.JobRunner.claim()
+
+        jobs.JobRunner.execute(stale)
+        # Its first progress report did not go through any more
+        self.assertEqual(self.processed, [0])
+        self.assertEqual(Job.objects.get().done, 0)
+
+        jobs.JobRunner.execute(fresh)
+        job = Job.objects.get()
+        self.assertEqual((job.state, job.done, job.attempts), (Job.DONE, 3, 2))
+
+    def test_active_job(self):
+        job = jobs.enqueue_job('test', {'channel': 1, 'posts': 10})
+        self.assertEqual(jobs.active_job('test', channel=1), job)
+        self.assertIsNone(jobs.active_job('test', channel=2))
+        Job.objects.update(state=Job.DONE)
+        self.assertIsNone(jobs.active_job('test', channel=1))
+
+
+class ReapplyTest(TestCase):
+    def setUp(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        self.bot = mock.MagicMock(token='1:reapply')
+        patcher = mock.patch.object(tb, 'my_bot', mock.MagicMock())
+        patcher.start().get_bot.return_value = self.bot
+        self.addCleanup(patcher.stop)
+
+        self.channel = ChannelSettings.objects.create(channel_id=-1001, bot_id=Bot.objects.id_for(self.bot.token))
+        for message_id in range(1, 6):
+            Post.objects.create(channel=self.channel, message_id=message_id)
+
+    def test_one_job_per_channel(self):
+        job = enqueue_reapply(self.channel, posts=10)
+        self.assertEqual(job.total, 5)
+        self.assertEqual(enqueue_reapply(self.channel), job)
+
+        Job.objects.update(state=Job.DONE)
+        self.assertNotEqual(enqueue_reapply(self.channel), job)
+
+    @mock.patch('bot.utils.reapply.reapply_to_post', side_effect=lambda bot, post: post.message_id % 2 == 0)
+    def test_edits_newest_posts_and_continues_from_checkpoint(self, reapply_to_post):
+        payload = {'channel': self.channel.pk, 'posts': 3}
+        progress = list(reapply_settings_job(payload, None))
+        self.assertEqual([call.args[1].message_id for call in reapply_to_post.call_args_list], [5, 4, 3])
+        self.assertEqual(progress[-1].checkpoint, {'before': 3, 'done': 3, 'edited': 1})
+        self.assertEqual(progress[-1].total, 3)
+
+        reapply_to_post.reset_mock()
+        progress = list(reapply_settings_job(payload, {'before': 4, 'done': 2, 'edited': 1}))
+        self.assertEqual([call.args[1].message_id for call in reapply_to_post.call_args_list], [3])
+        self.assertEqual(progress[-1].checkpoint, {'before': 3, 'done': 3, 'edited': 1})
+
+
+class CleanupTest(TestCase):
+    def test_prunes_rows_older_than_they_are_kept(self):
+        forget_bots()
+        self.addCleanup(forget_bots)
+        channel = ChannelSettings.objects.create(channel_id=-1001, bot_id=Bot.objects.id_for('1:cleanup'))
+        old_post, new_post = [Post.objects.create(channel=channel, message_id=message_id) for message_id in (1, 2)]
+        old_update, new_update = [ProcessedUpdate.objects.create(key=key) for key in ('update:1:1', 'update:1:2')]
+        Post.objects.filter(pk=old_post.pk).update(created=timezone.now() - Post.KEEP - timedelta(minutes=1))
+        ProcessedUpdate.objects.filter(pk=old_update.pk).update(
+            created=timezone.now() - ProcessedUpdate.KEEP - timedelta(minutes=1))
+
+        cleanup.prune()
+        self.assertEqual(list(Post.objects.values_list('pk', flat=True)), [new_post.pk])
+        self.assertEqual(list(ProcessedUpdate.objects.values_list('pk', flat=True)), [new_update.pk])
+
+    def test_scheduler_starts_one_thread(self):
+        pruned = threading.Event()
+        with mock.patch.object(cleanup, 'prune', side_effect=pruned.set):
+            scheduler = cleanup.CleanupScheduler(check_interval=3600)
+            scheduler.start()
+            thread = scheduler._thread
+            scheduler.start()
+            self.assertIs(scheduler._thread, thread)
+            self.assertTrue(pruned.wait(5))
@@ -2,11 +2,13 @@ from django.conf.urls import url
 from django.contrib import admin
 from django.urls import include, path
 
-from bot.views import redirect_to_admin_view, MigrateToBotView
+from bot.views import redirect_to_admin_view, JobResultView, MetricsView, MigrateToBotView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', redirect_to_admin_view),
     path('migrate/', MigrateToBotView.as_view()),
+    path('jobs/<int:pk>/result/', JobResultView.as_view(), name='job_result'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     url(r'^', include('django_telegrambot.urls')),
 ]
@@ -0,0 +1,132 @@
+from typing import Dict, Iterable, Iterator, List
+
+from django.db import transaction
+from django.db.models import Case, When
+
+from bot.models.channel_settings import ChannelSettings
+from bot.models.media_group import MediaGroup
+from bot.models.reactions import Reaction
+from bot.models.usersettings import UserSettings
+from bot.utils.jobs import Progress, job_handler
+
+# Channels migrated per transaction
+MIGRATION_CHUNK_SIZE = 50
+
+ChannelUsers = ChannelSettings.users.through
+ReactionUsers = Reaction.users.through
+
+
+def _case(field: str, mapping: Dict[int, int]) -> Case:
+    """SQL expression mapping the values of `field` to new values, for updating many rows in a single statement"""
+    return Case(*[When(**{field: old}, then=new) for old, new in mapping.items()], default=None)
+
+
+def users_for_bot(user_pks: Iterable[int], bot_id: int) -> Dict[int, int]:
+    """Map user settings to the settings of the same telegram users for another bot, missing ones are created"""
+    users = list(UserSettings.objects.filter(pk__in=set(user_pks)).values('pk', 'user_id', 'username', 'user_fullname'))
+    UserSettings.objects.bulk_create([UserSettings(user_id=user['user_id'], bot_id=bot_id, username=user['username'],
+                                                   user_fullname=user['user_fullname']) for user in users],
+                                     ignore_conflicts=True)
+    new_pks = dict(UserSettings.objects.filter(bot_id=bot_id, user_id__in=[user['user_id'] for user in users])
+                   .values_list('user_id', 'pk'))
+    return {user['pk']: new_pks[user['user_id']] for user in users}
+
+
+def merge_reactions(channel_pks: Iterable[int]) -> int:
+    """Merge reactions to the same message with the same emoji into the oldest one, returns how many were removed
+
+    The users of the removed reactions are added to the one which is kept.
+    """
+    kept = {}
+    merged_into = {}
+    for pk, channel, message, reaction in Reaction.objects.filter(channel_id__in=set(channel_pks)).order_by('pk') \
+            .values_list('pk', 'channel_id', 'message', 'reaction'):
+        key = (channel, message, reaction)
+        if key in kept:
+            merged_into[pk] = kept[key]
+        else:
+            kept[key] = pk
+    if not merged_into:
+        return 0
+
+    ReactionUsers.objects.bulk_create([ReactionUsers(reaction_id=merged_into[reaction], usersettings_id=user)
+                                       for reaction, user in ReactionUsers.objects.filter(reaction_id__in=merged_into)
+                                       .values_list('reaction_id', 'usersettings_id')], ignore_conflicts=True)
+    Reaction.objects.filter(pk__in=merged_into).delete()
+    return len(merged_into)
+
+
+def migrate_chunk(channel_pks: List[int], bot_id: int) -> Dict[str, int]:
+    """Move a few channels to another bot with a constant number of queries, returns what was done
+
+    Users are matched to their settings of the new bot which are created if missing, duplicates of a channel which
+    already exist for the new bot are merged into it together with their reactions.
+    """
+    channels = list(ChannelSettings.objects.filter(pk__in=channel_pks).exclude(bot_id=bot_id)
+                    .values('pk', 'channel_id', 'added_by'))
+    if not channels:
+        return {'channels': 0, 'users': 0, 'duplicates': 0, 'reactions': 0, 'merged_reactions': 0}
+    pks = [channel['pk'] for channel in channels]
+    pk_of_channel_id = {channel['channel_id']: channel['pk'] for channel in channels}
+
+    memberships = list(ChannelUsers.objects.filter(channelsettings_id__in=pks)
+                       .values_list('channelsettings_id', 'usersettings_id'))
+    new_users = users_for_bot([user for _, user in memberships] +
+                              [channel['added_by'] for channel in channels if channel['added_by']], bot_id)
+    migrated_users = len(new_users)
+
+    duplicates = dict(ChannelSettings.objects.filter(channel_id__in=pk_of_channel_id, bot_id=bot_id)
+                      .values_list('pk', 'channel_id'))
+    moved = merged = 0
+    if duplicates:
+        # Users of the duplicates already belong to the new bot and keep their access to the merged channel
+        memberships += [(pk_of_channel_id[duplicates[duplicate]], new_users.setdefault(user, user)) for duplicate, user
+                        in ChannelUsers.objects.filter(channelsettings_id__in=duplicates)
+                        .values_list('channelsettings_id', 'usersettings_id')]
+        moved = Reaction.objects.filter(channel_id__in=duplicates).update(channel_id=_case('channel_id', {
+            duplicate: pk_of_channel_id[channel_id] for duplicate, channel_id in duplicates.items()}))
+        merged = merge_reactions(pk_of_channel_id[channel_id] for channel_id in duplicates.values())
+        MediaGroup.objects.filter(channel_id__in=duplicates).delete()
+        UserSettings.objects.filter(current_channel_id__in=duplicates).update(current_channel=None)
+        ChannelSettings.objects.filter(pk__in=duplicates).delete()
+
+    Reaction.objects.filter(channel_id__in=pks).update(bot_id=bot_id)
+    MediaGroup.objects.filter(channel_id__in=pks).update(bot_id=bot_id)
+    added_by = {channel['pk']: new_users[channel['added_by']] for channel in channels if channel['added_by']}
+    ChannelSettings.objects.filter(pk__in=pks).update(bot_id=bot_id, added_by_id=_case('pk', added_by))
+
+    ChannelUsers.objects.filter(channelsettings_id__in=pks).delete()
+    ChannelUsers.objects.bulk_create([ChannelUsers(channelsettings_id=channel, usersettings_id=new_users[user])
+                                      for channel, user in memberships], ignore_conflicts=True)
+    return {'channels': len(pks), 'users': migrated_users, 'duplicates': len(duplicates), 'reactions': moved,
+            'merged_reactions': merged}
+
+
+def migrate_channels(channel_pks: Iterable[int], bot_id: int,
+                     chunk_size: int = MIGRATION_CHUNK_SIZE) -> Iterator[Dict[str, int]]:
+    """Move channels to another bot in chunks, each in its own transaction
+
+    Yields the result of every chunk together with the pk of its last channel, a migration which was interrupted can be
+    continued with the channels after it.
+    """
+    channel_pks = sorted(set(channel_pks))
+    for start in range(0, len(channel_pks), chunk_size):
+        chunk = channel_pks[start:start + chunk_size]
+        with transaction.atomic():
+            result = migrate_chunk(chunk, bot_id)
+        yield dict(result, last=chunk[-1])
+
+
+@job_handler('migrate_channels')
+def migrate_channels_job(payload: dict, checkpoint: dict or None) -> Iterator[Progress]:
+    checkpoint = checkpoint or {'last': 0, 'channels': 0, 'duplicates': 0}
+    channel_pks = payload['channels']
+    for result in migrate_channels([pk for pk in channel_pks if pk > checkpoint['last']], payload['bot_id']):
+        checkpoint = {
+            'last': result['last'],
+            'channels': checkpoint['channels'] + result['channels'],
+            'duplicates': checkpoint['duplicates'] + result['duplicates'],
+        }
+        yield Progress(done=sum(pk <= result['last'] for pk in channel_pks), total=len(channel_pks),
+                       checkpoint=checkpoint, message=f'Migrated {checkpoint["channels"]} channels and merged '
+                                                      f'{checkpoint["duplicates"]} duplicates')
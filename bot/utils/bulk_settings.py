@@ -0,0 +1,84 @@
+import json
+from typing import Dict, List, Tuple
+
+import emoji
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from bot.models.bot import Bot
+from bot.models.channel_settings import ChannelSettings
+from bot.utils.chat_cache import chat_cache, member_cache
+from bot.utils.media import Fonts
+
+# Settings which can be changed for many channels at once and the column they are stored in
+PATCHABLE_FIELDS = {
+    'caption': 'caption',
+    'image_caption': 'image_caption',
+    'image_caption_font': 'image_caption_font',
+    'image_caption_direction': 'image_caption_direction',
+    'image_caption_alpha': 'image_caption_alpha',
+    'reactions': '_reactions',
+}
+DIRECTIONS = [direction for direction, _ in ChannelSettings._meta.get_field('image_caption_direction').choices]
+
+
+def parse_reactions(text: str) -> List[str] or None:
+    """Emojis of the text like the reaction menu of the bot reads them, None to clear the reactions"""
+    reactions = [reaction['emoji'] for reaction in emoji.emoji_lis(text or '')]
+    return reactions or None
+
+
+def clean_patch(patch: Dict) -> Dict:
+    """Check a settings patch and turn it into the column values for the update, raises ValueError if it is invalid"""
+    unknown = set(patch) - set(PATCHABLE_FIELDS)
+    if unknown:
+        raise ValueError(f'Settings {", ".join(sorted(unknown))} can not be changed, use {", ".join(PATCHABLE_FIELDS)}')
+
+    values = {}
+    for field, value in patch.items():
+        if field in ('caption', 'image_caption'):
+            value = value or None
+        elif field == 'image_caption_font' and value not in Fonts:
+            raise ValueError(f'Unknown font "{value}", use one of: {", ".join(Fonts)}')
+        elif field == 'image_caption_direction' and value not in DIRECTIONS:
+            raise ValueError(f'Unknown direction "{value}", use one of: {", ".join(DIRECTIONS)}')
+        elif field == 'image_caption_alpha':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                value = None
+            if value is None or not 0 <= value <= 100:
+                raise ValueError('The opacity has to be an integer between 0 and 100')
+        elif field == 'reactions':
+            value = json.dumps(value or [])
+        values[PATCHABLE_FIELDS[field]] = value
+    return values
+
+
+def preview_settings(channels: QuerySet, patch: Dict) -> Tuple[int, int]:
+    """Number of channels and how many of them the patch would change"""
+    values = clean_patch(patch)
+    return channels.count(), channels.exclude(**values).count() if values else 0
+
+
+def apply_settings(channels: QuerySet, patch: Dict) -> int:
+    """Apply a settings patch to all channels with a single UPDATE, returns the number of changed channels
+
+    Channels which already have the settings are left alone. The settings themselves are read from the database for
+    every update, the cached chats and members of the changed channels are dropped in bulk afterwards. This only reaches
+    the caches of the current process, those of the bot processes catch up once their entries expire.
+    """
+    values = clean_patch(patch)
+    if not values:
+        return 0
+    changed = list(ChannelSettings.objects.filter(pk__in=channels.values('pk')).exclude(**values)
+                   .values_list('pk', 'bot_id', 'channel_id'))
+    if not changed:
+        return 0
+    updated = ChannelSettings.objects.filter(pk__in=[pk for pk, _, _ in changed]).exclude(**values) \
+        .update(modified=timezone.now(), **values)
+
+    chats = [(Bot.objects.token_for(bot_id), channel_id) for _, bot_id, channel_id in changed]
+    chat_cache.invalidate_many(chats)
+    member_cache.invalidate_many(chats)
+    return updated
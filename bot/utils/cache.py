@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Hashable, Iterable, Tuple
+
+_missing = object()
+
+
+class TTLCache:
+    """Thread safe and size bounded cache whose entries expire after `ttl` seconds
+
+    When the cache is full the least recently used entry is dropped.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_entry(self, key: Hashable) -> Tuple[Any, float] or None:
+        """Get value and age of an entry, None if there is no valid entry"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            stored_at, value = entry
+            age = monotonic() - stored_at
+            if age > self.ttl:
+                del self._data[key]
+                return
+            self._data.move_to_end(key)
+            return value, age
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get_entry(key) is not None
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _missing)
+        return default if entry is _missing else entry[1]
+
+    def pop_many(self, keys: Iterable[Hashable]):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def pop_matching(self, predicate: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -1,15 +1,27 @@
 import logging
-from typing import List
+from typing import Iterable, List, Set
+
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
 
 from telegram import Animation, Audio, Chat, ChatMember, Document, InlineKeyboardButton, InlineKeyboardMarkup, Message, PhotoSize, \
     User, Video, Voice
 from telegram.error import Unauthorized
 
+from bot.models.channel_settings import ChannelSettings
 from bot.models.usersettings import UserSettings
 from bot.telegrambot import my_bot
+from bot.utils.cache import TTLCache
+from bot.utils.chat_cache import member_cache
 
 bot_not_running_protect_logger = logging.getLogger('bot_not_running_protect')
 
+CHANNELS_PER_PAGE = 20
+# Callback data prefix of the navigation buttons of channel_selector_menu
+CHANNEL_PAGE = 'channel_page'
+# Rendered pages keyed by (user, prefix, page), other processes may change channels as well hence the ttl
+_channel_pages = TTLCache(ttl=600)
+
 
 def build_menu(*buttons: any,
                cols: int = None,
@@ -42,19 +54,94 @@ def is_media_message(msg: Message) -> bool:
     return is_media
 
 
+def _channel_rows(user: UserSettings, prefix: str, page: int) -> List[List[InlineKeyboardButton]]:
+    """Channel buttons of one page followed by the navigation row, cached until the user's channels change"""
+    key = (user.pk, prefix, page)
+    rows = _channel_pages.get(key)
+    if rows is None:
+        offset = page * CHANNELS_PER_PAGE
+        # One more than needed to know whether there is a next page
+        channels = list(user.channels.only('id', 'channel_id', 'channel_username', 'channel_title')
+                        .order_by('id')[offset:offset + CHANNELS_PER_PAGE + 1])
+
+        buttons = [InlineKeyboardButton(channel.name, callback_data=f'{prefix}:{channel.channel_id}')
+                   for channel in channels[:CHANNELS_PER_PAGE]]
+        rows = build_menu(*buttons) if buttons else []
+
+        navigation = []
+        if page and buttons:
+            navigation.append(InlineKeyboardButton('« Previous', callback_data=f'{CHANNEL_PAGE}:{page - 1}:{prefix}'))
+        if len(channels) > CHANNELS_PER_PAGE:
+            navigation.append(InlineKeyboardButton('Next »', callback_data=f'{CHANNEL_PAGE}:{page + 1}:{prefix}'))
+        if navigation:
+            rows.append(navigation)
+        _channel_pages.set(key, rows)
+    return rows
+
+
 def channel_selector_menu(user: UserSettings, prefix: str,
                           header_buttons: List[InlineKeyboardButton] = None,
-                          footer_buttons: List[InlineKeyboardButton] = None) -> InlineKeyboardMarkup or None:
-    if not user.channels:
+                          footer_buttons: List[InlineKeyboardButton] = None,
+                          page: int = 0) -> InlineKeyboardMarkup or None:
+    """Menu with a button per channel of the user, their callback data is `prefix:channel_id`
+
+    Long lists are split into pages of CHANNELS_PER_PAGE channels, see channel_selector_page.
+    """
+    rows = _channel_rows(user, prefix, page)
+    if not rows:
+        return
+    return InlineKeyboardMarkup(([header_buttons] if header_buttons else []) + rows +
+                                ([footer_buttons] if footer_buttons else []))
+
+
+def channel_selector_page(user: UserSettings, callback_data: str,
+                          current: InlineKeyboardMarkup = None) -> InlineKeyboardMarkup or None:
+    """Switch a menu from channel_selector_menu to the page of a navigation button's callback data
+
+    Header and footer buttons are taken over from the current menu.
+    """
+    _, page, prefix = callback_data.split(':', 2)
+    rows = _channel_rows(user, prefix, int(page)) or _channel_rows(user, prefix, 0)
+    if not rows:
+        return
+
+    current_rows = current.inline_keyboard if current else []
+    own = [index for index, row in enumerate(current_rows)
+           if any((button.callback_data or '').startswith((f'{prefix}:', f'{CHANNEL_PAGE}:')) for button in row)]
+    header = current_rows[:own[0]] if own else []
+    footer = current_rows[own[-1] + 1:] if own else []
+    return InlineKeyboardMarkup(header + rows + footer)
+
+
+def invalidate_channel_menus(user_ids: Iterable[int] = None):
+    """Drop the cached menus of the given users (UserSettings primary keys) or of everyone"""
+    if user_ids is None:
+        _channel_pages.clear()
+        return
+    user_ids = set(user_ids)
+    _channel_pages.pop_matching(lambda key: key[0] in user_ids)
+
+
+@receiver(m2m_changed, sender=ChannelSettings.users.through)
+def _channels_of_users_changed(sender, instance, action: str, pk_set: Set[int] = None, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, UserSettings):
+        invalidate_channel_menus([instance.pk])
+    else:
+        # pk_set is not given on clear
+        invalidate_channel_menus(pk_set)
+
+
+@receiver(post_save, sender=ChannelSettings)
+def _channel_renamed(sender, instance: ChannelSettings, update_fields: Set[str] = None, **kwargs):
+    if update_fields and not {'channel_username', 'channel_title'} & set(update_fields):
         return
-    buttons = []
-    for channel in user.channels.all():
-        buttons.append(InlineKeyboardButton(channel.name, callback_data=f'{prefix}:{channel.channel_id}'))
-    return InlineKeyboardMarkup(build_menu(*buttons, header_buttons=header_buttons, footer_buttons=footer_buttons))
+    invalidate_channel_menus(instance.users.values_list('pk', flat=True))
 
 
 def check_user_permissions(user: User, channel: Chat) -> bool:
-    user_member: ChatMember = channel.get_member(user.id)
+    user_member: ChatMember = member_cache.get_member(channel.bot, channel.id, user.id)
 
     if user_member.status not in [user_member.ADMINISTRATOR, user_member.CREATOR]:
         raise Unauthorized('User is not an admin of the channel.')
@@ -62,8 +149,13 @@ def check_user_permissions(user: User, channel: Chat) -> bool:
 
 
 def check_bot_permissions(channel: Chat) -> bool:
+    me = my_bot.me()
+    if not me:
+        # get_me failed, the membership cannot be verified right now
+        raise Unauthorized('Could not verify my membership in the channel, please try again later.')
+
     try:
-        member = channel.get_member(my_bot.me().id)
+        member = member_cache.get_member(channel.bot, channel.id, me.id)
         if member.status == member.LEFT:
             raise Unauthorized('Not a member')
     except Unauthorized:
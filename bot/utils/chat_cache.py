@@ -0,0 +1,187 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Tuple
+
+from telegram import Bot, Chat, ChatMember, TelegramError
+from telegram.error import BadRequest, Unauthorized
+
+from bot.utils.cache import TTLCache
+from bot.utils.internal import resolve_promise
+from bot.utils.rate_limit import RateLimiter
+
+logger = logging.getLogger('ChatCache')
+
+
+class ChatCache:
+    """Process wide cache of chats and their links keyed by (bot_token, chat_id)
+
+    Entries older than `refresh_after` seconds are still served but refreshed in the background. Failed lookups are
+    remembered for `error_ttl` seconds so that unreachable chats don't cost an API call every time. Links are kept
+    longer than the chats themselves, because exporting an invite link revokes the previous one.
+    """
+
+    def __init__(self, ttl: float = 3600, refresh_after: float = 900, link_ttl: float = 24 * 3600,
+                 error_ttl: float = 300, max_size: int = 10000, workers: int = 8):
+        self.refresh_after = refresh_after
+
+        self._chats = TTLCache(ttl=ttl, max_size=max_size)
+        self._links = TTLCache(ttl=link_ttl, max_size=max_size)
+        self._errors = TTLCache(ttl=error_ttl, max_size=max_size)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ChatCache')
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, bot: Bot, chat_id: int) -> Chat:
+        key = (bot.token, chat_id)
+        try:
+            chat = resolve_promise(bot.get_chat(chat_id))
+        except TelegramError as e:
+            self._errors.set(key, e)
+            self._chats.pop(key)
+            raise
+        self._errors.pop(key)
+        self._chats.set(key, chat)
+        return chat
+
+    def _refresh(self, bot: Bot, chat_id: int):
+        key = (bot.token, chat_id)
+        try:
+            self._fetch(bot, chat_id)
+        except Exception as e:
+            logger.info(f'Could not refresh chat {chat_id}: {e}')
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, bot: Bot, chat_id: int):
+        key = (bot.token, chat_id)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, bot, chat_id)
+
+    def get_chat(self, bot: Bot, chat_id: int) -> Chat:
+        """Get a chat, raises the TelegramError of the last lookup if the chat could not be fetched recently"""
+        key = (bot.token, chat_id)
+        error = self._errors.get(key)
+        if error:
+            raise error
+
+        entry = self._chats.get_entry(key)
+        if entry is None:
+            return self._fetch(bot, chat_id)
+
+        chat, age = entry
+        if age > self.refresh_after:
+            self._refresh_in_background(bot, chat_id)
+        return chat
+
+    def get_link(self, bot: Bot, chat_id: int) -> str or None:
+        key = (bot.token, chat_id)
+        link = self._links.get(key)
+        if link is None:
+            chat = self.get_chat(bot, chat_id)
+            link = chat.link or chat.invite_link or resolve_promise(bot.export_chat_invite_link(chat_id))
+            self._links.set(key, link)
+        return link
+
+    def cached_link(self, bot_token: str, chat_id: int) -> str or None:
+        """Link from the cache only, never calls the API"""
+        key = (bot_token, chat_id)
+        link = self._links.get(key)
+        if link is None:
+            chat = self._chats.get(key)
+            link = chat and (chat.link or chat.invite_link)
+        return link
+
+    def prefetch_links(self, bot: Bot, chat_ids: Iterable[int], timeout: float = 10) -> Dict[int, str or None]:
+        """Fill the cache for many chats at once, the missing ones are fetched concurrently"""
+        links = {}
+        missing = []
+        for chat_id in chat_ids:
+            key = (bot.token, chat_id)
+            if key in self._links:
+                links[chat_id] = self._links.get(key)
+            elif key not in self._errors:
+                missing.append(chat_id)
+
+        futures = {self._executor.submit(self.get_link, bot, chat_id): chat_id for chat_id in missing}
+        done, _ = wait(futures, timeout=timeout)
+        for future in done:
+            if not future.exception():
+                links[futures[future]] = future.result()
+        return links
+
+    def fetch_many(self, bot: Bot, chat_ids: Iterable[int], limiter: RateLimiter = None,
+                   timeout: float = 60) -> Dict[int, Chat or TelegramError]:
+        """Fetch many chats concurrently bypassing the cache, returns the chat or the error of every lookup
+
+        The lookups are started no faster than the limiter allows for the bot. Lookups which did not finish within
+        `timeout` seconds are left out.
+        """
+        futures = {}
+        for chat_id in chat_ids:
+            if limiter:
+                limiter.acquire(bot.token)
+            futures[self._executor.submit(self._fetch, bot, chat_id)] = chat_id
+
+        results = {}
+        done, _ = wait(futures, timeout=timeout)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                results[futures[future]] = future.result()
+            elif isinstance(error, TelegramError):
+                results[futures[future]] = error
+        return results
+
+    def invalidate(self, bot_token: str, chat_id: int):
+        key = (bot_token, chat_id)
+        self._chats.pop(key)
+        self._errors.pop(key)
+
+    def invalidate_many(self, keys: Iterable[Tuple[str, int]]):
+        keys = list(keys)
+        self._chats.pop_many(keys)
+        self._errors.pop_many(keys)
+
+
+class MemberCache:
+    """Short lived cache of chat members and with it their rights, keyed by (bot_token, chat_id, user_id)
+
+    Telegram does not tell us about changed admin rights, so entries only live for `ttl` seconds. All entries of a chat
+    are dropped as soon as the chat returns an Unauthorized or BadRequest error.
+    """
+
+    def __init__(self, ttl: float = 60, max_size: int = 10000):
+        self._members = TTLCache(ttl=ttl, max_size=max_size)
+
+    def get_member(self, bot: Bot, chat_id: int, user_id: int) -> ChatMember:
+        key = (bot.token, chat_id, user_id)
+        member = self._members.get(key)
+        if member is None:
+            try:
+                member = resolve_promise(bot.get_chat_member(chat_id=chat_id, user_id=user_id))
+            except (Unauthorized, BadRequest):
+                self.invalidate(bot.token, chat_id)
+                raise
+            self._members.set(key, member)
+        return member
+
+    def invalidate(self, bot_token: str, chat_id: int, user_id: int = None):
+        if user_id is not None:
+            self._members.pop((bot_token, chat_id, user_id))
+        else:
+            self._members.pop_matching(lambda key: key[:2] == (bot_token, chat_id))
+
+    def invalidate_many(self, chats: Iterable[Tuple[str, int]]):
+        """Drop all entries of the given (bot_token, chat_id) pairs in a single pass"""
+        chats = set(chats)
+        self._members.pop_matching(lambda key: key[:2] in chats)
+
+
+chat_cache = ChatCache()
+member_cache = MemberCache()
@@ -0,0 +1,47 @@
+import logging
+import threading
+from time import sleep
+
+from django.utils import timezone
+
+from bot.models.post import Post
+from bot.models.processed_update import ProcessedUpdate
+from bot.utils.db import db_pool
+
+logger = logging.getLogger('Cleanup')
+
+# Models whose rows are deleted once their `created` is older than their KEEP
+PRUNED_MODELS = [Post, ProcessedUpdate]
+
+
+def prune():
+    for model in PRUNED_MODELS:
+        deleted, _ = model.objects.filter(created__lt=timezone.now() - model.KEEP).delete()
+        if deleted:
+            logger.info(f'Deleted {deleted} old {model.__name__} rows')
+
+
+class CleanupScheduler:
+    """Prunes old rows of the models which are only kept for a while, every process does so on its own"""
+
+    def __init__(self, check_interval: float = 3600):
+        self.check_interval = check_interval
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='CleanupScheduler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with db_pool.connection():
+                    prune()
+            except Exception as e:
+                logger.exception(e)
+            sleep(self.check_interval)
+
+
+cleanup_scheduler = CleanupScheduler()
@@ -0,0 +1,104 @@
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Set
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger('ConnectionPool')
+
+
+class ConnectionPool:
+    """Lifecycle of the database connections of the bot's worker threads
+
+    Django opens a connection per thread and only cleans up after web requests, so every job which runs outside of a
+    request has to go through `connection()` (or be wrapped with `job`):
+
+    - Broken connections and those older than CONN_MAX_AGE are closed before and after the job, the next query opens a
+      fresh one. This also recovers the threads after a database restart.
+    - At most `size` jobs use the database at the same time, further ones wait for a slot. Threads whose number is
+      bounded anyway, like the workers of the task scheduler, pass limit=False and never wait. The pool is sized for
+      them, see DB_POOL_SIZE.
+    - After a job its thread keeps its connection for reuse as long as less than `size` threads do, otherwise it is
+      closed. So the process holds at most `size` idle connections no matter how many bots and workers there are.
+
+    Threads which are about to end should pass keep=False. Nested use in the same thread is a no-op.
+    """
+
+    def __init__(self, size: int = None):
+        self._size = size
+        self._slots = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._keeping: Set[threading.Thread] = set()
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = getattr(settings, 'DB_POOL_SIZE', 10)
+        return self._size
+
+    def _get_slots(self) -> threading.BoundedSemaphore:
+        with self._lock:
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(self.size)
+            return self._slots
+
+    @staticmethod
+    def _is_open() -> bool:
+        return any(connection.connection is not None for connection in connections.all())
+
+    def _keep_or_close(self, keep: bool):
+        thread = threading.current_thread()
+        with self._lock:
+            self._keeping = {kept for kept in self._keeping if kept.is_alive()}
+            if not self._is_open():
+                self._keeping.discard(thread)
+                return
+            if not keep:
+                self._keeping.discard(thread)
+            elif thread in self._keeping or len(self._keeping) < self.size:
+                self._keeping.add(thread)
+                return
+
+        for connection in connections.all():
+            connection.close()
+
+    @contextmanager
+    def connection(self, keep: bool = True, limit: bool = True):
+        if getattr(self._local, 'active', False):
+            yield
+            return
+
+        slots = self._get_slots() if limit else None
+        if slots:
+            slots.acquire()
+        self._local.active = True
+        try:
+            close_old_connections()
+            yield
+        finally:
+            self._local.active = False
+            try:
+                close_old_connections()
+                self._keep_or_close(keep)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                if slots:
+                    slots.release()
+
+    def job(self, func: Callable, keep: bool = True) -> Callable:
+        """Decorate a function to run it within `connection()`"""
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.connection(keep=keep):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+db_pool = ConnectionPool()
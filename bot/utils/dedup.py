@@ -0,0 +1,117 @@
+import logging
+import threading
+from collections import deque
+from time import monotonic
+from typing import Deque, Hashable, Iterable, List, Set, Tuple
+
+from django.db import IntegrityError, transaction
+from telegram import Bot, Update
+
+from bot.models.processed_update import ProcessedUpdate
+
+logger = logging.getLogger('Dedup')
+
+
+class DedupIndex:
+    """Thread safe set of the keys seen in the last `ttl` seconds
+
+    Keys are kept in one set per `ttl / buckets` seconds, so expiring keys is dropping the oldest set. When there are
+    more than `max_size` keys the oldest sets are dropped early, even the current one.
+    """
+
+    def __init__(self, ttl: float = 600, buckets: int = 10, max_size: int = 100000):
+        self.width = ttl / buckets
+        self.buckets = buckets
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._sets: Deque[Tuple[int, Set[Hashable]]] = deque()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            self._expire(int(monotonic() // self.width))
+            return any(key in keys for _, keys in self._sets)
+
+    def add_all(self, keys: Iterable[Hashable]) -> bool:
+        """Remember the keys, returns False if any of them was seen before"""
+        keys = list(keys)
+        bucket = int(monotonic() // self.width)
+        with self._lock:
+            self._expire(bucket)
+            seen = any(key in bucket_keys for _, bucket_keys in self._sets for key in keys)
+
+            if not self._sets or self._sets[-1][0] != bucket:
+                self._sets.append((bucket, set()))
+            current = self._sets[-1][1]
+            self._size -= len(current)
+            current.update(keys)
+            self._size += len(current)
+
+            # Forgetting keys early only costs a lookup in the database
+            while self._size > self.max_size:
+                self._size -= len(self._sets.popleft()[1])
+        return not seen
+
+    def _expire(self, bucket: int):
+        while self._sets and self._sets[0][0] <= bucket - self.buckets:
+            self._size -= len(self._sets.popleft()[1])
+
+
+def update_keys(bot: Bot, update: Update) -> List[str]:
+    """Keys which are the same if Telegram delivers an update again
+
+    Besides the update id a new message is also known by its chat and message id, which stay the same even if Telegram
+    starts counting update ids anew. Edits are not, a message may be edited many times.
+    """
+    # Just the id part of the token, the keys are stored
+    bot_id = bot.token.split(':')[0]
+    keys = [f'update:{bot_id}:{update.update_id}']
+    for operation in ('message', 'channel_post'):
+        message = getattr(update, operation)
+        if message:
+            keys.append(f'{operation}:{bot_id}:{message.chat_id}:{message.message_id}')
+    return keys
+
+
+class UpdateDedup:
+    """Skips updates which were handled already
+
+    Updates are looked up in the index of the current process first and only reach the database if they are new to the
+    process, where the key's unique constraint decides which process handles an update delivered to several of them.
+
+    Handling is at most once: keys are stored before the update is handled and stay stored if the handler fails or the
+    process dies meanwhile. Telegram got its answer by then (the webhook responded, the polling offset moved on) and
+    won't deliver the update again on its own, so releasing the keys would only let a stray redelivery through. Work
+    which has to survive failures goes through the outbox, which the handlers of channel posts enqueue right away.
+    """
+
+    def __init__(self, index: DedupIndex = None):
+        self.index = index or DedupIndex()
+
+    def seen_recently(self, keys: List[str]) -> bool:
+        """Whether this process saw any of the keys in the last minutes, remembers them either way"""
+        if self.index.add_all(keys):
+            return False
+        logger.info(f'Skipping {keys[0]}, it was delivered before')
+        return True
+
+    @staticmethod
+    def claim(keys: List[str]) -> bool:
+        """Store the keys, returns False if any of them was stored before by this or another process
+
+        All keys or none are stored, an update which shares a single key with a claimed one is skipped as a whole.
+        """
+        try:
+            with transaction.atomic():
+                ProcessedUpdate.objects.bulk_create([ProcessedUpdate(key=key) for key in keys])
+        except IntegrityError:
+            logger.info(f'Skipping {keys[0]}, another process handled it already')
+            return False
+        return True
+
+
+update_dedup = UpdateDedup()
@@ -0,0 +1,100 @@
+import csv
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+from uuid import uuid4
+
+from django.conf import settings
+from django.db.models import Count, QuerySet
+
+from bot.models.channel_settings import ChannelSettings
+from bot.models.reactions import Reaction
+from bot.utils.jobs import Progress, job_handler
+
+REACTION_EXPORT_FIELDS = ['channel_id', 'channel', 'message', 'reaction', 'total']
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_PROGRESS_EVERY = 10000
+
+
+class _Echo:
+    """File like object which just hands back what is written to it, used to stream csv rows"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def reaction_counts_queryset(channels: QuerySet = None) -> QuerySet:
+    reactions = Reaction.objects.all()
+    if channels is not None:
+        reactions = reactions.filter(channel__in=channels)
+
+    return (reactions
+            .values('channel__channel_id', 'channel__channel_username', 'channel__channel_title', 'message', 'reaction')
+            .annotate(total=Count('users'))
+            .order_by('channel__channel_id', 'message', 'reaction'))
+
+
+def reaction_counts(channels: QuerySet = None, chunk_size: int = 2000) -> Iterator[Dict]:
+    """Per channel and message reaction counts
+
+    The counting is done by the database and the rows are read with a server side cursor so that exporting big channels
+    runs in constant memory.
+    """
+    rows = reaction_counts_queryset(channels)
+    for row in rows.iterator(chunk_size=chunk_size):
+        username = row['channel__channel_username']
+        yield {
+            'channel_id': row['channel__channel_id'],
+            'channel': f'@{username}' if username else row['channel__channel_title'],
+            'message': row['message'],
+            'reaction': row['reaction'],
+            'total': row['total'],
+        }
+
+
+def as_csv(rows: Iterable[Dict]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(REACTION_EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in REACTION_EXPORT_FIELDS])
+
+
+def as_ndjson(rows: Iterable[Dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def export_reactions(channels: QuerySet = None, export_format: str = 'csv') -> Iterator[str]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format "{export_format}", use one of: {", ".join(EXPORT_FORMATS)}')
+
+    rows = reaction_counts(channels)
+    if export_format == 'ndjson':
+        return as_ndjson(rows)
+    return as_csv(rows)
+
+
+def export_file_name(export_format: str) -> str:
+    return f'reactions-{uuid4().hex}.{export_format}'
+
+
+@job_handler('export_reactions')
+def export_reactions_job(payload: dict, checkpoint: dict or None) -> Iterator[Progress]:
+    """Write an export to the exports folder of the media root, an interrupted export starts over since it changes
+    nothing"""
+    path = Path(settings.MEDIA_ROOT) / 'exports' / payload['file']
+    path.parent.mkdir(parents=True, exist_ok=True)
+    channels = None
+    if payload.get('channels') is not None:
+        channels = ChannelSettings.objects.filter(pk__in=payload['channels'])
+
+    lines = 0
+    with path.open('w', encoding='utf-8', newline='') as file:
+        for lines, line in enumerate(export_reactions(channels, payload['format']), 1):
+            file.write(line)
+            if lines % EXPORT_PROGRESS_EVERY == 0:
+                yield Progress(done=lines, message=f'{lines} lines written')
+    yield Progress(done=lines, total=lines, message=f'{lines} lines written', result=path.as_posix())
@@ -0,0 +1,86 @@
+import threading
+from time import monotonic
+from typing import Dict, Set
+
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from bot.models.bot import Bot
+from bot.models.channel_settings import ChannelSettings
+
+
+class ForwardGraph:
+    """In memory graph of the configured forwarders (ChannelSettings.forward_to) per bot
+
+    The graph is built lazily and dropped whenever forwarders are saved or channels are deleted. Other processes can
+    change forwarders as well, so it is rebuilt after `ttl` seconds in any case. Zombie channels are left out as
+    targets, but their edges still count for loops, a zombie which comes back would close them again.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # Per bot: source -> target -> whether the target is a zombie
+        self._edges: Dict[str, Dict[int, Dict[int, bool]]] or None = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._edges = None
+
+    def _graph(self, bot_token: str) -> Dict[int, Dict[int, bool]]:
+        with self._lock:
+            if self._edges is None or monotonic() - self._built_at > self.ttl:
+                self._edges = self._build()
+                self._built_at = monotonic()
+            return self._edges.get(bot_token, {})
+
+    @staticmethod
+    def _build() -> Dict[str, Dict[int, Dict[int, bool]]]:
+        edges = {}
+        rows = ChannelSettings.forward_to.through.objects \
+            .values_list('from_channelsettings__bot_id',
+                         'from_channelsettings__channel_id',
+                         'to_channelsettings__channel_id',
+                         'to_channelsettings__zombie')
+        for bot_id, source, target, zombie in rows.iterator():
+            edges.setdefault(Bot.objects.token_for(bot_id), {}).setdefault(source, {})[target] = zombie
+        return edges
+
+    def targets(self, bot_token: str, channel_id: int) -> Set[int]:
+        """Channels a message posted in the given channel is forwarded to, zombies are skipped"""
+        return {target for target, zombie in self._graph(bot_token).get(channel_id, {}).items() if not zombie}
+
+    def reachable(self, bot_token: str, channel_id: int) -> Set[int]:
+        """All channels a message posted in the given channel ends up in, counting zombies as if they came back"""
+        graph = self._graph(bot_token)
+        seen = set()
+        todo = [channel_id]
+        while todo:
+            for target in graph.get(todo.pop(), ()):
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+        return seen
+
+    def is_target(self, bot_token: str, channel_id: int) -> bool:
+        """Messages of some channel are forwarded into the given one"""
+        return any(channel_id in targets for targets in self._graph(bot_token).values())
+
+    def is_upstream(self, bot_token: str, source_id: int, channel_id: int) -> bool:
+        """Messages from source_id are forwarded, directly or via other channels, into channel_id"""
+        return channel_id in self.reachable(bot_token, source_id)
+
+    def creates_cycle(self, bot_token: str, source_id: int, target_id: int) -> bool:
+        return source_id == target_id or self.is_upstream(bot_token, target_id, source_id)
+
+
+forward_graph = ForwardGraph()
+
+
+@receiver(m2m_changed, sender=ChannelSettings.forward_to.through)
+@receiver(post_delete, sender=ChannelSettings)
+def invalidate_forward_graph(sender, action: str = 'post_delete', **kwargs):
+    if action.startswith('post_'):
+        forward_graph.invalidate()
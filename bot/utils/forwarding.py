@@ -0,0 +1,291 @@
+import json
+import logging
+import threading
+from datetime import timedelta
+from time import monotonic, sleep, time
+from typing import Callable, Dict, Hashable, Iterable, List
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from telegram import Bot, InputMediaPhoto, InputMediaVideo, Message, ParseMode
+
+from bot.models.bot import Bot as BotModel
+from bot.models.outbox import Outbox
+from bot.models.post import Post
+from bot.utils.db import db_pool
+from bot.utils.internal import resolve_promise
+from bot.utils.outbox import enqueue, outbox_handler, outbox_worker
+from bot.utils.rate_limit import RateLimiter
+from bot.utils.scheduler import FORWARDS, task_scheduler
+from bot.utils.workers import KeyedWorkers
+
+logger = logging.getLogger('Forwarding')
+
+# Seconds to wait for further messages of an album before it is sent on
+ALBUM_COLLECT_DELAY = 3
+# Seconds after its first message an album is sent on even if some of its messages are still waiting for their edit
+ALBUM_MAX_WAIT = 240
+# Seconds after which the messages of an album are forwarded one by one in case the album was not sent as a whole,
+# e.g. because the process was restarted while collecting it. Must stay above ALBUM_MAX_WAIT.
+ALBUM_FALLBACK_DELAY = 300
+ALBUM_SEND_TIMEOUT = 60
+# Sent albums are checked this long for the copies coming back as updates of their target
+ALBUM_COPIES_KEEP = timedelta(minutes=10)
+ALBUM_MAX_SIZE = 10
+MEDIA_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+}
+
+# Telegram allows about 20 messages per minute into the same channel
+forward_limiter = RateLimiter(rate=20, per=60, burst=5)
+forward_workers = KeyedWorkers('forward')
+
+
+class AlbumCollector:
+    """Collect the messages of an album until all of them are in
+
+    Telegram delivers every message of an album as a separate update, this puts them back together. Messages are added
+    once their edit is done and the edits of a channel run one after another, so with watermarks they come in seconds
+    apart. An album is sent on once no message came in for `delay` seconds and `pending` tells that none of its
+    messages still waits for its edit, or at the latest `max_wait` seconds after its first message.
+    """
+
+    def __init__(self, delay: float = ALBUM_COLLECT_DELAY, max_wait: float = ALBUM_MAX_WAIT):
+        self.delay = delay
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._albums: Dict[Hashable, Dict[int, Message]] = {}
+        self._started: Dict[Hashable, float] = {}
+        self._timers: Dict[Hashable, threading.Timer] = {}
+
+    def add(self, key: Hashable, message: Message, callback: Callable[[List[Message]], None],
+            pending: Callable[[List[int]], bool] = None):
+        """Add a message to the album of the given key
+
+        Args:
+            callback: Called with the messages of the album in order once it is complete
+            pending: Called with the ids of the collected messages, whether further messages are still to come
+        """
+        with self._lock:
+            self._albums.setdefault(key, {})[message.message_id] = message
+            self._started.setdefault(key, monotonic())
+            self._schedule(key, callback, pending)
+
+    def _schedule(self, key: Hashable, callback: Callable[[List[Message]], None],
+                  pending: Callable[[List[int]], bool] or None):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        timer = self._timers[key] = threading.Timer(self.delay, self._flush, args=(key, callback, pending))
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, key: Hashable, callback: Callable[[List[Message]], None],
+               pending: Callable[[List[int]], bool] or None):
+        timer = threading.current_thread()
+        with self._lock:
+            message_ids = sorted(self._albums.get(key, ()))
+            waited = monotonic() - self._started.get(key, 0)
+
+        waiting = False
+        if pending and message_ids and waited < self.max_wait:
+            try:
+                waiting = pending(message_ids)
+            except Exception as e:
+                logger.exception(e)
+
+        with self._lock:
+            if self._timers.get(key) is not timer:
+                # Another message came in meanwhile, its timer takes over
+                return
+            if waiting:
+                self._schedule(key, callback, pending)
+                return
+            del self._timers[key]
+            self._started.pop(key, None)
+            album = self._albums.pop(key, {})
+
+        if album:
+            callback([album[message_id] for message_id in sorted(album)])
+
+
+album_collector = AlbumCollector()
+
+
+def _in_target_worker(func: Callable, entry: Outbox):
+    """Run on the worker of the target, so that a slow or banned target only holds up itself
+
+    The rate limit is waited for before the entry is executed, so that waiting does not hold a database connection or a
+    slot of the forwards lane. The worker waits for the entry so that forwards to the same target stay in order.
+    """
+    target = entry.payload['target']
+
+    def job():
+        forward_limiter.acquire(target)
+        task_scheduler.run(FORWARDS, func, entry)
+
+    forward_workers.submit(target, job)
+
+
+@outbox_handler('forward', executor=_in_target_worker, lane=FORWARDS)
+def forward_to_target(bot: Bot, payload: dict):
+    resolve_promise(bot.forward_message(payload['target'], payload['chat_id'], payload['message_id']))
+
+
+@outbox_handler('album', executor=_in_target_worker, lane=FORWARDS)
+def send_album_to_target(bot: Bot, payload: dict):
+    """Send an album as a single media group with its items in order
+
+    The entry notes when it is being sent and afterwards which messages the copies are, see `is_album_copy`.
+    """
+    media = [MEDIA_TYPES[item['type']](item['media'], caption=item.get('caption'), parse_mode=item.get('parse_mode'))
+             for item in payload['media']]
+    _note_album(bot.token, payload, sending_at=time())
+    sent = resolve_promise(bot.send_media_group(payload['target'], media, timeout=ALBUM_SEND_TIMEOUT))
+    _note_album(bot.token, payload, copies=[message.message_id for message in sent or []])
+
+
+def _note_album(bot_token: str, payload: dict, **values):
+    if not payload.get('media_group_id'):
+        # Queued before albums were noted
+        return
+    payload.update(values)
+    key = _album_key(bot_token, payload['target'], payload['chat_id'], payload['media_group_id'])
+    Outbox.objects.filter(key=key).update(_payload=json.dumps(payload))
+
+
+def is_album_copy(message: Message, wait: float = ALBUM_SEND_TIMEOUT) -> bool:
+    """Whether the message is a copy of an album we sent into its channel
+
+    The updates of the copies can come in before sendMediaGroup returned, so an album which is being sent into the
+    channel right now is waited for, up to `wait` seconds.
+    """
+    prefix = f'album:{BotModel.objects.id_for(message.bot.token)}:{message.chat_id}:'
+    deadline = monotonic() + wait
+    while True:
+        sending = False
+        # A range instead of startswith, which can't use the index of the key everywhere
+        entries = Outbox.objects.filter(key__gt=prefix, key__lt=f'{prefix[:-1]};') \
+            .filter(Q(state=Outbox.PENDING) | Q(modified__gte=timezone.now() - ALBUM_COPIES_KEEP))
+        for entry in entries:
+            payload = entry.payload
+            if 'copies' in payload:
+                if message.message_id in payload['copies']:
+                    return True
+            elif payload.get('sending_at', 0) > time() - ALBUM_SEND_TIMEOUT:
+                sending = True
+
+        if not sending or monotonic() > deadline:
+            return False
+        sleep(1)
+
+
+def album_media(messages: List[Message]) -> List[dict] or None:
+    """Build the media for sendMediaGroup, None if the album holds anything but photos and videos"""
+    media = []
+    for message in messages:
+        caption = message.caption_html
+        parse_mode = ParseMode.HTML if caption else None
+        if message.photo:
+            media.append(InputMediaPhoto(message.photo[-1], caption=caption, parse_mode=parse_mode).to_dict())
+        elif message.video:
+            media.append(InputMediaVideo(message.video, caption=caption, parse_mode=parse_mode).to_dict())
+        else:
+            return
+    return media
+
+
+def auto_edit_key(bot_id: int, chat_id: int, message_id: int) -> str:
+    """Key of the outbox entry which edits a channel post, see AutoEdit"""
+    return f'auto_edit:{bot_id}:{chat_id}:{message_id}'
+
+
+def _forward_key(bot_token: str, target: int, chat_id: int, message_id: int) -> str:
+    # Several bots may forward from the same channel, each of them needs its own entries
+    return f'forward:{BotModel.objects.id_for(bot_token)}:{target}:{chat_id}:{message_id}'
+
+
+def _album_key(bot_token: str, target: int, chat_id: int, media_group_id: str) -> str:
+    return f'album:{BotModel.objects.id_for(bot_token)}:{target}:{chat_id}:{media_group_id}'
+
+
+def enqueue_forward(message: Message, target: int, delay: float = 0):
+    key = _forward_key(message.bot.token, target, message.chat_id, message.message_id)
+    enqueue('forward', message.bot.token, key, {
+        'target': target,
+        'chat_id': message.chat_id,
+        'message_id': message.message_id,
+    }, delay=delay)
+
+
+def enqueue_album(messages: List[Message], targets: List[int]):
+    """Replace the fallback forwards of the album's messages by a single media group per target
+
+    If the album can't be sent as a media group the fallback forwards are made due right away instead.
+    """
+    first = messages[0]
+    media = album_media(messages)
+
+    def fallbacks(target: int, message_ids: List[int]):
+        keys = [_forward_key(first.bot.token, target, first.chat_id, message_id) for message_id in message_ids]
+        return Outbox.objects.filter(key__in=keys, state=Outbox.PENDING)
+
+    message_ids = [message.message_id for message in messages]
+    for target in targets:
+        if not media or not 2 <= len(media) <= ALBUM_MAX_SIZE:
+            fallbacks(target, message_ids).update(available_at=timezone.now())
+            outbox_worker.wake()
+            continue
+
+        sent_ids = message_ids
+        with transaction.atomic():
+            key = _album_key(first.bot.token, target, first.chat_id, first.media_group_id)
+            if not enqueue('album', first.bot.token, key, {
+                'target': target,
+                'chat_id': first.chat_id,
+                'media_group_id': first.media_group_id,
+                'message_ids': message_ids,
+                'media': media,
+            }):
+                # The album was sent on before, items which arrived later than that are forwarded one by one
+                sent_ids = Outbox.objects.get(key=key).payload['message_ids']
+                late_ids = [message_id for message_id in message_ids if message_id not in sent_ids]
+                if late_ids:
+                    fallbacks(target, late_ids).update(available_at=timezone.now())
+                    transaction.on_commit(outbox_worker.wake)
+            fallbacks(target, sent_ids).update(state=Outbox.DONE, modified=timezone.now())
+
+
+def _album_edits_pending(message: Message, collected: List[int]) -> bool:
+    """Whether posts of the message's album besides the collected ones still wait for their edit"""
+    bot_id = BotModel.objects.id_for(message.bot.token)
+    message_ids = Post.objects.filter(channel__bot_id=bot_id, channel__channel_id=message.chat_id,
+                                      media_group_id=message.media_group_id) \
+        .exclude(message_id__in=collected) \
+        .values_list('message_id', flat=True)
+    keys = [auto_edit_key(bot_id, message.chat_id, message_id) for message_id in message_ids]
+    return bool(keys) and Outbox.objects.filter(key__in=keys, state=Outbox.PENDING).exists()
+
+
+def forward_to_targets(message: Message, targets: Iterable[int]):
+    """Forward a message to all targets via the outbox
+
+    Messages belonging to an album are collected first and then sent on as a whole, see `AlbumCollector`.
+    """
+    targets = list(targets)
+    if not targets:
+        return
+
+    if not message.media_group_id:
+        for target in targets:
+            enqueue_forward(message, target)
+        return
+
+    for target in targets:
+        enqueue_forward(message, target, delay=ALBUM_FALLBACK_DELAY)
+    album_collector.add((message.bot.token, message.chat_id, message.media_group_id), message,
+                        db_pool.job(lambda messages: enqueue_album(messages, targets), keep=False),
+                        db_pool.job(lambda message_ids: _album_edits_pending(message, message_ids), keep=False))
@@ -1,14 +1,33 @@
 import inspect
 import logging
+import os
+import sys
 from functools import wraps
 from typing import Callable, Type
 
 from telegram import Bot, Update
 from telegram.ext import Dispatcher
-from django_telegrambot.apps import DjangoTelegramBot
+from telegram.utils.promise import Promise
 
 bot_not_running_protect_logger = logging.getLogger('bot_not_running_protect')
 
+# Management commands which handle telegram updates, all others only need the models
+BOT_MANAGEMENT_COMMANDS = ('runserver', 'botpolling')
+
+
+def is_bot_process() -> bool:
+    """Whether this process handles telegram updates and therefore needs the plugins
+
+    Can be forced with the BOT_PROCESS environment variable, e.g. for gunicorn workers which only serve the admin.
+    """
+    forced = os.environ.get('BOT_PROCESS')
+    if forced is not None:
+        return forced.lower() not in ('0', 'false', 'no', '')
+
+    if sys.argv and os.path.basename(sys.argv[0]) == 'manage.py':
+        return len(sys.argv) > 1 and sys.argv[1] in BOT_MANAGEMENT_COMMANDS
+    return True
+
 
 def bot_not_running_protect(func):
     """Prevent a function call if bot is not running
@@ -54,9 +73,9 @@ def set_thread_locals(base: Dispatcher or Bot or Update, update=None):
     if isinstance(base, Dispatcher):
         dispatcher = base
     elif isinstance(base, Bot):
-        dispatcher = DjangoTelegramBot.get_dispatcher(base.token)
+        dispatcher = tb.my_bot.get_dispatcher(base.token)
     elif isinstance(base, Update) and base.effective_chat:
-        dispatcher = DjangoTelegramBot.get_dispatcher(base.effective_chat.bot.token)
+        dispatcher = tb.my_bot.get_dispatcher(base.effective_chat.bot.token)
 
     tb.my_bot.threadlocal.dispatcher = dispatcher
     tb.my_bot.threadlocal.update = update
@@ -64,3 +83,10 @@ def set_thread_locals(base: Dispatcher or Bot or Update, update=None):
 
 def first(l):
     return next(iter(l), None)
+
+
+def resolve_promise(result):
+    """Wait for the result of calls queued by the message queue, so that errors are raised where the call was made"""
+    if isinstance(result, Promise):
+        return result.result()
+    return result
@@ -0,0 +1,147 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import timedelta
+from time import sleep
+from typing import Callable, Dict, Iterator, List
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from bot.models.job import Job
+from bot.utils.db import db_pool
+
+logger = logging.getLogger('Jobs')
+
+# Seconds a running job is reserved for its runner. Every progress report renews the lease, a job whose runner did not
+# report for this long, e.g. because the process crashed, is continued from its last checkpoint by another runner.
+JOB_LEASE = 300
+JOB_MAX_ATTEMPTS = 5
+JOB_POLL_INTERVAL = 2
+
+
+@dataclass
+class Progress:
+    """Reported by job handlers, the checkpoint is handed back to the handler when the job is continued"""
+    done: int
+    total: int or None = None
+    checkpoint: dict or None = None
+    message: str = ''
+    result: str or None = None
+
+
+_handlers: Dict[str, Callable[[dict, dict or None], Iterator[Progress]]] = {}
+
+
+def job_handler(name: str):
+    """Register the decorated generator as handler for jobs of the given name
+
+    The handler is called with the payload of the job and its last checkpoint, None on the first run, and yields its
+    progress at least every JOB_LEASE seconds. Work up to a checkpoint must not be repeated when the handler is called
+    with it, work after it may be.
+    """
+
+    def decorator(func):
+        _handlers[name] = func
+        return func
+
+    return decorator
+
+
+def active_job(name: str, **payload) -> Job or None:
+    """Pending or running job of the given name whose payload has the given values"""
+    for job in Job.objects.filter(name=name, state__in=[Job.PENDING, Job.RUNNING]).order_by('pk'):
+        if all(job.payload.get(field) == value for field, value in payload.items()):
+            return job
+
+
+def enqueue_job(name: str, payload: dict, total: int = None, message: str = '') -> Job:
+    job = Job(name=name, total=total, message=message)
+    job.payload = payload
+    job.save()
+    return job
+
+
+class JobRunner:
+    """Runs jobs on a few threads of the current process, meant for `manage.py runjobs`
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so that multiple processes can share the job table. Every
+    claim increments the attempts of the job and later updates only go through for that attempt, so a runner which lost
+    its lease can't overwrite the progress of the runner which took over.
+    """
+
+    def __init__(self):
+        self._threads: List[threading.Thread] = []
+
+    def start(self, workers: int = 2):
+        if self._threads:
+            return
+        for index in range(workers):
+            thread = threading.Thread(target=self._run, name=f'JobRunner-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = None
+            try:
+                with db_pool.connection():
+                    job = self.claim()
+                    if job:
+                        self.execute(job)
+            except Exception as e:
+                logger.exception(e)
+
+            if not job:
+                sleep(JOB_POLL_INTERVAL)
+
+    @staticmethod
+    def claim() -> Job or None:
+        now = timezone.now()
+        with transaction.atomic():
+            job = Job.objects.select_for_update(skip_locked=True) \
+                .filter(state__in=[Job.PENDING, Job.RUNNING], available_at__lte=now, name__in=list(_handlers)) \
+                .order_by('available_at').first()
+            if job:
+                Job.objects.filter(pk=job.pk).update(state=Job.RUNNING, attempts=F('attempts') + 1,
+                                                     available_at=now + timedelta(seconds=JOB_LEASE))
+                job.refresh_from_db()
+        return job
+
+    @staticmethod
+    def execute(job: Job):
+        entries = Job.objects.filter(pk=job.pk, attempts=job.attempts, state=Job.RUNNING)
+        try:
+            for progress in _handlers[job.name](job.payload, job.checkpoint):
+                fields = {
+                    'done': progress.done,
+                    'message': progress.message,
+                    'result': progress.result,
+                    '_checkpoint': json.dumps(progress.checkpoint) if progress.checkpoint is not None else None,
+                    'available_at': timezone.now() + timedelta(seconds=JOB_LEASE),
+                    'modified': timezone.now(),
+                }
+                if progress.total is not None:
+                    fields['total'] = progress.total
+                if not entries.update(**fields):
+                    logger.warning(f'Job {job} was taken over by another runner')
+                    return
+        except Exception as e:
+            if job.attempts >= JOB_MAX_ATTEMPTS:
+                logger.exception(f'Job {job} failed {job.attempts} times, giving up')
+                entries.update(state=Job.FAILED, modified=timezone.now(), last_error=repr(e))
+            else:
+                logger.warning(f'Job {job} failed, continuing later from its last checkpoint: {e!r}')
+                entries.update(state=Job.PENDING, modified=timezone.now(), last_error=repr(e),
+                               available_at=timezone.now() + timedelta(seconds=min(2 ** job.attempts * 10, 600)))
+        else:
+            entries.update(state=Job.DONE, modified=timezone.now())
+
+
+job_runner = JobRunner()
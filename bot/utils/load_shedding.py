@@ -0,0 +1,95 @@
+import logging
+import threading
+from typing import List, Tuple
+
+from django.conf import settings
+
+from bot.utils.scheduler import BACKGROUND, EDITS, FORWARDS, LANES, TaskScheduler, task_scheduler
+
+logger = logging.getLogger('LoadShedder')
+
+# Degradation tiers, every tier also degrades what the ones below it do
+NORMAL = 0
+SKIP_WATERMARK = 1
+DELAY_FORWARDS = 2
+REJECT_BACKGROUND = 3
+TIER_NAMES = {
+    NORMAL: 'normal',
+    SKIP_WATERMARK: 'skip_watermark',
+    DELAY_FORWARDS: 'delay_forwards',
+    REJECT_BACKGROUND: 'reject_background',
+}
+
+# A tier is entered once the number of posts waiting to be edited or the seconds the oldest of them has been waiting
+# reach its thresholds. Can be overridden with LOAD_TIERS in the settings.
+DEFAULT_LOAD_TIERS = [
+    (SKIP_WATERMARK, 100, 30),
+    (DELAY_FORWARDS, 300, 120),
+    (REJECT_BACKGROUND, 600, 300),
+]
+# A tier is only left again once the backlog fell below this share of its thresholds, so it doesn't flap
+LOAD_TIER_RECOVERY = 0.5
+# Seconds forwards and background work are postponed by while they are shed
+LOAD_SHED_DELAY = 60
+
+
+class LoadShedder:
+    """Degrades the work on posts step by step when the edit backlog grows, so that the bot stays responsive
+
+    Only sees the scheduler of the current process, other processes like `manage.py runjobs` always run normally.
+    """
+
+    def __init__(self, scheduler: TaskScheduler, tiers: List[Tuple[int, int, float]] = None):
+        self.scheduler = scheduler
+        self.tiers = sorted(tiers or getattr(settings, 'LOAD_TIERS', DEFAULT_LOAD_TIERS))
+        self._tier = NORMAL
+        self._lock = threading.Lock()
+
+    @property
+    def tier(self) -> int:
+        depth = self.scheduler.pending(EDITS)
+        age = self.scheduler.waiting(EDITS)
+        with self._lock:
+            tier = NORMAL
+            for candidate, max_depth, max_age in self.tiers:
+                factor = LOAD_TIER_RECOVERY if candidate <= self._tier else 1
+                if depth >= max_depth * factor or age >= max_age * factor:
+                    tier = candidate
+
+            if tier != self._tier:
+                log = logger.warning if tier > self._tier else logger.info
+                log(f'Load tier {TIER_NAMES[self._tier]} -> {TIER_NAMES[tier]} with {depth} posts waiting up to '
+                    f'{age:.0f} seconds')
+                self._tier = tier
+        return tier
+
+    def sheds(self, tier: int) -> bool:
+        return self.tier >= tier
+
+    def sheds_lane(self, lane: str) -> bool:
+        """Whether work of the lane is postponed by LOAD_SHED_DELAY instead of run now"""
+        if lane == FORWARDS:
+            return self.sheds(DELAY_FORWARDS)
+        if lane == BACKGROUND:
+            return self.sheds(REJECT_BACKGROUND)
+        return False
+
+
+load_shedder = LoadShedder(task_scheduler)
+
+
+def metrics() -> List[str]:
+    """The load tier and the state of the scheduler's lanes in the Prometheus text format"""
+    lines = [
+        '# HELP bot_load_tier Current degradation tier, 0 is normal',
+        '# TYPE bot_load_tier gauge',
+        f'bot_load_tier {load_shedder.tier}',
+    ]
+    for name, help_text, value in (
+            ('pending', 'Tasks waiting for a worker', task_scheduler.pending),
+            ('running', 'Tasks being run', task_scheduler.running),
+            ('waiting_seconds', 'Seconds the oldest waiting task has been waiting for', task_scheduler.waiting),
+    ):
+        lines += [f'# HELP bot_scheduler_{name} {help_text}', f'# TYPE bot_scheduler_{name} gauge']
+        lines += [f'bot_scheduler_{name}{{lane="{lane}"}} {value(lane):g}' for lane in LANES]
+    return lines
@@ -1,6 +1,7 @@
 import json
 import math
 import sys
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, IO, Tuple
@@ -17,27 +18,79 @@ class Font:
 
 
 class _Fonts(dict):
+    """Fonts of the current platform which could be opened, see settings.AVAILABLE_FONTS
+
+    Opening every font takes a while, so this happens on first access and not on import. Call `load_in_background`
+    to have them ready before they are needed.
+    """
+
     def __init__(self):
-        available_fonts = {}
-        fonts_info_file = settings.AVAILABLE_FONTS
-
-        with open(fonts_info_file) as file:
-            fonts_info = json.load(file)
-
-        sys_fonts = fonts_info.get(sys.platform, {})
-        for font_id, values in sys_fonts.get('fonts', {}).items():
-            try:
-                ImageFont.truetype(values['path'], 14)
-                available_fonts[font_id] = Font(name=values['name'], path=Path(values['path']), id=font_id)
-            except OSError:
-                continue
-
-        if 'default' not in sys_fonts or sys_fonts['default'] not in available_fonts:
-            raise OSError('Default font not defined or not available')
-
-        self.default_font: Font = available_fonts[sys_fonts['default']]
-        self.available_fonts: Dict[str, Font] = available_fonts
-        super(_Fonts, self).__init__(self.available_fonts)
+        super(_Fonts, self).__init__()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._default_font: Font = None
+        self._available_fonts: Dict[str, Font] = {}
+
+    def load(self):
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+
+            available_fonts = {}
+            fonts_info_file = settings.AVAILABLE_FONTS
+
+            with open(fonts_info_file) as file:
+                fonts_info = json.load(file)
+
+            sys_fonts = fonts_info.get(sys.platform, {})
+            for font_id, values in sys_fonts.get('fonts', {}).items():
+                try:
+                    ImageFont.truetype(values['path'], 14)
+                    available_fonts[font_id] = Font(name=values['name'], path=Path(values['path']), id=font_id)
+                except OSError:
+                    continue
+
+            if 'default' not in sys_fonts or sys_fonts['default'] not in available_fonts:
+                raise OSError('Default font not defined or not available')
+
+            self._default_font = available_fonts[sys_fonts['default']]
+            self._available_fonts = available_fonts
+            super(_Fonts, self).update(available_fonts)
+            self._loaded = True
+
+    def load_in_background(self):
+        threading.Thread(target=self.load, name='FontLoader', daemon=True).start()
+
+    @property
+    def default_font(self) -> Font:
+        self.load()
+        return self._default_font
+
+    @property
+    def available_fonts(self) -> Dict[str, Font]:
+        self.load()
+        return self._available_fonts
+
+    def __iter__(self):
+        return iter(self.available_fonts)
+
+    def __len__(self):
+        return len(self.available_fonts)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.available_fonts
+
+    def keys(self):
+        return self.available_fonts.keys()
+
+    def values(self):
+        return self.available_fonts.values()
+
+    def items(self):
+        return self.available_fonts.items()
 
     def __getitem__(self, name: str) -> Font:
         return self.get_font(name)
@@ -0,0 +1,218 @@
+import json
+import logging
+import threading
+from datetime import timedelta
+from typing import Callable, Dict, List
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, Unauthorized
+
+from bot import telegrambot as tb
+from bot.models.outbox import Outbox
+from bot.utils.db import db_pool
+from bot.utils.load_shedding import LOAD_SHED_DELAY, load_shedder
+from bot.utils.scheduler import BACKGROUND, task_scheduler
+
+logger = logging.getLogger('Outbox')
+
+OUTBOX_BATCH_SIZE = 50
+# Seconds a claimed entry is reserved for the process which claimed it, counted again when it starts. If it did not
+# finish by then, e.g. because the process was restarted, the entry is picked up again.
+OUTBOX_LEASE = 300
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_POLL_INTERVAL = 5
+OUTBOX_KEEP_FINISHED = timedelta(days=1)
+# Claimed entries waiting in the task scheduler per task their lane may run at the same time. Further entries stay in
+# the database until the lane caught up, so that claimed entries start well within their lease.
+OUTBOX_PENDING_PER_SLOT = 10
+
+_handlers: Dict[str, Callable[[Bot, dict], None]] = {}
+_executors: Dict[str, Callable[[Callable, Outbox], None]] = {}
+_lanes: Dict[str, str] = {}
+
+
+def outbox_handler(operation: str, executor: Callable[[Callable, Outbox], None] = None, lane: str = BACKGROUND):
+    """Register the decorated function as handler for outbox entries of the given operation
+
+    The handler is called with the bot and the payload of the entry. Raising marks the entry for a retry, except for
+    Unauthorized and BadRequest errors which will never go through. Handlers run in the given lane of the task
+    scheduler, a custom executor can be given instead which is called with the function to run and the entry.
+    """
+
+    def decorator(func):
+        _handlers[operation] = func
+        _lanes[operation] = lane
+        if executor:
+            _executors[operation] = executor
+        return func
+
+    return decorator
+
+
+def enqueue(operation: str, bot_token: str, key: str, payload: dict, delay: float = 0) -> bool:
+    """Add an operation to the outbox
+
+    Returns:
+        :obj:`bool`: False if an entry with the same key already existed
+    """
+    entry, created = Outbox.objects.get_or_create(key=key, defaults={
+        'bot_token': bot_token,
+        'operation': operation,
+        '_payload': json.dumps(payload),
+        'available_at': timezone.now() + timedelta(seconds=delay),
+    })
+    if created and not delay:
+        transaction.on_commit(outbox_worker.wake)
+    return created
+
+
+def _backoff(attempts: int) -> float:
+    return min(2 ** attempts, 600)
+
+
+class OutboxWorker:
+    """Drains the outbox
+
+    Due entries are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED so that multiple processes can work on the
+    same outbox, then handed to their executors. Delivery is at least once, handlers have to cope with running twice.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='OutboxWorker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Let the thread finish its current round and wait for it, entries it handed on still run"""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self.wake()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        last_cleanup = None
+        while not self._stopping.is_set():
+            claimed = []
+            try:
+                with db_pool.connection():
+                    claimed = self.claim(self.operations_with_room())
+                    shed = []
+                    for entry in claimed:
+                        if load_shedder.sheds_lane(_lanes[entry.operation]):
+                            shed.append(entry)
+                            continue
+                        executor = _executors.get(entry.operation, self._run_async)
+                        executor(self.execute, entry)
+                    if shed:
+                        self.postpone(shed, LOAD_SHED_DELAY)
+
+                    if not last_cleanup or timezone.now() - last_cleanup > timedelta(hours=1):
+                        self.cleanup()
+                        last_cleanup = timezone.now()
+            except Exception as e:
+                logger.exception(e)
+
+            if len(claimed) < OUTBOX_BATCH_SIZE:
+                self._wake.wait(OUTBOX_POLL_INTERVAL)
+                self._wake.clear()
+
+    @staticmethod
+    def _run_async(func: Callable, entry: Outbox):
+        task_scheduler.submit(_lanes[entry.operation], func, entry)
+
+    @staticmethod
+    def operations_with_room() -> List[str]:
+        """Operations whose lane can take further entries"""
+        lanes = {lane for lane in set(_lanes.values())
+                 if task_scheduler.pending(lane) < task_scheduler.limit(lane) * OUTBOX_PENDING_PER_SLOT}
+        return [operation for operation, lane in _lanes.items() if lane in lanes]
+
+    @staticmethod
+    def claim(operations: List[str] = None, batch_size: int = OUTBOX_BATCH_SIZE) -> List[Outbox]:
+        """Reserve due entries for this process
+
+        The lease the entries got is kept on them, see `begin_attempt`. Claiming is not an attempt yet, an entry may wait for
+        its lane and even be claimed again if its lease ran out in the meantime.
+        """
+        operations = list(_handlers) if operations is None else operations
+        if not operations:
+            return []
+        now = timezone.now()
+        lease = now + timedelta(seconds=OUTBOX_LEASE)
+        with transaction.atomic():
+            entries = list(Outbox.objects.select_for_update(skip_locked=True)
+                           .filter(state=Outbox.PENDING, available_at__lte=now, operation__in=operations,
+                                   bot_token__in=[bot.token for bot in tb.my_bot.bots])
+                           .order_by('available_at')[:batch_size])
+            if entries:
+                Outbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(available_at=lease)
+        for entry in entries:
+            entry.available_at = lease
+        return entries
+
+    @staticmethod
+    def begin_attempt(entry: Outbox) -> bool:
+        """Renew the lease of a claimed entry and count the attempt, False if the entry was claimed again meanwhile
+
+        The lease set by the claim works as fence, an entry which waited past it and was claimed again only runs for
+        the latest claim.
+        """
+        return bool(Outbox.objects.filter(pk=entry.pk, state=Outbox.PENDING, available_at=entry.available_at)
+                    .update(available_at=timezone.now() + timedelta(seconds=OUTBOX_LEASE),
+                            attempts=F('attempts') + 1))
+
+    @staticmethod
+    def postpone(entries: List[Outbox], delay: float):
+        """Hand entries of shed lanes back, they were not attempted"""
+        Outbox.objects.filter(pk__in=[entry.pk for entry in entries]) \
+            .update(available_at=timezone.now() + timedelta(seconds=delay))
+
+    @staticmethod
+    def execute(entry: Outbox):
+        """Run a claimed entry, executors hand it to the task scheduler which provides the database connection"""
+        if not OutboxWorker.begin_attempt(entry):
+            logger.info(f'Outbox entry {entry} was claimed again while it waited, skipping it')
+            return
+        attempts = entry.attempts + 1
+        entries = Outbox.objects.filter(pk=entry.pk)
+        try:
+            bot = tb.my_bot.get_bot(entry.bot_token)
+            _handlers[entry.operation](bot, entry.payload)
+        except RetryAfter as e:
+            entries.update(available_at=timezone.now() + timedelta(seconds=e.retry_after), last_error=str(e))
+        except (Unauthorized, BadRequest) as e:
+            logger.warning(f'Outbox entry {entry} failed: {e}')
+            entries.update(state=Outbox.FAILED, modified=timezone.now(), last_error=str(e))
+        except Exception as e:
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.exception(f'Outbox entry {entry} failed {attempts} times, giving up')
+                entries.update(state=Outbox.FAILED, modified=timezone.now(), last_error=repr(e))
+            else:
+                entries.update(available_at=timezone.now() + timedelta(seconds=_backoff(attempts)),
+                               last_error=repr(e))
+        else:
+            entries.update(state=Outbox.DONE, modified=timezone.now())
+
+    @staticmethod
+    def cleanup():
+        Outbox.objects.filter(state__in=[Outbox.DONE, Outbox.FAILED],
+                              modified__lt=timezone.now() - OUTBOX_KEEP_FINISHED) \
+            .delete()
+
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,246 @@
+import json
+import re
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Dict, Iterator, List, Set
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from bot.models.bot import Bot
+from bot.models.channel_settings import ChannelSettings
+from bot.models.media_group import MediaGroup
+from bot.models.outbox import Outbox
+from bot.models.post import Post
+from bot.models.reactions import Reaction
+from bot.models.usersettings import UserSettings
+from bot.utils.export import reaction_counts_queryset
+
+# Tables with more rows than this must not be read sequentially
+SEQ_SCAN_THRESHOLD = 1000
+SEED_BATCH_SIZE = 5000
+# Queries a single admin changelist page may take, independent of the number of rows on it
+ADMIN_QUERY_CAP = 12
+ADMIN_CHANGELISTS = [ChannelSettings, UserSettings, Reaction, Outbox]
+
+
+@dataclass
+class AuditedQuery:
+    name: str
+    queryset: Callable[[Dict], QuerySet]
+    # Queries which read whole tables by design, e.g. exports
+    full_scan: bool = False
+
+
+def _changelist(model) -> Callable[[Dict], QuerySet]:
+    """First page of the model's admin changelist in its default ordering"""
+
+    def queryset(sample: Dict) -> QuerySet:
+        ordering = list(model._meta.ordering) + ['-pk']
+        return admin.site._registry[model].get_queryset(None).order_by(*ordering)[:100]
+
+    return queryset
+
+
+QUERIES: List[AuditedQuery] = [
+    # bot.commands.BaseCommand
+    AuditedQuery('user settings of update', lambda s: UserSettings.objects.filter(
+        user_id=s['user'].user_id, bot_id=s['bot_id'])),
+    AuditedQuery('channel settings of update', lambda s: ChannelSettings.objects.filter(
+        channel_id=s['channel'].channel_id, bot_id=s['bot_id'])),
+    AuditedQuery('media group of update', lambda s: MediaGroup.objects.filter(
+        media_group_id=s['media_group'].media_group_id, bot_id=s['bot_id'])),
+    # bot.commands.auto_reaction and auto_edit
+    AuditedQuery('reactions of message', lambda s: Reaction.objects.filter(
+        message=s['reaction'].message, channel=s['channel'], bot_id=s['bot_id'])),
+    AuditedQuery('reaction of message', lambda s: Reaction.objects.filter(
+        message=s['reaction'].message, channel=s['channel'], bot_id=s['bot_id'], reaction=s['reaction'].reaction)),
+    AuditedQuery('reaction users', lambda s: s['reaction'].users.all()),
+    # bot.utils.chat and bot.commands.auto_forward
+    AuditedQuery('channel selector page', lambda s: s['user'].channels.only(
+        'id', 'channel_id', 'channel_username', 'channel_title').order_by('id')[:21]),
+    AuditedQuery('forward targets of channel', lambda s: s['channel'].forward_to.all()),
+    AuditedQuery('forward sources of channel', lambda s: s['channel'].forward_from.all()),
+    AuditedQuery('forward graph', lambda s: ChannelSettings.forward_to.through.objects.values_list(
+        'from_channelsettings__bot_id', 'from_channelsettings__channel_id', 'to_channelsettings__channel_id',
+        'to_channelsettings__zombie'), full_scan=True),
+    # bot.utils.zombies
+    AuditedQuery('zombie sweep channels', lambda s: ChannelSettings.objects.filter(
+        bot_id=s['bot_id'], pk__gt=s['channel'].pk).only('pk', 'channel_id', 'zombie').order_by('pk')[:100]),
+    AuditedQuery('zombie sweep users', lambda s: UserSettings.objects.filter(
+        bot_id=s['bot_id'], pk__gt=s['user'].pk).only('pk', 'user_id', 'zombie').order_by('pk')[:100]),
+    # bot.utils.outbox and bot.utils.forwarding
+    AuditedQuery('outbox claim', lambda s: Outbox.objects.filter(
+        state=Outbox.PENDING, available_at__lte=timezone.now(), operation__in=['forward', 'album', 'auto_edit'],
+        bot_token__in=[s['bot_token']]).order_by('available_at')[:50]),
+    AuditedQuery('outbox cleanup', lambda s: Outbox.objects.filter(
+        state__in=[Outbox.DONE, Outbox.FAILED], modified__lt=timezone.now() - timedelta(days=1))),
+    AuditedQuery('outbox album fallbacks', lambda s: Outbox.objects.filter(
+        key__in=[s['outbox'].key], state=Outbox.PENDING)),
+    AuditedQuery('outbox albums into channel', lambda s: Outbox.objects.filter(
+        key__gt=f'album:{s["bot_id"]}:{s["channel"].channel_id}:',
+        key__lt=f'album:{s["bot_id"]}:{s["channel"].channel_id};').filter(
+        Q(state=Outbox.PENDING) | Q(modified__gte=timezone.now() - timedelta(minutes=10)))),
+    AuditedQuery('posts of album', lambda s: Post.objects.filter(
+        channel__bot_id=s['bot_id'], channel__channel_id=s['channel'].channel_id, media_group_id='1')
+        .exclude(message_id__in=[1]).values_list('message_id', flat=True)),
+    # bot.utils.export
+    AuditedQuery('reaction export of channel', lambda s: reaction_counts_queryset(
+        ChannelSettings.objects.filter(pk=s['channel'].pk))),
+    AuditedQuery('reaction export', lambda s: reaction_counts_queryset(), full_scan=True),
+    # bot.admin
+    AuditedQuery('admin channels', _changelist(ChannelSettings)),
+    AuditedQuery('admin users', _changelist(UserSettings)),
+    AuditedQuery('admin reactions', _changelist(Reaction)),
+    AuditedQuery('admin outbox', _changelist(Outbox)),
+]
+
+
+def seed(scale: float = 1) -> Dict:
+    """Fill the database with a realistic amount of rows and return samples for the queries
+
+    Meant to run inside a transaction which is rolled back afterwards.
+    """
+    bots = [Bot.objects.create(token=f'audit:{index}') for index in range(3)]
+    user_count, channel_count = int(20000 * scale), int(5000 * scale)
+    reactions_per_channel = 40
+
+    def bulk(model, objects: Iterator):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= SEED_BATCH_SIZE:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+    bulk(UserSettings, (UserSettings(user_id=index, bot_id=bots[index % 3].pk, user_fullname=f'User {index}')
+                        for index in range(user_count)))
+    users = list(UserSettings.objects.filter(bot__in=bots).values_list('pk', 'bot_id'))
+    users_by_bot = {}
+    for pk, bot_id in users:
+        users_by_bot.setdefault(bot_id, []).append(pk)
+
+    bulk(ChannelSettings, (ChannelSettings(channel_id=-index - 1, bot_id=bots[index % 3].pk,
+                                           added_by_id=users_by_bot[bots[index % 3].pk][index // 12],
+                                           channel_title=f'Channel {index}', zombie=index % 50 == 0)
+                           for index in range(channel_count)))
+    channels = list(ChannelSettings.objects.filter(bot__in=bots).values_list('pk', 'bot_id'))
+
+    ChannelUsers = ChannelSettings.users.through
+    bulk(ChannelUsers, (ChannelUsers(channelsettings_id=pk, usersettings_id=users_by_bot[bot_id][(pk * 7 + i) % len(
+        users_by_bot[bot_id])]) for pk, bot_id in channels for i in range(3)))
+    Forwards = ChannelSettings.forward_to.through
+    bulk(Forwards, (Forwards(from_channelsettings_id=pk, to_channelsettings_id=channels[(index + 3) % len(channels)][0])
+                    for index, (pk, bot_id) in enumerate(channels) if index % 10 == 0))
+
+    bulk(Reaction, (Reaction(channel_id=pk, bot_id=bot_id, message=message, reaction=reaction)
+                    for pk, bot_id in channels for message in range(reactions_per_channel // 4)
+                    for reaction in ('👍', '👎', '❤', '😂')))
+    bulk(MediaGroup, (MediaGroup(media_group_id=index, message_id=index, channel_id=pk, bot_id=bot_id)
+                      for index, (pk, bot_id) in enumerate(channels)))
+    now = timezone.now()
+    bulk(Outbox, (Outbox(key=f'audit:{index}', bot_token=bots[index % 3].token, operation='forward',
+                         state=Outbox.PENDING if index % 20 == 0 else Outbox.DONE, available_at=now)
+                  for index in range(user_count)))
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    channel = ChannelSettings.objects.filter(bot_id=bots[0].pk).order_by('pk')[channel_count // 6]
+    reaction = Reaction.objects.filter(channel=channel).first()
+    return {
+        'bot_id': bots[0].pk,
+        'bot_token': bots[0].token,
+        'channel': channel,
+        'user': channel.users.first(),
+        'reaction': reaction,
+        'media_group': MediaGroup.objects.filter(channel=channel).first(),
+        'outbox': Outbox.objects.filter(state=Outbox.PENDING).first(),
+    }
+
+
+def _postgres_seq_scans(queryset: QuerySet) -> Set[str]:
+    tables = set()
+    todo = [json.loads(queryset.explain(format='json'))[0]['Plan']]
+    while todo:
+        node = todo.pop()
+        if node['Node Type'] == 'Seq Scan':
+            tables.add(node['Relation Name'])
+        todo.extend(node.get('Plans', []))
+    return tables
+
+
+_sqlite_scan = re.compile(r'\bSCAN (?:TABLE )?(\w+)(.*)$')
+
+
+def _sqlite_seq_scans(queryset: QuerySet) -> Set[str]:
+    plan = queryset.explain()
+    # A limited query which needs no sorting stops scanning as soon as it has enough rows
+    if queryset.query.high_mark is not None and 'TEMP B-TREE' not in plan:
+        return set()
+
+    tables = set()
+    for line in plan.splitlines():
+        match = _sqlite_scan.search(line)
+        if match and 'INDEX' not in match.group(2):
+            tables.add(match.group(1))
+    return tables
+
+
+def seq_scans(queryset: QuerySet) -> Set[str]:
+    """Tables the query reads sequentially according to the database's query plan"""
+    if connection.vendor == 'postgresql':
+        return _postgres_seq_scans(queryset)
+    elif connection.vendor == 'sqlite':
+        return _sqlite_seq_scans(queryset)
+    raise NotImplementedError(f'Query plans of {connection.vendor} are not supported')
+
+
+def table_rows(tables: Set[str]) -> Dict[str, int]:
+    rows = {}
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            rows[table] = cursor.fetchone()[0]
+    return rows
+
+
+def changelist_queries(model) -> int:
+    """Number of queries it takes to render the first page of the model's admin changelist"""
+    request = RequestFactory().get('/')
+    request.user = User(username='audit', is_active=True, is_staff=True, is_superuser=True)
+    with CaptureQueriesContext(connection) as context:
+        admin.site._registry[model].changelist_view(request).render()
+    return len(context.captured_queries)
+
+
+def audit(scale: float = 1, threshold: int = SEQ_SCAN_THRESHOLD, query_cap: int = ADMIN_QUERY_CAP) -> Iterator[Dict]:
+    """Seed the database, explain every audited query and roll everything back
+
+    Yields one result per query with the tables it scans sequentially and whether that is acceptable, followed by one
+    result per admin changelist with the number of queries its first page took.
+    """
+    with transaction.atomic():
+        sample = seed(scale)
+        for query in QUERIES:
+            scans = seq_scans(query.queryset(sample))
+            sizes = table_rows(scans)
+            yield {
+                'query': query.name,
+                'seq_scans': sizes,
+                'ok': query.full_scan or all(rows <= threshold for rows in sizes.values()),
+            }
+        for model in ADMIN_CHANGELISTS:
+            queries = changelist_queries(model)
+            yield {
+                'query': f'admin {model._meta.model_name} page',
+                'queries': queries,
+                'ok': queries <= query_cap,
+            }
+        transaction.set_rollback(True)
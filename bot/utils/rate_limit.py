@@ -0,0 +1,39 @@
+import threading
+from time import monotonic, sleep
+from typing import Dict, Hashable
+
+
+class RateLimiter:
+    """Thread safe token bucket rate limiter with a separate bucket per key
+
+    Allows `rate` calls per `per` seconds for each key with bursts of up to `burst` calls.
+    """
+
+    def __init__(self, rate: float, per: float = 1.0, burst: int = 1, max_keys: int = 10000):
+        self.interval = per / rate
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self.max_keys = max_keys
+
+        self._lock = threading.Lock()
+        self._next: Dict[Hashable, float] = {}
+
+    def reserve(self, key: Hashable = None) -> float:
+        """Reserve the next slot for the given key
+
+        Returns:
+            :obj:`float`: Seconds to wait before the reserved slot may be used
+        """
+        with self._lock:
+            now = monotonic()
+            if len(self._next) >= self.max_keys:
+                self._next = {k: value for k, value in self._next.items() if value > now}
+
+            next_slot = max(self._next.get(key, now), now)
+            self._next[key] = next_slot + self.interval
+            return max(next_slot - self.tolerance - now, 0)
+
+    def acquire(self, key: Hashable = None):
+        """Block until a call for the given key is allowed"""
+        wait = self.reserve(key)
+        if wait:
+            sleep(wait)
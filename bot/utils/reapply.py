@@ -0,0 +1,97 @@
+from time import sleep
+from typing import Iterator
+
+from telegram import Update
+from telegram.error import RetryAfter
+
+from bot import telegrambot as tb
+from bot.models.channel_settings import ChannelSettings
+from bot.models.post import Post
+from bot.utils.internal import set_thread_locals
+from bot.utils.jobs import Progress, active_job, enqueue_job, job_handler
+from bot.utils.rate_limit import RateLimiter
+
+REAPPLY_DEFAULT_POSTS = 100
+REAPPLY_MAX_POSTS = 5000
+REAPPLY_BATCH_SIZE = 50
+
+# Telegram allows about 20 edits per minute in the same channel, half of them are left to new posts
+reapply_channel_limiter = RateLimiter(rate=10, per=60, burst=1)
+# And leave most of the bot's overall limit to live traffic
+reapply_bot_limiter = RateLimiter(rate=3, per=1, burst=3)
+
+
+def enqueue_reapply(channel: ChannelSettings, posts: int = REAPPLY_DEFAULT_POSTS):
+    """Apply the current settings of the channel to its last posts in the background, see `manage.py runjobs`
+
+    Every channel gets one such job at a time, a pending or running one is returned instead of adding another.
+    """
+    job = active_job('reapply_settings', channel=channel.pk)
+    if job:
+        return job
+
+    posts = min(posts, REAPPLY_MAX_POSTS)
+    total = min(posts, channel.posts.count())
+    return enqueue_job('reapply_settings', {'channel': channel.pk, 'posts': posts}, total=total,
+                       message=f'Applying the settings of {channel.name} to its last {total} posts')
+
+
+def reapply_to_post(bot, post: Post) -> bool:
+    """Edit a post to match the current settings of its channel, returns whether it was edited
+
+    Posts which already match are skipped.
+    """
+    # Imported here as importing a command registers its handlers, which only the bot process does on startup
+    from bot.commands.auto_edit import AutoEdit
+
+    update = Update.de_json(post.update, bot)
+    set_thread_locals(bot, update)
+    instance = AutoEdit(bot, update)
+    settings_hash = instance.channel_settings.settings_hash
+    if post.settings_hash == settings_hash:
+        return False
+
+    instance.media_group_creator = post.media_group_creator
+    reapply_bot_limiter.acquire(bot.token)
+    reapply_channel_limiter.acquire(post.channel_id)
+    while True:
+        try:
+            edited = instance.edit_post(retroactive=True)
+            break
+        except RetryAfter as e:
+            sleep(e.retry_after)
+
+    if edited:
+        Post.objects.filter(pk=post.pk).update(settings_hash=settings_hash)
+    return edited
+
+
+@job_handler('reapply_settings')
+def reapply_settings_job(payload: dict, checkpoint: dict or None) -> Iterator[Progress]:
+    """Edit the last posts of a channel from the newest to the oldest, posts which are up to date are skipped"""
+    channel = ChannelSettings.objects.select_related('bot').get(pk=payload['channel'])
+    bot = tb.my_bot.get_bot(channel.bot.token)
+    if not bot:
+        raise ValueError(f'Bot of {channel.name} is not running in this process')
+
+    checkpoint = checkpoint or {'before': None, 'done': 0, 'edited': 0}
+    while checkpoint['done'] < payload['posts']:
+        posts = channel.posts.order_by('-message_id')
+        if checkpoint['before'] is not None:
+            posts = posts.filter(message_id__lt=checkpoint['before'])
+        posts = list(posts[:min(REAPPLY_BATCH_SIZE, payload['posts'] - checkpoint['done'])])
+        if not posts:
+            break
+
+        for post in posts:
+            edited = reapply_to_post(bot, post)
+            checkpoint = {
+                'before': post.message_id,
+                'done': checkpoint['done'] + 1,
+                'edited': checkpoint['edited'] + edited,
+            }
+            yield Progress(done=checkpoint['done'], checkpoint=checkpoint,
+                           message=f'{checkpoint["edited"]} of {checkpoint["done"]} posts edited')
+
+    yield Progress(done=checkpoint['done'], total=checkpoint['done'], checkpoint=checkpoint,
+                   message=f'{checkpoint["edited"]} of {checkpoint["done"]} posts edited, the others were up to date')
@@ -0,0 +1,212 @@
+import logging
+import math
+import threading
+from collections import OrderedDict, deque
+from time import monotonic
+from typing import Callable, Deque, Dict, Hashable, List, Tuple
+
+from django.conf import settings
+from telegram import Update
+from telegram.utils.promise import Promise
+
+from bot.utils.db import db_pool
+
+logger = logging.getLogger('TaskScheduler')
+
+# Lanes from the highest to the lowest priority
+CALLBACKS = 'callbacks'
+PRIVATE = 'private'
+EDITS = 'edits'
+FORWARDS = 'forwards'
+BACKGROUND = 'background'
+LANES = (CALLBACKS, PRIVATE, EDITS, FORWARDS, BACKGROUND)
+
+# Tasks a lane may run at the same time. The lower lanes together can't take all workers, so there always are workers
+# left for callbacks and private chats no matter how many posts are being rendered.
+DEFAULT_LANE_LIMITS = {
+    CALLBACKS: 8,
+    PRIVATE: 8,
+    EDITS: 4,
+    FORWARDS: 2,
+    BACKGROUND: 1,
+}
+DEFAULT_WORKERS = 12
+
+
+class _KeyQueue:
+    def __init__(self, limit: float):
+        # Tasks with the time they were submitted
+        self.tasks: Deque[Tuple[float, Promise]] = deque()
+        self.running = 0
+        self.weight = 1
+        self.limit = limit
+        self.deficit = 0
+
+
+class _Lane:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.running = 0
+        self.pending = 0
+        # Queues of the keys with pending or running tasks, and the keys with pending tasks in the order they take turns
+        self.keys: Dict[Hashable, _KeyQueue] = {}
+        self.active: Dict[Hashable, _KeyQueue] = OrderedDict()
+
+    def push(self, key: Hashable, promise: Promise, weight: int, limit: int):
+        # Tasks without a key have no order to keep, so they may all run at the same time
+        queue = self.keys.setdefault(key, _KeyQueue(limit if key is not None else math.inf))
+        if key is not None:
+            queue.weight, queue.limit = max(1, weight), max(1, limit)
+        queue.tasks.append((monotonic(), promise))
+        self.active.setdefault(key, queue)
+        self.pending += 1
+
+    def pop(self) -> (Hashable, Promise) or None:
+        """Deficit round robin: the key in front runs up to its weight of tasks before it goes to the back of the line
+
+        Keys which already run as many tasks as they may are passed over, they keep their turn for the next round.
+        """
+        for _ in range(len(self.active)):
+            key, queue = next(iter(self.active.items()))
+            if queue.running < queue.limit:
+                if queue.deficit < 1:
+                    queue.deficit += queue.weight
+                queue.deficit -= 1
+                _, task = queue.tasks.popleft()
+                queue.running += 1
+                self.pending -= 1
+                if not queue.tasks:
+                    del self.active[key]
+                    queue.deficit = 0
+                elif queue.deficit < 1:
+                    self.active.move_to_end(key)
+                return key, task
+            self.active.move_to_end(key)
+
+    def oldest(self) -> float or None:
+        return min((queue.tasks[0][0] for queue in self.active.values()), default=None)
+
+    def done(self, key: Hashable):
+        queue = self.keys[key]
+        queue.running -= 1
+        if not queue.running and not queue.tasks:
+            del self.keys[key]
+
+
+class TaskScheduler:
+    """Runs tasks on a fixed pool of threads, always picking the highest priority lane with work and a free slot
+
+    Every task runs within a connection of the database pool, see bot.utils.db.
+
+    Every lane has a limit of tasks it may run at the same time. Tasks of a lane with the same key run in order of
+    submission, by default one after another, tasks without a key may run in parallel. Keys of a lane take turns
+    according to their weight, so a key with a lot of tasks can't hold up the others.
+    """
+
+    def __init__(self, workers: int = None, limits: Dict[str, int] = None):
+        self.workers = workers or getattr(settings, 'SCHEDULER_WORKERS', DEFAULT_WORKERS)
+        limits = {**DEFAULT_LANE_LIMITS, **(limits or getattr(settings, 'SCHEDULER_LANE_LIMITS', {}))}
+
+        self._lanes: List[_Lane] = [_Lane(name, limits[name]) for name in LANES]
+        self._lanes_by_name = {lane.name: lane for lane in self._lanes}
+        if sum(lane.limit for lane in self._lanes if lane.name not in (CALLBACKS, PRIVATE)) >= self.workers:
+            logger.warning(f'Edits, forwards and background tasks can take all {self.workers} workers, callbacks and '
+                           f'private chats will wait behind them')
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        with self._condition:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'TaskScheduler-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, lane: str, func: Callable, *args, key: Hashable = None, weight: int = 1, limit: int = 1,
+               **kwargs) -> Promise:
+        """Queue a function in a lane, the returned promise resolves to its result
+
+        Args:
+            key: Tasks with the same key run in order of submission
+            weight: Tasks the key may start per turn, relative to the other keys of the lane
+            limit: Tasks of the key which may run at the same time
+        """
+        self.start()
+        promise = Promise(func, args, kwargs)
+        lane = self._lanes_by_name[lane]
+        with self._condition:
+            lane.push(key, promise, weight, limit)
+            self._condition.notify()
+        return promise
+
+    def run(self, lane: str, func: Callable, *args, key: Hashable = None, **kwargs):
+        """Run a function in a lane and wait for it, for work which has to stay in the order of the calling thread"""
+        return self.submit(lane, func, *args, key=key, **kwargs).result()
+
+    def limit(self, lane: str) -> int:
+        return self._lanes_by_name[lane].limit
+
+    def pending(self, lane: str = None) -> int:
+        with self._condition:
+            if lane:
+                return self._lanes_by_name[lane].pending
+            return sum(lane.pending for lane in self._lanes)
+
+    def running(self, lane: str = None) -> int:
+        with self._condition:
+            if lane:
+                return self._lanes_by_name[lane].running
+            return sum(lane.running for lane in self._lanes)
+
+    def waiting(self, lane: str) -> float:
+        """Seconds the oldest pending task of the lane has been waiting for"""
+        with self._condition:
+            oldest = self._lanes_by_name[lane].oldest()
+        return monotonic() - oldest if oldest is not None else 0
+
+    def _next(self) -> (_Lane, Hashable, Promise) or None:
+        for lane in self._lanes:
+            if lane.pending and lane.running < lane.limit:
+                entry = lane.pop()
+                if entry:
+                    return (lane,) + entry
+
+    def _work(self):
+        while True:
+            with self._condition:
+                entry = self._next()
+                while not entry:
+                    self._condition.wait()
+                    entry = self._next()
+                lane, key, promise = entry
+                lane.running += 1
+
+            try:
+                # The number of workers is bounded, so they don't wait for a slot of the pool. Otherwise tasks of the
+                # lower lanes holding slots could keep callbacks waiting although their lane has room.
+                with db_pool.connection(limit=False):
+                    promise.run()
+            finally:
+                with self._condition:
+                    lane.running -= 1
+                    lane.done(key)
+                    self._condition.notify_all()
+
+
+def lane_for_update(update: Update or None) -> (str, Hashable):
+    """Lane for the handling of an update and the key which keeps updates of the same chat in order"""
+    if not isinstance(update, Update):
+        return PRIVATE, None
+    if update.callback_query:
+        return CALLBACKS, update.effective_user.id if update.effective_user else None
+    chat = update.effective_chat
+    if chat and chat.type == chat.CHANNEL:
+        # Apart from the edits of the channel's posts, which have their own key and limits, see bot.commands.auto_edit
+        return EDITS, ('post', chat.id)
+    return PRIVATE, chat.id if chat else None
+
+
+task_scheduler = TaskScheduler()
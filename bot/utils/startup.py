@@ -0,0 +1,52 @@
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import List, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger('Startup')
+
+
+class StartupTimer:
+    """Records how long the phases of the startup took
+
+    The report is logged and additionally written to settings.STARTUP_REPORT if that is set.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, perf_counter() - start))
+
+    def report(self) -> str:
+        with self._lock:
+            phases = list(self.phases)
+        phases.append(('total', perf_counter() - self.started))
+        width = max(len(name) for name, _ in phases)
+        return '\n'.join(f'{name:<{width}} {duration * 1000:>10.1f} ms' for name, duration in phases)
+
+    def write_report(self):
+        report = self.report()
+        logger.info(f'Startup timings:\n{report}')
+
+        path = getattr(settings, 'STARTUP_REPORT', None)
+        if path:
+            try:
+                with open(path, 'w') as file:
+                    file.write(report + '\n')
+            except OSError as e:
+                logger.warning(f'Could not write startup report to {path}: {e}')
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,52 @@
+import logging
+import threading
+from queue import Empty, Queue
+from typing import Callable, Dict, Hashable
+
+logger = logging.getLogger('KeyedWorkers')
+
+
+class KeyedWorkers:
+    """Run jobs in parallel across keys but one after another for the same key
+
+    Every key gets its own worker thread so that a slow key never holds up the others. Threads are started on demand and
+    stop again after being idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, name: str, idle_timeout: float = 60):
+        self.name = name
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._queues: Dict[Hashable, Queue] = {}
+
+    def submit(self, key: Hashable, func: Callable, *args, **kwargs):
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = Queue()
+                threading.Thread(target=self._work, args=(key, queue), name=f'{self.name}:{key}', daemon=True).start()
+            queue.put((func, args, kwargs))
+
+    def pending(self, key: Hashable = None) -> int:
+        with self._lock:
+            if key is not None:
+                queue = self._queues.get(key)
+                return queue.qsize() if queue else 0
+            return sum(queue.qsize() for queue in self._queues.values())
+
+    def _work(self, key: Hashable, queue: Queue):
+        while True:
+            try:
+                func, args, kwargs = queue.get(timeout=self.idle_timeout)
+            except Empty:
+                with self._lock:
+                    if queue.empty():
+                        del self._queues[key]
+                        return
+                continue
+
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.exception(e)
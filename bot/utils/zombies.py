@@ -0,0 +1,159 @@
+import logging
+import threading
+from time import sleep, time
+from typing import Iterator, Tuple, Type
+
+from telegram import Bot, Chat
+from telegram.error import BadRequest, RetryAfter, Unauthorized
+
+from bot import telegrambot as tb
+from bot.models.bot import Bot as BotModel
+from bot.models.channel_settings import ChannelSettings
+from bot.models.usersettings import UserSettings
+from bot.utils.chat_cache import chat_cache
+from bot.utils.db import db_pool
+from bot.utils.jobs import Progress, active_job, enqueue_job, job_handler
+from bot.utils.outbox import enqueue, outbox_handler
+from bot.utils.rate_limit import RateLimiter
+
+logger = logging.getLogger('ZombieSweeper')
+
+# Seconds between two sweeps of the same bot, must stay below OUTBOX_KEEP_FINISHED so that the sweep of the current
+# interval is still known when another process schedules it again
+ZOMBIE_SWEEP_INTERVAL = 6 * 3600
+ZOMBIE_SWEEP_BATCH_SIZE = 100
+
+# Lookups per second and bot, leaves most of Telegram's limit to the requests of users
+sweep_limiter = RateLimiter(rate=5, per=1, burst=5)
+
+
+def sweep_batches(bot: Bot, model: Type[ChannelSettings] or Type[UserSettings], id_field: str, after: int = 0,
+                  batch_size: int = ZOMBIE_SWEEP_BATCH_SIZE) -> Iterator[Tuple[int, int, int]]:
+    """Check the rows of the bot with a pk above `after` batch by batch and update their zombie flags
+
+    A row is a zombie if its chat can't be fetched because the bot was removed or blocked. Rows whose lookup failed for
+    any other reason are left as they are.
+
+    Yields:
+        :obj:`tuple`: Pk of the last row, number of checked rows and number of changed rows of every batch
+    """
+    bot_id = BotModel.objects.id_for(bot.token)
+    last_pk = after
+    while True:
+        rows = list(model.objects.filter(bot_id=bot_id, pk__gt=last_pk)
+                    .only('pk', id_field, 'zombie')
+                    .order_by('pk')[:batch_size])
+        if not rows:
+            return
+        last_pk = rows[-1].pk
+
+        results = chat_cache.fetch_many(bot, [getattr(row, id_field) for row in rows], limiter=sweep_limiter)
+        updated = []
+        for row in rows:
+            result = results.get(getattr(row, id_field))
+            if isinstance(result, Chat):
+                zombie = False
+            elif isinstance(result, (Unauthorized, BadRequest)):
+                zombie = True
+            else:
+                continue
+
+            if zombie != row.zombie:
+                row.zombie = zombie
+                updated.append(row)
+
+        model.objects.bulk_update(updated, ['zombie'])
+        yield last_pk, len(rows), len(updated)
+
+        retry_after = max([result.retry_after for result in results.values() if isinstance(result, RetryAfter)],
+                          default=0)
+        if retry_after:
+            sleep(retry_after)
+
+
+def sweep_model(bot: Bot, model: Type[ChannelSettings] or Type[UserSettings], id_field: str,
+                batch_size: int = ZOMBIE_SWEEP_BATCH_SIZE) -> int:
+    """Check all rows of the bot and update their zombie flags
+
+    Returns:
+        :obj:`int`: Number of changed rows
+    """
+    return sum(changed for _, _, changed in sweep_batches(bot, model, id_field, batch_size=batch_size))
+
+
+SWEEP_MODELS = {
+    'channels': (ChannelSettings, 'channel_id'),
+    'users': (UserSettings, 'user_id'),
+}
+
+
+@job_handler('sweep_zombies')
+def sweep_zombies_job(payload: dict, checkpoint: dict or None) -> Iterator[Progress]:
+    """Sweep started from the admin, continues with the batch after the last one when interrupted"""
+    bot = tb.my_bot.get_bot(payload['bot_token'])
+    if not bot:
+        raise ValueError(f'Bot [{payload["bot_token"]}] is not running in this process')
+
+    checkpoint = checkpoint or {'model': 'channels', 'last': 0, 'checked': 0, 'changed': 0}
+    names = list(SWEEP_MODELS)
+    for name in names[names.index(checkpoint['model']):]:
+        model, id_field = SWEEP_MODELS[name]
+        after = checkpoint['last'] if name == checkpoint['model'] else 0
+        for last, checked, changed in sweep_batches(bot, model, id_field, after):
+            checkpoint = {
+                'model': name,
+                'last': last,
+                'checked': checkpoint['checked'] + checked,
+                'changed': checkpoint['changed'] + changed,
+            }
+            yield Progress(done=checkpoint['checked'], checkpoint=checkpoint,
+                           message=f'Checking {name}, {checkpoint["changed"]} changed so far')
+    yield Progress(done=checkpoint['checked'], total=checkpoint['checked'], checkpoint=checkpoint,
+                   message=f'{checkpoint["changed"]} of {checkpoint["checked"]} channels and users changed')
+
+
+def enqueue_sweep_job(bot_token: str):
+    bot_id = BotModel.objects.id_for(bot_token)
+    total = sum(model.objects.filter(bot_id=bot_id).count() for model, _ in SWEEP_MODELS.values())
+    return enqueue_job('sweep_zombies', {'bot_token': bot_token}, total=total)
+
+
+@outbox_handler('zombie_sweep')
+def start_sweep(bot: Bot, payload: dict):
+    """The sweep itself can take longer than an outbox lease, so it runs as a job which continues from its checkpoint
+    when interrupted, see `manage.py runjobs`"""
+    if not active_job('sweep_zombies', bot_token=bot.token):
+        enqueue_sweep_job(bot.token)
+
+
+def schedule_sweeps():
+    """Add the sweep of the current interval for every bot to the outbox, processes share the same keys"""
+    interval = int(time() // ZOMBIE_SWEEP_INTERVAL)
+    for bot in tb.my_bot.bots:
+        enqueue('zombie_sweep', bot.token, f'zombie_sweep:{BotModel.objects.id_for(bot.token)}:{interval}', {})
+
+
+class ZombieScheduler:
+    """Schedules the zombie sweeps, the outbox makes sure that only one process starts the sweep of a bot"""
+
+    def __init__(self, check_interval: float = 3600):
+        self.check_interval = check_interval
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='ZombieScheduler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with db_pool.connection():
+                    schedule_sweeps()
+            except Exception as e:
+                logger.exception(e)
+            sleep(self.check_interval)
+
+
+zombie_scheduler = ZombieScheduler()
@@ -1,17 +1,25 @@
+import os
+
 from django import forms
-from django.shortcuts import redirect
+from django.conf import settings
+from django.shortcuts import get_object_or_404, redirect
 from django.shortcuts import render
-from django.views.generic import FormView
-from django.db import transaction
+from django.urls import reverse
+from django.views.generic import FormView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import StreamingHttpResponse, HttpResponse
-from telegram.error import BadRequest
+from django.http import FileResponse, Http404, HttpResponse
+from telegram import Chat
 
-from bot.models.usersettings import UserSettings
+from bot.models.bot import Bot
 from bot.models.channel_settings import ChannelSettings
-from bot.models.reactions import Reaction
+from bot.models.job import Job
 from bot import telegrambot as tb
-from bot.utils.internal import first
+from bot.utils.chat_cache import chat_cache
+from bot.utils.jobs import enqueue_job
+from bot.utils.load_shedding import metrics
+from bot.utils.rate_limit import RateLimiter
+
+migration_limiter = RateLimiter(rate=20, per=1, burst=10)
 
 
 def redirect_to_admin_view(request):
@@ -26,8 +34,9 @@ class MigrateToBotForm(forms.Form):
 
     def choices_from_bots(self):
         for bot in tb.my_bot.bots:
-            me = bot.get_me()
-            yield (bot.token, f'{me.full_name} [@{me.username}] ({bot.token})')
+            me = tb.my_bot.identity(bot.token)
+            if me:
+                yield (bot.token, f'{me.full_name} [@{me.username}] ({bot.token})')
 
 
 class MigrateToBotView(LoginRequiredMixin, FormView):
@@ -44,14 +53,11 @@ class MigrateToBotView(LoginRequiredMixin, FormView):
 
         channels = {}
         for channel in channel_objs:
-            bot = next(iter([bot for bot in tb.my_bot.bots if bot.token == channel.bot_token]), None)
-            if not bot:
+            botuser = tb.my_bot.identity(channel.bot_token)
+            if not botuser:
                 name = f'({channel.bot_token})'
             else:
-                botuser = bot.bot
-                if not botuser:
-                    botuser = bot.get_me()
-                name = f'{botuser.full_name} [@{botuser.username}] ({bot.token})'
+                name = f'{botuser.full_name} [@{botuser.username}] ({channel.bot_token})'
 
             channels[channel] = name
 
@@ -69,81 +75,38 @@ class MigrateToBotView(LoginRequiredMixin, FormView):
         except ValueError:
             return HttpResponse('IDs not clean')
 
-        channels = ChannelSettings.objects.filter(pk__in=ids)
         form = self.form_class(self.request.POST)
-
-        bot_token = self.request.POST.get('new_bot_token')
-        for channel in channels:
-            bot = first([bot for bot in tb.my_bot.bots if bot.token == bot_token])
-            try:
-                bot.get_chat(channel.channel_id)
-            except BadRequest:
-                return HttpResponse(f'Bot is not a member of {channel.name}')
-
-        if form.is_valid():
-            return StreamingHttpResponse(self.migrate(channels, bot_token))
-        return HttpResponse('Form invalid')
-
-    def print(self, text: str) -> str:
-        return text + '\n'
-
-    def migrate(self, channels, new_bot_token) -> bool:
-        yield self.print('<pre>')
-        with transaction.atomic():
-            for channel in channels:
-                yield self.print('*' * 80)
-                yield self.print(f'Working on {channel.name} ({channel.pure_link})')
-                if channel.bot_token == new_bot_token:
-                    yield self.print('Channel already migrated')
-                    continue
-                duplicate_channels = ChannelSettings.objects.filter(channel_id=channel.channel_id,
-                                                                    bot_token=new_bot_token)
-                yield self.print(('Has' if duplicate_channels else 'Does not have') + 'duplicate channel/s')
-
-                channel.bot_token = new_bot_token
-                creator = channel.added_by
-                yield self.print(f'Migrating creator {creator.name}')
-
-                try:
-                    creator = UserSettings.objects.get(user_id=creator.user_id, bot_token=new_bot_token)
-                    yield self.print('Creator exists')
-                except UserSettings.DoesNotExist:
-                    yield self.print('Creator does not exist')
-                    creator.pk = None  # Results in a clone
-                creator.bot_token = new_bot_token
-                creator.save()
-
-                channel.added_by = creator
-
-                channel.users.clear()
-                channel.users.add(creator)
-                users = channel.users.exclude(pk=creator.pk)
-                for user in users:
-                    yield self.print(f'Migrating user {user.name}')
-                    try:
-                        user = UserSettings.objects.get(user_id=user.user_id, bot_token=new_bot_token)
-                    except UserSettings.DoesNotExist:
-                        user.pk = None  # Results in a clone
-                    user.bot_token = new_bot_token
-                    user.save()
-
-                    channel.users.add(user)
-
-                if duplicate_channels:
-                    yield self.print(f'Updateing reactions on duplicate channels')
-                    for index, reaction in enumerate(Reaction.objects.filter(channel=duplicate_channels), 1):
-                        reaction.channel = channel
-                        reaction.save()
-                        if index % 50 == 0:
-                            yield self.print(f'Reactions migrated {index}')
-                    yield self.print(f'Update all reactions from duplicates {index}')
-
-                for duplicate in duplicate_channels:
-                    yield self.print('Removing duplicate')
-                    duplicate.delete()
-
-                yield self.print('Update channel')
-                channel.save()
-                yield self.print(f'Channel {channel.name} updated')
-            yield self.print('Commiting transaction')
-        yield self.print('</pre>')
+        if not form.is_valid():
+            return HttpResponse('Form invalid')
+
+        bot_token = form.cleaned_data['new_bot_token']
+        channels = ChannelSettings.objects.filter(pk__in=ids).only('id', 'channel_id', 'channel_username',
+                                                                   'channel_title')
+        names = {channel.channel_id: channel.name for channel in channels}
+        chats = chat_cache.fetch_many(tb.my_bot.get_bot(bot_token), names, limiter=migration_limiter)
+        not_member = [name for channel_id, name in names.items() if not isinstance(chats.get(channel_id), Chat)]
+        if not_member:
+            return HttpResponse(f'Bot is not a member of {", ".join(not_member)}')
+
+        job = enqueue_job('migrate_channels', {'channels': sorted(set(ids)), 'bot_id': Bot.objects.id_for(bot_token)},
+                          total=len(set(ids)))
+        return redirect(reverse('admin:bot_job_change', args=(job.pk,)))
+
+
+class JobResultView(LoginRequiredMixin, View):
+    def get(self, request, pk: int):
+        job = get_object_or_404(Job, pk=pk, state=Job.DONE)
+        if not job.result or not os.path.isfile(job.result):
+            raise Http404('Job has no result')
+        return FileResponse(open(job.result, 'rb'), as_attachment=True, filename=os.path.basename(job.result))
+
+
+class MetricsView(View):
+    """Load of the bot process for monitoring, see bot.utils.load_shedding"""
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        provided = request.GET.get('token') or request.META.get('HTTP_AUTHORIZATION', '').replace('Bearer ', '', 1)
+        if token and provided != token:
+            return HttpResponse(status=403)
+        return HttpResponse('\n'.join(metrics()) + '\n', content_type='text/plain; version=0.0.4')